@@ -0,0 +1,80 @@
+"""A small local message broker, so several server processes can serve one chat room.
+
+Each worker process connects to the broker over a Unix socket and publishes the frames its
+own producers post; the broker relays every record to all the other workers, which fan it
+out to their local consumers. Records are length-prefixed byte strings."""
+import asyncio
+import struct
+from typing import Callable, Set
+
+_HEADER = struct.Struct("!I")
+
+
+async def read_record(reader: asyncio.StreamReader) -> bytes:
+    (length,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return await reader.readexactly(length)
+
+
+class Broker:
+    """Relays each record it receives from one client to every other client.
+
+    A client that isn't keeping up slows down the relay (and, in turn, the publisher) rather
+    than having records pile up in the broker."""
+
+    def __init__(self):
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    async def serve(self, path: str) -> asyncio.AbstractServer:
+        return await asyncio.start_unix_server(self._handle_client, path)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            while True:
+                record = await read_record(reader)
+                header = _HEADER.pack(len(record))
+                others = [other for other in self._writers if other is not writer]
+                for other in others:
+                    other.writelines([header, record])
+                for other in others:
+                    await other.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+class BrokerClient:
+    """A worker's connection to the broker.
+
+    publish() hands a record to the broker without waiting; records from other workers are
+    passed to `on_record` as they arrive."""
+
+    def __init__(self, on_record: Callable[[bytes], None]):
+        self.on_record = on_record
+        self._writer = None
+        self._reader_task = None
+
+    async def connect(self, path: str):
+        (reader, self._writer) = await asyncio.open_unix_connection(path)
+        self._reader_task = asyncio.create_task(self._read(reader))
+
+    def publish(self, record: bytes):
+        self._writer.writelines([_HEADER.pack(len(record)), record])
+
+    async def drain(self):
+        await self._writer.drain()
+
+    async def _read(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                self.on_record(await read_record(reader))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            print("Lost the connection to the broker.")
+
+    def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
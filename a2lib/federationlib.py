@@ -0,0 +1,150 @@
+"""Links between federated chat servers.
+
+Servers peer over a websocket connection. Messages cross a link in batches: one BINARY message
+holding any number of records, each a message ID (the originating node and its counter), the
+room, whether the message is binary, and the payload. Every node fans records out to its own
+consumers and forwards them to its other peers; the message IDs let it drop the copies that
+come back around a loop or by another path."""
+import asyncio
+import struct
+from typing import Awaitable, Callable, Dict, Iterator, List, Tuple
+
+from websockets.exceptions import ConnectionClosed
+
+# origin node ID, per-origin counter, binary flag, room length, payload length
+_RECORD = struct.Struct("!8sQ?BI")
+
+NODE_ID_SIZE = 8
+
+# The most a record adds to its payload (the header and a room name of up to 255 bytes), so a
+# link accepting messages of max_size + MAX_RECORD_OVERHEAD takes any record of a message
+# that's at most max_size.
+MAX_RECORD_OVERHEAD = _RECORD.size + 255
+
+
+def encode_record(origin: bytes, counter: int, room: bytes, payload: bytes,
+                  binary: bool = False) -> bytes:
+    return _RECORD.pack(origin, counter, binary, len(room), len(payload)) + room + payload
+
+def decode_batch(data: bytes) -> Iterator[Tuple[bytes, int, bytes, bytes, bool]]:
+    """Yields (origin, counter, room, payload, binary) for every record of a batch."""
+    view = memoryview(data)
+    pos = 0
+    while pos < len(data):
+        (origin, counter, binary, room_size, payload_size) = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        room = bytes(view[pos:pos + room_size])
+        pos += room_size
+        payload = bytes(view[pos:pos + payload_size])
+        pos += payload_size
+        yield (origin, counter, room, payload, binary)
+
+
+class Deduplicator:
+    """Recognizes messages a node has already seen, with a sliding window per origin node.
+
+    An origin's messages can arrive out of order when there's more than one path from it, so
+    each origin has its highest counter so far plus a bitmap of which of the `window`
+    counters below it have been seen (bit i for the highest minus i). Counters that have
+    fallen behind the window are taken as seen."""
+
+    def __init__(self, window: int = 65536):
+        self.window = window
+        self._windows: Dict[bytes, Tuple[int, int]] = {}
+
+    def seen(self, origin: bytes, counter: int) -> bool:
+        (highest, bits) = self._windows.get(origin, (0, 0))
+        if counter > highest:
+            bits = ((bits << (counter - highest)) | 1) & ((1 << self.window) - 1)
+            self._windows[origin] = (counter, bits)
+            return False
+        behind = highest - counter
+        if behind >= self.window or bits >> behind & 1:
+            return True
+        self._windows[origin] = (highest, bits | 1 << behind)
+        return False
+
+
+class PeerLink:
+    """The link to one peer server, used in both directions.
+
+    forward() only queues a record; a writer task sends what's queued in batches of at most
+    `max_batch_bytes` (a record larger than that goes on its own), so a batch never exceeds
+    what the peer accepts. Once `max_pending_bytes` are waiting, wait_writable() blocks until
+    they're sent, which is how a slow link pushes back on the local producers forwarding to
+    it. Relayed records are queued regardless, so that reading one link never waits on another.
+
+    Records are only dropped from the queue once they've been sent. The link can be run again
+    over a new connection to the same peer (set `websocket` first), and starts by resending
+    whatever was still queued when the last one closed; the peer drops any duplicates."""
+
+    def __init__(self, websocket, name: str, max_pending_bytes: int = 1024 * 1024,
+                 max_batch_bytes: int = 1024 * 1024):
+        self.websocket = websocket
+        self.name = name
+        self.max_pending_bytes = max_pending_bytes
+        self.max_batch_bytes = max_batch_bytes
+        self.forwarded = 0
+        self.received = 0
+        self._pending: List[bytes] = []
+        self._pending_bytes = 0
+        self._ready = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    def forward(self, record: bytes):
+        self._pending.append(record)
+        self._pending_bytes += len(record)
+        self.forwarded += 1
+        if self._pending_bytes >= self.max_pending_bytes:
+            self._writable.clear()
+        self._ready.set()
+
+    async def wait_writable(self):
+        await self._writable.wait()
+
+    async def run(self, on_batch: Callable[["PeerLink", bytes], Awaitable[None]]):
+        """Sends and receives until the connection closes. Each received batch is passed to
+        `on_batch`, and the next one isn't read until it returns."""
+        self._writable.set()
+        if self._pending:
+            self._ready.set()
+        writer = asyncio.create_task(self._write())
+        try:
+            async for batch in self.websocket:
+                if isinstance(batch, bytes):
+                    await on_batch(self, batch)
+        finally:
+            writer.cancel()
+            # whoever was waiting on this link mustn't wait forever
+            self._writable.set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _batch_size(self) -> Tuple[int, int]:
+        """How many of the queued records go in the next batch, and their size."""
+        count = size = 0
+        for record in self._pending:
+            if count and size + len(record) > self.max_batch_bytes:
+                break
+            count += 1
+            size += len(record)
+        return (count, size)
+
+    async def _write(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._pending:
+                    (count, size) = self._batch_size()
+                    await self.websocket.send(b"".join(self._pending[:count]))
+                    # forward() only appends, so these are still the records just sent
+                    del self._pending[:count]
+                    self._pending_bytes -= size
+                    if self._pending_bytes < self.max_pending_bytes:
+                        self._writable.set()
+        except ConnectionClosed:
+            pass
@@ -1,13 +1,17 @@
 import socket
 from collections import defaultdict
+from collections.abc import MutableMapping
 from dataclasses import dataclass, field
 from http import HTTPStatus
-from typing import Any, DefaultDict, Optional, Union
+from typing import Any, DefaultDict, Dict, Iterator, Optional, Tuple, Union
 
 # Need to keep the buffer size small to allow for proper buffering of data over the wire.
 # See https://docs.python.org/3/library/socket.html#socket.socket.recv.
 _RECV_BUFFER_SIZE = 4096
 
+# The most bytes an HTTP message head (start line and header fields) may take up.
+MAX_HEADER_SIZE = 16 * 1024
+
 
 class HttpMessage:
     version: str = "HTTP/1.1"
@@ -90,54 +94,128 @@ class HttpResponse(HttpMessage):
         return  f'{self.version} {self.status}{" " + self.msg if self.msg else ""}\r\n'
     
 
-def get_http_request(socket: socket.socket) -> HttpRequest:
-    data = socket.recv(_RECV_BUFFER_SIZE)
-    header_end = data.find(b'\r\n\r\n')
-    while header_end == -1:
-        data = socket.recv(_RECV_BUFFER_SIZE)
-        header_end = data.find(b'\r\n\r\n')
+class HttpParseError(Exception):
+    pass
 
-    (header_data, body) = (data[:header_end].decode(), data[header_end+4:])
+class HeaderMap(MutableMapping):
+    """HTTP header fields, looked up case-insensitively.
 
-    lines = header_data.strip().split('\r\n')
-    (method, url, version) = lines[0].split()
+    Like the defaultdict(str) it replaces, a missing field reads as ""."""
 
-    headers = defaultdict(str)
-    for line in lines[1:]:
-            (name, value) = line.split(":", 1)
-            headers[name] = value.strip()
+    def __init__(self, fields=None):
+        self._fields: Dict[str, Tuple[str, Any]] = {}
+        if fields:
+            self.update(fields)
 
-    if 'Content-Length' in headers: 
-        while len(body) < int(headers['Content-Length']):
-            body += socket.recv(_RECV_BUFFER_SIZE)
+    def __getitem__(self, name: str):
+        field = self._fields.get(name.lower())
+        return field[1] if field else ""
 
-    return HttpRequest(method, url, version, headers, body)
+    def __setitem__(self, name: str, value):
+        self._fields[name.lower()] = (name, value)
 
-def get_http_response(socket: socket.socket) -> HttpResponse:
-    data = socket.recv(_RECV_BUFFER_SIZE)
-    header_end = data.find(b'\r\n\r\n')
-    while header_end == -1:
-        data = socket.recv(_RECV_BUFFER_SIZE)
-        header_end = data.find(b'\r\n\r\n')
+    def __delitem__(self, name: str):
+        del self._fields[name.lower()]
+
+    def __contains__(self, name) -> bool:
+        return isinstance(name, str) and name.lower() in self._fields
+
+    def get(self, name: str, default=None):
+        field = self._fields.get(name.lower())
+        return field[1] if field else default
 
-    (header_data, body) = (data[:header_end].decode(), data[header_end+4:])
+    def __iter__(self) -> Iterator[str]:
+        return (name for (name, _) in self._fields.values())
 
-    lines = header_data.strip().split('\r\n')
-    status_comps = lines[0].split(maxsplit=2)
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+class HttpParser:
+    """Incrementally parses one HTTP message out of a byte stream.
+
+    Data is accumulated in a single bytearray and the end of the head is searched for only in
+    what's new, so a head split across any number of segments costs linear time. Header
+    fields are parsed once into a HeaderMap. Bytes that arrive after the message (e.g. the
+    first Websocket frames after a 101 response) are kept in `leftover`."""
+
+    def __init__(self, max_header_size: int = MAX_HEADER_SIZE):
+        self.max_header_size = max_header_size
+        self.buffer = bytearray()
+        self.start_line: Optional[str] = None
+        self.headers: Optional[HeaderMap] = None
+        self.body = b''
+        self.leftover = b''
+        self._scan_from = 0
+        self._body_start = 0
+
+    def feed(self, data: bytes) -> bool:
+        """Adds `data`; returns True once the whole message (head and body) has arrived."""
+        self.buffer += data
+        if self.headers is None:
+            header_end = self.buffer.find(b'\r\n\r\n', self._scan_from)
+            if header_end == -1:
+                if len(self.buffer) > self.max_header_size:
+                    raise HttpParseError(f"HTTP head is over {self.max_header_size} bytes")
+                # the terminator may straddle this chunk and the next one
+                self._scan_from = max(0, len(self.buffer) - 3)
+                return False
+            if header_end > self.max_header_size:
+                raise HttpParseError(f"HTTP head is over {self.max_header_size} bytes")
+            self._parse_head(self.buffer[:header_end].decode('latin-1'))
+            self._body_start = header_end + 4
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body_end = self._body_start + length
+        if len(self.buffer) < body_end:
+            return False
+        self.body = bytes(self.buffer[self._body_start:body_end])
+        self.leftover = bytes(self.buffer[body_end:])
+        return True
+
+    def _parse_head(self, head: str):
+        lines = head.split('\r\n')
+        self.start_line = lines[0]
+        self.headers = HeaderMap()
+        for line in lines[1:]:
+            (name, sep, value) = line.partition(":")
+            if not sep:
+                raise HttpParseError(f"Malformed header line: {line!r}")
+            self.headers[name.strip()] = value.strip()
+
+def _read_message(socket: socket.socket, max_header_size: int) -> HttpParser:
+    parser = HttpParser(max_header_size)
+    while True:
+        data = socket.recv(_RECV_BUFFER_SIZE)
+        if not data:
+            raise ConnectionError("Connection closed before the HTTP message was complete")
+        if parser.feed(data):
+            return parser
+
+def read_http_request(socket: socket.socket,
+                      max_header_size: int = MAX_HEADER_SIZE) -> Tuple[HttpRequest, bytes]:
+    """Reads one request; returns it along with any bytes received after it."""
+    parser = _read_message(socket, max_header_size)
+    (method, url, _) = parser.start_line.split()
+    return HttpRequest(method, url, parser.headers, parser.body or None), parser.leftover
+
+def read_http_response(socket: socket.socket,
+                       max_header_size: int = MAX_HEADER_SIZE) -> Tuple[HttpResponse, bytes]:
+    """Reads one response; returns it along with any bytes received after it."""
+    parser = _read_message(socket, max_header_size)
+    status_comps = parser.start_line.split(maxsplit=2)
     if len(status_comps) == 3:
         (_, status, msg) = status_comps
     else:
         (_, status) = status_comps
         msg = ""
     status = HTTPStatus(int(status))
+    return HttpResponse(status, msg, parser.headers, parser.body or None), parser.leftover
 
-    headers = defaultdict(str)
-    for line in lines[1:]:
-            (name, value) = line.split(":", 1)
-            headers[name] = value.strip()
-
-    if 'Content-Length' in headers: 
-        while len(body) < int(headers['Content-Length']):
-            body += socket.recv(_RECV_BUFFER_SIZE)
+def get_http_request(socket: socket.socket) -> HttpRequest:
+    return read_http_request(socket)[0]
 
-    return HttpResponse(status, msg, headers, body)
+def get_http_response(socket: socket.socket) -> HttpResponse:
+    return read_http_response(socket)[0]
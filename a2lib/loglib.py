@@ -0,0 +1,269 @@
+"""A durable, segmented, append-only message log.
+
+Every message gets the next offset. The log is a directory of segment files named after the
+offset of their first message, each with a sparse index of (offset, file position) pairs
+written every `index_interval` bytes. Appends are buffered and written with a single write()
+per flush; how often the data is also fsync()ed is a policy. Reads map the segments into
+memory and walk records from the closest index entry, without reading anything else in.
+
+Old segments are deleted once the log is over `retention_bytes` or they're older than
+`retention_seconds`; the active segment is never deleted."""
+import bisect
+import mmap
+import os
+import struct
+import time
+from typing import List, Tuple
+
+# offset, payload length, binary flag
+_RECORD = struct.Struct("!QI?")
+# offset relative to the segment's base, position in the segment
+_INDEX_ENTRY = struct.Struct("!II")
+
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+FSYNC_POLICIES = [FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER]
+
+
+class _Segment:
+    """One log file and its index."""
+
+    def __init__(self, directory: str, base: int):
+        self.base = base
+        self.path = os.path.join(directory, f"{base:020d}.log")
+        self.index_path = os.path.join(directory, f"{base:020d}.index")
+        self.index: List[Tuple[int, int]] = []  # (offset, position)
+        self.size = 0
+        self.last_indexed = -1
+        self.next_offset = base
+        self._map = None
+        self._mapped_size = 0
+
+    def load_index(self):
+        try:
+            with open(self.index_path, "rb") as index:
+                data = index.read()
+        except FileNotFoundError:
+            data = b""
+        usable = len(data) - len(data) % _INDEX_ENTRY.size
+        self.index = [(self.base + relative, position)
+                      for (relative, position) in _INDEX_ENTRY.iter_unpack(data[:usable])]
+
+    def view(self) -> memoryview:
+        """The segment's flushed contents, mapped into memory (and remapped as it grows)."""
+        if self._map is None or self._mapped_size != self.size:
+            self.close_map()
+            if self.size == 0:
+                return memoryview(b"")
+            with open(self.path, "rb") as segment:
+                self._map = mmap.mmap(segment.fileno(), self.size, access=mmap.ACCESS_READ)
+            self._mapped_size = self.size
+        return memoryview(self._map)
+
+    def close_map(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # a reader still holds a view; it's released with the last reference
+            self._map = None
+
+
+class MessageLog:
+    """An append-only log of (offset, payload, binary) records in `directory`.
+
+    append() only buffers; the buffer is written out by flush(), once it holds `flush_bytes`,
+    or by whoever owns the log (once per event loop iteration, say), so many appends share
+    one write() and, with the "always" fsync policy, one fsync()."""
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024,
+                 index_interval: int = 4096, fsync: str = FSYNC_INTERVAL,
+                 fsync_interval: float = 1.0, retention_bytes: int = 0,
+                 retention_seconds: float = 0.0, flush_bytes: int = 256 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.retention_bytes = retention_bytes
+        self.retention_seconds = retention_seconds
+        self.flush_bytes = flush_bytes
+        self._segments: List[_Segment] = []
+        self._bases: List[int] = []
+        self._buffer = bytearray()
+        self._index_buffer = bytearray()
+        self._fd = None
+        self._index_fd = None
+        self._last_fsync = time.monotonic()
+        self._unsynced = False
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    @property
+    def first_offset(self) -> int:
+        return self._segments[0].base
+
+    @property
+    def next_offset(self) -> int:
+        return self._segments[-1].next_offset
+
+    @property
+    def size(self) -> int:
+        return sum(segment.size for segment in self._segments) + len(self._buffer)
+
+    def _open(self):
+        bases = sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                       if name.endswith(".log") and name[:-4].isdigit())
+        for base in bases or [1]:
+            segment = _Segment(self.directory, base)
+            segment.load_index()
+            segment.size = os.path.getsize(segment.path) if os.path.exists(segment.path) else 0
+            self._segments.append(segment)
+            self._bases.append(base)
+        for (segment, following) in zip(self._segments, self._segments[1:]):
+            segment.next_offset = following.base
+        self._recover(self._segments[-1])
+        self._open_active()
+        self.apply_retention()
+
+    def _recover(self, segment: _Segment):
+        """Finds where the active segment really ends, dropping a torn last record (and any
+        index entries past it) left by a crash."""
+        view = segment.view()
+        end = len(view)
+        # the index may have reached the disk ahead of the records it points to
+        segment.index = [entry for entry in segment.index if entry[1] < end]
+        (offset, position) = segment.index[-1] if segment.index else (segment.base, 0)
+        while end - position >= _RECORD.size:
+            (record_offset, length, _) = _RECORD.unpack_from(view, position)
+            if record_offset != offset or end - position - _RECORD.size < length:
+                break
+            position += _RECORD.size + length
+            offset += 1
+        view.release()
+        segment.close_map()
+        if position < segment.size:
+            os.truncate(segment.path, position)
+        segment.size = position
+        segment.next_offset = offset
+        segment.index = [entry for entry in segment.index if entry[1] < position]
+        with open(segment.index_path, "wb") as index:
+            index.write(b"".join(_INDEX_ENTRY.pack(o - segment.base, p) for (o, p) in segment.index))
+        segment.last_indexed = segment.index[-1][1] if segment.index else -1
+
+    def _open_active(self):
+        segment = self._segments[-1]
+        self._fd = os.open(segment.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._index_fd = os.open(segment.index_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def append(self, offset: int, payload: bytes, binary: bool = False):
+        """Buffers the record for `offset`, which has to be next_offset."""
+        segment = self._segments[-1]
+        if offset != segment.next_offset:
+            raise ValueError(f"expected offset {segment.next_offset}, got {offset}")
+        position = segment.size + len(self._buffer)
+        if segment.last_indexed < 0 or position - segment.last_indexed >= self.index_interval:
+            segment.index.append((offset, position))
+            segment.last_indexed = position
+            self._index_buffer += _INDEX_ENTRY.pack(offset - segment.base, position)
+        self._buffer += _RECORD.pack(offset, len(payload), binary)
+        self._buffer += payload
+        segment.next_offset += 1
+        if (len(self._buffer) >= self.flush_bytes
+                or segment.size + len(self._buffer) >= self.segment_bytes):
+            self.flush()
+
+    def flush(self):
+        """Writes out the buffered records, fsyncing as the policy says, and starts a new
+        segment once the active one is full."""
+        if self._buffer:
+            segment = self._segments[-1]
+            os.write(self._fd, self._buffer)
+            self._unsynced = True
+            segment.size += len(self._buffer)
+            self._buffer.clear()
+            if self._index_buffer:
+                os.write(self._index_fd, self._index_buffer)
+                self._index_buffer.clear()
+            now = time.monotonic()
+            if self.fsync == FSYNC_ALWAYS or (self.fsync == FSYNC_INTERVAL
+                                             and now - self._last_fsync >= self.fsync_interval):
+                os.fsync(self._fd)
+                self._last_fsync = now
+                self._unsynced = False
+            if segment.size >= self.segment_bytes:
+                self._roll()
+
+    def sync(self):
+        """fsyncs what was written since the last fsync. With the "interval" policy, writes are
+        only fsynced as part of a later flush, so a log that's gone quiet needs this."""
+        if self._unsynced and self.fsync != FSYNC_NEVER:
+            os.fsync(self._fd)
+            self._last_fsync = time.monotonic()
+            self._unsynced = False
+
+    def _roll(self):
+        if self.fsync != FSYNC_NEVER:
+            os.fsync(self._fd)
+            os.fsync(self._index_fd)
+        self._unsynced = False
+        os.close(self._fd)
+        os.close(self._index_fd)
+        segment = _Segment(self.directory, self.next_offset)
+        self._segments.append(segment)
+        self._bases.append(segment.base)
+        self._open_active()
+        self.apply_retention()
+
+    def apply_retention(self):
+        """Deletes the oldest finished segments while the log is over its size limit, and any
+        finished segment last written more than retention_seconds ago."""
+        now = time.time()
+        while len(self._segments) > 1:
+            oldest = self._segments[0]
+            too_big = self.retention_bytes and self.size > self.retention_bytes
+            too_old = (self.retention_seconds
+                       and now - os.path.getmtime(oldest.path) > self.retention_seconds)
+            if not (too_big or too_old):
+                break
+            oldest.close_map()
+            for path in [oldest.path, oldest.index_path]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            del self._segments[0]
+            del self._bases[0]
+
+    def read(self, offset: int, max_bytes: int = 256 * 1024) -> List[Tuple[int, memoryview, bool]]:
+        """Up to about `max_bytes` of records from `offset` on (or from the oldest one still
+        kept), as (offset, payload, binary) with payloads that are views of the mapped
+        segment. Returns an empty list once there's nothing past `offset`."""
+        self.flush()
+        offset = max(offset, self.first_offset)
+        if offset >= self.next_offset:
+            return []
+        segment = self._segments[bisect.bisect_right(self._bases, offset) - 1]
+        i = bisect.bisect_right(segment.index, (offset, float("inf"))) - 1
+        (current, position) = segment.index[i] if i >= 0 else (segment.base, 0)
+        view = segment.view()
+        records = []
+        taken = 0
+        while position < len(view) and taken < max_bytes:
+            (current, length, binary) = _RECORD.unpack_from(view, position)
+            position += _RECORD.size
+            if current >= offset:
+                records.append((current, view[position:position + length], binary))
+                taken += _RECORD.size + length
+            position += length
+        return records
+
+    def close(self):
+        self.flush()
+        if self.fsync != FSYNC_NEVER:
+            os.fsync(self._fd)
+        os.close(self._fd)
+        os.close(self._index_fd)
+        for segment in self._segments:
+            segment.close_map()
@@ -0,0 +1,28 @@
+"""Token buckets, for holding a sender to an average rate while letting it burst.
+
+A bucket fills at `rate` tokens a second up to `burst` tokens, and every message (or byte) takes
+one. Charges are never refused: a bucket that's short goes into debt, and the charge returns
+how long it takes to pay that back, which is how long the sender should wait before the next
+one. So a message larger than the burst still gets through, it just costs its sender longer."""
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Allows `rate` units a second on average, in bursts of up to `burst` units."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+
+    def charge(self, amount: float, now: Optional[float] = None) -> float:
+        """Takes `amount` tokens and returns how many seconds the bucket will be in debt for
+        (0.0 if it had enough)."""
+        if now is None:
+            now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
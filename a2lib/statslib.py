@@ -0,0 +1,124 @@
+"""Low-overhead latency histograms and counters, plus the message stamps they're fed from.
+
+Instrumented producers prefix every message with a stamp holding a sequence number and the
+send time. Consumers use it to measure end-to-end latency and spot gaps in the sequence."""
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+# Values below 2 * _SUB_BUCKETS are counted exactly; above that, each power of two is split
+# into _SUB_BUCKETS buckets, so a recorded value is off by at most 1/_SUB_BUCKETS (~3%).
+_SUB_BUCKET_BITS = 5
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+
+# Wraps the "<seq>:<send time in ns>" stamp at the front of an instrumented message.
+STAMP_MARK = b"\x1e"
+
+
+class Histogram:
+    """A log-linear (HDR-style) histogram of non-negative integers.
+
+    Recording is a couple of integer operations and a list increment, with a fixed amount of
+    memory regardless of how many values are recorded."""
+
+    def __init__(self):
+        self.counts = [0] * (2 * _SUB_BUCKETS + 64 * _SUB_BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    @staticmethod
+    def _index(value: int) -> int:
+        if value < 2 * _SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - _SUB_BUCKET_BITS - 1
+        return _SUB_BUCKETS * shift + (value >> shift)
+
+    @staticmethod
+    def _value(index: int) -> int:
+        """The lowest value counted in bucket `index`."""
+        if index < 2 * _SUB_BUCKETS:
+            return index
+        shift = index // _SUB_BUCKETS - 1
+        return (index - _SUB_BUCKETS * shift) << shift
+
+    def record(self, value: int):
+        if value < 0:
+            value = 0
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def percentile(self, pct: float) -> int:
+        if not self.count:
+            return 0
+        rank = max(1, round(self.count * pct / 100))
+        seen = 0
+        for (index, n) in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def reset(self):
+        self.__init__()
+
+    def summary(self) -> str:
+        if not self.count:
+            return "n=0"
+        return (f"n={self.count} min={self.min} p50={self.percentile(50)} "
+                f"p90={self.percentile(90)} p99={self.percentile(99)} "
+                f"p99.9={self.percentile(99.9)} max={self.max} mean={self.total / self.count:.1f}")
+
+
+class Stats:
+    """A named set of histograms and counters, dumped together."""
+
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.started = time.monotonic()
+
+    def histogram(self, name: str) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        return histogram
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def report(self) -> str:
+        lines = [f"Stats after {time.monotonic() - self.started:.1f}s:"]
+        for (name, value) in sorted(self.counters.items()):
+            lines.append(f"  {name}: {value}")
+        for (name, histogram) in sorted(self.histograms.items()):
+            lines.append(f"  {name}: {histogram.summary()}")
+        return "\n".join(lines)
+
+
+def stamp(payload: bytes, seq: int) -> bytes:
+    """Prefixes `payload` with a stamp holding `seq` and the current time."""
+    return b"%s%d:%d%s%s" % (STAMP_MARK, seq, time.time_ns(), STAMP_MARK, payload)
+
+def parse_stamp(data: bytes) -> Optional[Tuple[bytes, int, int, bytes]]:
+    """Finds the stamp in a (possibly prefixed) message.
+
+    Returns (text before the stamp, seq, send time in ns, message without the stamp), or None
+    if `data` isn't stamped."""
+    start = data.find(STAMP_MARK)
+    if start == -1:
+        return None
+    end = data.find(STAMP_MARK, start + 1)
+    if end == -1:
+        return None
+    try:
+        (seq, sent) = data[start + 1:end].split(b":")
+        return (data[:start], int(seq), int(sent), data[:start] + data[end + 1:])
+    except ValueError:
+        return None
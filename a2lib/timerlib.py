@@ -0,0 +1,73 @@
+"""A hashed timer wheel, for keeping track of many coarse timeouts with one timer.
+
+Scheduling and cancelling are a couple of dict operations, whatever the number of timeouts,
+and the event loop only wakes up once per tick to expire everything that's due in a batch.
+That suits heartbeats and idle timeouts for thousands of connections, where being a tick late
+doesn't matter but a timer (or a sleeping task) per connection costs memory and wakeups."""
+import asyncio
+import math
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+
+class TimerWheel:
+    """Calls `on_expire` with the list of keys whose timeouts fell due during each tick.
+
+    A timeout lands in slot (due tick % slots); one further than a full turn of the wheel
+    stays put until the wheel comes round to its due tick."""
+
+    def __init__(self, on_expire: Callable[[List[Hashable]], Any], tick: float = 1.0,
+                 slots: int = 512):
+        self.on_expire = on_expire
+        self.tick = tick
+        self.wakeups = 0
+        self.expired = 0
+        self._slots: List[Dict[Hashable, int]] = [{} for _ in range(slots)]
+        self._slot_of: Dict[Hashable, int] = {}
+        self._now = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._started = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._started = self._loop.time()
+        self._arm()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def schedule(self, key: Hashable, delay: float):
+        """(Re)sets the timeout of `key` to `delay` seconds from now, rounded up to a tick."""
+        self.cancel(key)
+        due = self._now + max(1, math.ceil(delay / self.tick))
+        slot = due % len(self._slots)
+        self._slots[slot][key] = due
+        self._slot_of[key] = slot
+
+    def cancel(self, key: Hashable):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def _arm(self):
+        # scheduled against the start time, so ticks don't drift; a late tick is caught up
+        # with the next ones firing straight away
+        self._timer = self._loop.call_at(self._started + (self._now + 1) * self.tick, self._tick)
+
+    def _tick(self):
+        self._now += 1
+        self.wakeups += 1
+        slot = self._slots[self._now % len(self._slots)]
+        expired = [key for (key, due) in slot.items() if due <= self._now]
+        for key in expired:
+            del slot[key]
+            del self._slot_of[key]
+        self._arm()
+        if expired:
+            self.expired += len(expired)
+            self.on_expire(expired)
@@ -2,8 +2,23 @@
 
 Leverages and exposes some approved components of the websocket library."""
 
+import os
+import struct
+import zlib
 from threading import Timer
+from typing import Iterator, List, Optional
 
+try:
+    import numpy as _np
+except ImportError:  # NumPy is optional; masking falls back to int.from_bytes().
+    _np = None
+
+try:
+    from websockets.speedups import apply_mask as _speedups_apply_mask
+except ImportError:  # websockets was installed without its C extension
+    _speedups_apply_mask = None
+
+from websockets import exceptions as _exceptions
 from websockets import frames as _frames
 from websockets.streams import StreamReader as _StreamReader
 
@@ -19,6 +34,26 @@ Frame = _frames.Frame
 Opcode = _frames.Opcode
 Close = _frames.Close
 CloseCode = _frames.CloseCode
+ProtocolError = _exceptions.ProtocolError
+PayloadTooBig = _exceptions.PayloadTooBig
+
+# Payloads at least this large are masked with NumPy, when it's installed. Below it, a single
+# int.from_bytes() XOR is as fast and has no array setup cost.
+NUMPY_MASK_THRESHOLD = 1024
+
+# Size of the receive buffer FrameDecoder.recv_from() reads into. Large enough that a single
+# recv_into() can pick up a whole burst of broadcast frames.
+RECV_INTO_SIZE = 64 * 1024
+
+# Large messages go out as fragments of this size, so neither end has to hold a whole frame of
+# an arbitrarily large message before it can do anything with it.
+FRAGMENT_SIZE = 64 * 1024
+
+# permessage-deflate (RFC 7692) defaults. Payloads shorter than DEFLATE_MIN_SIZE are sent as
+# they are: a few dozen bytes barely shrink, if at all, and aren't worth the CPU.
+DEFLATE_MIN_SIZE = 32
+DEFLATE_MAX_WINDOW_BITS = 15
+_DEFLATE_TAIL = b"\x00\x00\xff\xff"
 
 
 def parse_frame(data: bytes, mask=False) -> Frame:
@@ -44,10 +79,259 @@ def parse_close(frame: Frame) -> Close:
         return None
     return Close.parse(frame.data)
     
-def serialize_frame(frame: Frame, mask: bool = True) -> bytes:  
-    """Serializes a frame. Masks by default (required for client frames)."""      
-    return frame.serialize(mask=mask)
+def apply_mask(data: bytes, mask: bytes) -> bytes:
+    """XORs `data` with the repeating 4-byte `mask`, a whole payload (or word array) at a time
+    rather than byte by byte."""
+    length = len(data)
+    if _np is not None and length >= NUMPY_MASK_THRESHOLD:
+        words = length // 4
+        masked = _np.frombuffer(data, dtype="<u4", count=words) ^ _np.frombuffer(mask, dtype="<u4")[0]
+        tail = bytes(b ^ m for b, m in zip(data[words * 4:], mask))
+        return masked.tobytes() + tail
+    key = mask * (length // 4 + 1)
+    return (int.from_bytes(data, "little") ^ int.from_bytes(key[:length], "little")).to_bytes(length, "little")
+
+# websockets' C extension still beats both paths above, so it's used whenever it's installed.
+_mask = _speedups_apply_mask or apply_mask
+
+def serialize_frame(frame: Frame, mask: bool = True, deflate=None) -> bytes:  
+    """Serializes a frame. Masks by default (required for client frames).
+
+    With a negotiated PerMessageDeflate, data frames are compressed on the way."""      
+    frame.check()
+    if deflate is not None:
+        frame = deflate.encode(frame)
+    head1 = ((0x80 if frame.fin else 0) | (0x40 if frame.rsv1 else 0)
+             | (0x20 if frame.rsv2 else 0) | (0x10 if frame.rsv3 else 0) | frame.opcode)
+    head2 = 0x80 if mask else 0
+    length = len(frame.data)
+    if length < 126:
+        header = struct.pack("!BB", head1, head2 | length)
+    elif length < 65536:
+        header = struct.pack("!BBH", head1, head2 | 126, length)
+    else:
+        header = struct.pack("!BBQ", head1, head2 | 127, length)
+    if mask:
+        mask_bits = os.urandom(4)
+        return header + mask_bits + _mask(frame.data, mask_bits)
+    return header + frame.data
+
+def fragment(opcode: Opcode, payload: bytes, fragment_size: int = FRAGMENT_SIZE) -> Iterator[Frame]:
+    """Splits a message into frames of at most `fragment_size` bytes: an `opcode` frame
+    followed by CONT frames, the last of them with FIN set."""
+    for start in range(0, max(len(payload), 1), fragment_size):
+        end = start + fragment_size
+        yield Frame(opcode if start == 0 else Opcode.CONT, payload[start:end], end >= len(payload))
+
+def read_fragments(reader, opcode: Opcode, fragment_size: int = FRAGMENT_SIZE) -> Iterator[Frame]:
+    """Like fragment(), for a message read from a binary file object as it's sent. No more
+    than two fragments are held at a time, whatever the size of the file."""
+    chunk = reader.read(fragment_size)
+    while True:
+        following = reader.read(fragment_size) if chunk else b''
+        yield Frame(opcode, chunk, not following)
+        if not following:
+            return
+        (opcode, chunk) = (Opcode.CONT, following)
+
+def serialize_message(opcode: Opcode, payload: bytes, fragment_size: int = FRAGMENT_SIZE,
+                      mask: bool = True, deflate=None) -> bytes:
+    """Serializes a whole message, fragmented if it's larger than `fragment_size`."""
+    if len(payload) <= fragment_size:
+        return serialize_frame(Frame(opcode, payload), mask, deflate)
+    return b"".join(serialize_frame(frame, mask, deflate)
+                    for frame in fragment(opcode, payload, fragment_size))
 
 def wrap_close(close: Close) -> bytes:
     """Wraps a Close object with the appropriate frame."""
-    return Frame(Opcode.CLOSE, close.serialize())
\ No newline at end of file
+    return Frame(Opcode.CLOSE, close.serialize())
+
+class PerMessageDeflate:
+    """The permessage-deflate state of one end of a connection: a compressor for the messages
+    it sends and a decompressor for the ones it receives.
+
+    With context takeover (the default) the zlib dictionary carries over from one message to
+    the next, so repetitive chat traffic keeps getting cheaper; `*_no_context_takeover` starts
+    every message from scratch instead. Messages under `min_size` bytes aren't compressed."""
+
+    def __init__(self, local_no_context_takeover=False, remote_no_context_takeover=False,
+                 local_max_window_bits=DEFLATE_MAX_WINDOW_BITS,
+                 remote_max_window_bits=DEFLATE_MAX_WINDOW_BITS,
+                 min_size=DEFLATE_MIN_SIZE, level=6, mem_level=8):
+        self.local_no_context_takeover = local_no_context_takeover
+        self.remote_no_context_takeover = remote_no_context_takeover
+        self.local_max_window_bits = local_max_window_bits
+        self.remote_max_window_bits = remote_max_window_bits
+        self.min_size = min_size
+        self.level = level
+        self.mem_level = mem_level
+        self._compressor = None
+        self._decompressor = None
+        self._encoding = False
+        self._decoding = False
+        self._decoded_size = 0
+
+    def encode(self, frame: Frame) -> Frame:
+        """Compresses an outgoing data frame (or fragment), leaving control frames alone."""
+        if frame.opcode in (Opcode.TEXT, Opcode.BINARY):
+            self._encoding = len(frame.data) >= self.min_size
+            if self._encoding and (self._compressor is None or self.local_no_context_takeover):
+                self._compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                                    -self.local_max_window_bits, self.mem_level)
+        elif frame.opcode is not Opcode.CONT:
+            return frame
+        if not self._encoding:
+            return frame
+        data = self._compressor.compress(frame.data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if frame.fin and data.endswith(_DEFLATE_TAIL):
+            data = data[:-4]
+        return Frame(frame.opcode, data, frame.fin, rsv1=frame.opcode is not Opcode.CONT)
+
+    def decode(self, frame: Frame, max_size: Optional[int] = None) -> Frame:
+        """Decompresses an incoming data frame (or fragment) if it was sent compressed.
+
+        Given `max_size`, raises PayloadTooBig as soon as the message inflates past it, without
+        inflating any more of it than that."""
+        if frame.opcode in (Opcode.TEXT, Opcode.BINARY):
+            self._decoding = frame.rsv1
+            self._decoded_size = 0
+            if self._decoding and (self._decompressor is None or self.remote_no_context_takeover):
+                self._decompressor = zlib.decompressobj(-self.remote_max_window_bits)
+        elif frame.opcode is not Opcode.CONT or frame.rsv1:
+            return frame
+        if not self._decoding:
+            return frame
+        data = self._inflate(frame.data, max_size)
+        if frame.fin:
+            data += self._inflate(_DEFLATE_TAIL, max_size)
+        return Frame(frame.opcode, data, frame.fin)
+
+    def _inflate(self, data: bytes, max_size: Optional[int]) -> bytes:
+        if max_size is None:
+            return self._decompressor.decompress(data)
+        # one byte over what's left tells a message that's too big from one that just fits
+        data = self._decompressor.decompress(data, max_size - self._decoded_size + 1)
+        self._decoded_size += len(data)
+        if self._decoded_size > max_size or self._decompressor.unconsumed_tail:
+            self._decompressor = None  # its state is partway through a message
+            raise PayloadTooBig(f"message inflated past {max_size} bytes")
+        return data
+
+def deflate_offer(no_context_takeover=False) -> str:
+    """The Sec-WebSocket-Extensions value a client sends to offer permessage-deflate."""
+    offer = "permessage-deflate; client_max_window_bits"
+    if no_context_takeover:
+        offer += "; client_no_context_takeover"
+    return offer
+
+def accept_deflate(header: str, min_size=DEFLATE_MIN_SIZE) -> Optional[PerMessageDeflate]:
+    """A client's PerMessageDeflate for the server's Sec-WebSocket-Extensions response, or
+    None if the server didn't agree to permessage-deflate."""
+    for extension in header.split(","):
+        (name, *params) = [param.strip() for param in extension.split(";")]
+        if name != "permessage-deflate":
+            continue
+        settings = {}
+        for param in params:
+            (key, _, value) = param.partition("=")
+            settings[key.strip()] = value.strip().strip('"')
+        try:
+            return PerMessageDeflate(
+                local_no_context_takeover="client_no_context_takeover" in settings,
+                remote_no_context_takeover="server_no_context_takeover" in settings,
+                local_max_window_bits=int(settings.get("client_max_window_bits") or DEFLATE_MAX_WINDOW_BITS),
+                remote_max_window_bits=int(settings.get("server_max_window_bits") or DEFLATE_MAX_WINDOW_BITS),
+                min_size=min_size)
+        except ValueError as exc:
+            raise ProtocolError(f"invalid permessage-deflate response: {header}") from exc
+    return None
+
+class FrameDecoder:
+    """Incrementally decodes Websocket frames from a byte stream.
+
+    Unlike parse_frame(), a decoder holds on to bytes it could not use yet, so it copes with
+    several frames arriving in one segment as well as frames that are split across (or are
+    larger than) a single recv(). Keep one decoder per connection.
+
+    `data` seeds the decoder with bytes already read off the connection, such as whatever
+    followed the handshake response; its frames come out of the next feed(). Given the
+    connection's PerMessageDeflate, compressed messages are decompressed as they're decoded."""
+
+    def __init__(self, data: bytes = b'', recv_size: int = RECV_INTO_SIZE,
+                 max_size: Optional[int] = None, deflate: Optional[PerMessageDeflate] = None):
+        self.max_size = max_size
+        self.deflate = deflate
+        self._pending = bytearray(data)
+        self._recv_buffer = bytearray(recv_size)
+        self._recv_view = memoryview(self._recv_buffer)
+
+    def recv_from(self, sock) -> List[Frame]:
+        """Does a single recv_into() on `sock` and returns every frame it completed.
+
+        Raises ConnectionError if the peer has closed the connection."""
+        n = sock.recv_into(self._recv_view)
+        if n == 0:
+            raise ConnectionError("Connection closed by peer")
+        return self.feed(self._recv_view[:n])
+
+    async def sock_recv(self, loop, sock) -> List[Frame]:
+        """The same as recv_from(), for a non-blocking socket driven by an asyncio loop."""
+        n = await loop.sock_recv_into(sock, self._recv_view)
+        if n == 0:
+            raise ConnectionError("Connection closed by peer")
+        return self.feed(self._recv_view[:n])
+
+    def feed(self, data) -> List[Frame]:
+        """Adds `data` to the stream and returns the (possibly empty) list of complete frames.
+
+        Partial frames are kept and finished by later calls."""
+        buf = self._pending
+        buf += data
+        end = len(buf)
+        pos = 0
+        frames = []
+        # one copy per payload, straight out of the buffer (a bytearray slice would be a second)
+        with memoryview(buf) as view:
+            while end - pos >= 2:
+                head1, head2 = buf[pos], buf[pos + 1]
+                length = head2 & 0x7F
+                offset = pos + 2
+                if length == 126:
+                    if end - offset < 2:
+                        break
+                    (length,) = struct.unpack_from("!H", buf, offset)
+                    offset += 2
+                elif length == 127:
+                    if end - offset < 8:
+                        break
+                    (length,) = struct.unpack_from("!Q", buf, offset)
+                    offset += 8
+                if self.max_size is not None and length > self.max_size:
+                    raise PayloadTooBig(f"over size limit ({length} > {self.max_size} bytes)")
+                masked = head2 & 0x80
+                if masked:
+                    if end - offset < 4:
+                        break
+                    mask_bits = bytes(view[offset:offset + 4])
+                    offset += 4
+                if end - offset < length:
+                    break
+
+                payload = bytes(view[offset:offset + length])
+                if masked:
+                    payload = _mask(payload, mask_bits)
+                try:
+                    opcode = Opcode(head1 & 0x0F)
+                except ValueError as exc:
+                    raise ProtocolError("invalid opcode") from exc
+                frame = Frame(opcode, payload, bool(head1 & 0x80),
+                              bool(head1 & 0x40), bool(head1 & 0x20), bool(head1 & 0x10))
+                if self.deflate is not None:
+                    frame = self.deflate.decode(frame, self.max_size)
+                frame.check()
+                frames.append(frame)
+                pos = offset + length
+
+        if pos:
+            del buf[:pos]
+        return frames
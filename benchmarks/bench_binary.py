@@ -0,0 +1,111 @@
+"""End-to-end benchmark: binary records vs the same records base64-encoded as text.
+
+Starts the test server, then sends the same struct-packed records through it twice: as
+BINARY messages, relayed untouched and handed to the consumer as memoryviews, and as TEXT
+messages holding base64, which the server validates as UTF-8 and prefixes with the sender's
+address, and the consumer has to strip and decode. Reports bytes on the wire, CPU per record
+on each side and the overall record rate.
+
+Run from the repository root:
+    python -m benchmarks.bench_binary --records 100000
+"""
+import argparse
+import random
+import struct
+import threading
+import time
+from base64 import b64decode, b64encode
+
+import a2lib.wslib
+from benchmarks.bench_load import _connect, _process_cpu, _start_server
+
+# sequence number, timestamp, price, quantity and a short symbol: a typical market-data tick
+_TICK = struct.Struct("!QqdI8s")
+
+
+def _ticks(count: int) -> list:
+    rng = random.Random(1)
+    symbols = [b"AAPL", b"MSFT", b"GOOG", b"AMZN", b"NVDA"]
+    return [_TICK.pack(i, time.time_ns(), rng.uniform(10, 500), rng.randrange(1, 1000),
+                       rng.choice(symbols)) for i in range(count)]
+
+
+def _consume(sock, leftover, expected: int, binary: bool, result: dict):
+    start = time.thread_time()
+    decoder = a2lib.wslib.FrameDecoder(leftover)
+    received = checksum = 0
+    while received < expected:
+        for frame in decoder.recv_from(sock):
+            if binary:
+                if frame.opcode != a2lib.wslib.Opcode.BINARY:
+                    continue
+                record = memoryview(frame.data)
+            else:
+                if frame.opcode != a2lib.wslib.Opcode.TEXT:
+                    continue
+                record = b64decode(frame.data.split(b": ", 1)[1])
+            checksum += record[0]
+            received += 1
+    result["cpu"] = time.thread_time() - start
+
+
+def _run(ticks: list, binary: bool, batch_bytes: int) -> dict:
+    server, port = _start_server([])
+    try:
+        (consumer, leftover) = _connect(port, "consumer")
+        (producer, _) = _connect(port, "producer")
+        result = {}
+        reader = threading.Thread(target=_consume,
+                                  args=(consumer, leftover, len(ticks), binary, result))
+        reader.start()
+        server_cpu = _process_cpu(server.pid)
+        start = time.perf_counter()
+        cpu = time.thread_time()
+        opcode = a2lib.wslib.Opcode.BINARY if binary else a2lib.wslib.Opcode.TEXT
+        wire = 0
+        batch = bytearray()
+        for tick in ticks:
+            payload = tick if binary else b64encode(tick)
+            batch += a2lib.wslib.serialize_frame(a2lib.wslib.Frame(opcode, payload))
+            if len(batch) >= batch_bytes:
+                producer.sendall(batch)
+                wire += len(batch)
+                batch.clear()
+        producer.sendall(batch)
+        wire += len(batch)
+        producer_cpu = time.thread_time() - cpu
+        reader.join()
+        elapsed = time.perf_counter() - start
+        if server_cpu is not None:
+            server_cpu = _process_cpu(server.pid) - server_cpu
+        producer.close()
+        consumer.close()
+    finally:
+        server.terminate()
+        server.wait()
+    count = len(ticks)
+    return {"wire": wire, "rate": count / elapsed, "producer_us": producer_cpu / count * 1e6,
+            "server_us": None if server_cpu is None else server_cpu / count * 1e6,
+            "consumer_us": result["cpu"] / count * 1e6}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Binary vs base64 text benchmark.")
+    parser.add_argument('--records', type=int, default=50000,
+                        help="records sent per mode. Defaults to 50000.")
+    parser.add_argument('--batch-bytes', type=int, default=64 * 1024,
+                        help="producer bytes per write. Defaults to 64 KiB.")
+    args = parser.parse_args()
+
+    ticks = _ticks(args.records)
+    print(f"{args.records} records of {_TICK.size} bytes")
+    print(f"{'path':>8} {'wire bytes':>11} {'records/s':>10} {'producer':>11} {'server':>11} {'consumer':>11}")
+    for (name, binary) in [("text", False), ("binary", True)]:
+        r = _run(ticks, binary, args.batch_bytes)
+        server = "n/a" if r["server_us"] is None else f"{r['server_us']:.2f} us"
+        print(f"{name:>8} {r['wire']:>11} {r['rate']:>10.0f} {r['producer_us']:>8.2f} us "
+              f"{server:>11} {r['consumer_us']:>8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
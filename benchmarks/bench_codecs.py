@@ -0,0 +1,223 @@
+"""Micro-benchmark and regression check: the wslib and httplib codecs.
+
+Runs parse_frame(), serialize_frame() (masked and unmasked), parse_close()/wrap_close(),
+HttpMessage.__bytes__() and get_http_response() over fixed corpora of frame sizes, close codes
+and header sets, and reports nanoseconds per call and the peak memory allocated by one call,
+as traced by tracemalloc. The cases are timed in several interleaved rounds and each keeps its
+best time, so a burst of noise from elsewhere on the machine only spoils one of them. A fixed
+pure-Python workload is timed alongside them, and comparisons are made relative to it, so a
+machine that's uniformly slower (or busier) than when the baseline was taken isn't reported.
+
+Given a baseline (benchmarks/codec_baseline.json by default), every case is compared against
+it and the run fails (exit status 1) if any got slower, or allocates more, by over
+--threshold. Timings depend on the machine, so record the baseline where the check runs:
+    python -m benchmarks.bench_codecs --update-baseline
+    python -m benchmarks.bench_codecs
+"""
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+import timeit
+import tracemalloc
+from http import HTTPStatus
+
+import a2lib.httplib
+import a2lib.wslib
+
+_DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "codec_baseline.json")
+_CALIBRATION = "calibration"
+
+# one payload length per header encoding (7-bit, 16-bit, 64-bit), plus typical chat sizes
+_FRAME_SIZES = [0, 32, 125, 126, 1024, 16 * 1024, 65535, 65536, 1024 * 1024]
+
+_CLOSES = [(a2lib.wslib.CloseCode.NORMAL_CLOSURE, ""),
+           (a2lib.wslib.CloseCode.GOING_AWAY, "server shutting down"),
+           (a2lib.wslib.CloseCode.TRY_AGAIN_LATER, "Consumer too slow")]
+
+# header sets the chat client and server actually exchange, plus a larger one
+_HEADER_SETS = {
+    "minimal": {"Host": "localhost:8001"},
+    "handshake": {
+        "Host": "localhost:8001",
+        "Upgrade": "websocket",
+        "Connection": "Upgrade",
+        "Sec-Websocket-Key": "dGhlIHNhbXBsZSBub25jZQ==",
+        "Sec-Websocket-Protocol": "chat.ack, chat.seq, chat",
+        "Sec-Websocket-Version": "13",
+        "Sec-Websocket-Extensions": "permessage-deflate; client_max_window_bits",
+    },
+    "large": {f"X-Header-{i}": "v" * 40 for i in range(40)},
+}
+
+_RESPONSES = {
+    "101": (b"HTTP/1.1 101 Switching Protocols\r\n"
+            b"Upgrade: websocket\r\n"
+            b"Connection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=\r\n"
+            b"Sec-WebSocket-Protocol: chat.seq\r\n"
+            b"Sec-WebSocket-Extensions: permessage-deflate; server_no_context_takeover; "
+            b"server_max_window_bits=12\r\n"
+            b"Server: test_chat_server/1.0\r\n\r\n"),
+    "400-body": (b"HTTP/1.1 400 Bad Request\r\n"
+                 b"Content-Type: text/plain\r\n"
+                 b"Content-Length: 24\r\n\r\n"
+                 b"Improper replay request."),
+}
+
+
+class _RecordedSocket:
+    """Plays back a recorded byte stream through recv(), in chunks of at most `n` bytes."""
+
+    def __init__(self, data: bytes):
+        self._data = data
+        self._pos = 0
+
+    def recv(self, n: int) -> bytes:
+        chunk = self._data[self._pos:self._pos + n]
+        self._pos += len(chunk)
+        return chunk
+
+
+def _cases() -> dict:
+    """Name -> a call to measure, all built from fixed (seeded) corpora."""
+    rng = random.Random(1)
+    cases = {}
+    for size in _FRAME_SIZES:
+        payload = bytes(rng.getrandbits(8) for _ in range(min(size, 4096))) * (size // 4096 + 1)
+        frame = a2lib.wslib.Frame(a2lib.wslib.Opcode.BINARY, payload[:size])
+        wire = a2lib.wslib.serialize_frame(frame, mask=False)
+        cases[f"parse_frame/{size}"] = lambda wire=wire: a2lib.wslib.parse_frame(wire)
+        cases[f"serialize_frame/{size}"] = (
+            lambda frame=frame: a2lib.wslib.serialize_frame(frame, mask=False))
+        cases[f"serialize_frame/masked/{size}"] = (
+            lambda frame=frame: a2lib.wslib.serialize_frame(frame))
+    for (code, reason) in _CLOSES:
+        close = a2lib.wslib.Close(code, reason)
+        frame = a2lib.wslib.wrap_close(close)
+        cases[f"parse_close/{int(code)}"] = lambda frame=frame: a2lib.wslib.parse_close(frame)
+        cases[f"wrap_close/{int(code)}"] = lambda close=close: a2lib.wslib.wrap_close(close)
+    for (name, headers) in _HEADER_SETS.items():
+        request = a2lib.httplib.HttpRequest("GET", "/consumer/lobby?since=42", dict(headers))
+        response = a2lib.httplib.HttpResponse(HTTPStatus.OK, "OK", dict(headers), b"x" * 256)
+        cases[f"HttpRequest.__bytes__/{name}"] = request.__bytes__
+        cases[f"HttpResponse.__bytes__/{name}+body"] = response.__bytes__
+    for (name, data) in _RESPONSES.items():
+        cases[f"get_http_response/{name}"] = (
+            lambda data=data: a2lib.httplib.get_http_response(_RecordedSocket(data)))
+    return cases
+
+
+def _calibration():
+    """A fixed workload of the same flavour as the codecs: small allocations, struct packing,
+    byte and string joins."""
+    parts = [b"%d" % i for i in range(64)]
+    b"".join(parts)
+    "\r\n".join(f"{i}: {i}" for i in range(16)).encode()
+    struct.pack("!BBH", 0x82, 126, 1024)
+
+
+def _calls_per_run(call, min_time: float) -> int:
+    (number, elapsed) = timeit.Timer(call).autorange()
+    return max(1, int(number * min_time / elapsed))
+
+def _ns_per_op(call, number: int, repeat: int) -> float:
+    return min(timeit.Timer(call).repeat(repeat, number)) / number * 1e9
+
+
+def _peak_alloc(call) -> int:
+    """Bytes allocated at the peak of one call, beyond what was allocated before it."""
+    call()  # warm up any caches
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        call()
+        return max(0, tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+
+
+def _regressions(results: dict, baseline: dict, threshold: float, alloc_slack: int) -> list:
+    found = []
+    speed = results[_CALIBRATION]["ns"] / baseline[_CALIBRATION]["ns"]
+    for (name, result) in results.items():
+        base = baseline.get(name)
+        if base is None or name == _CALIBRATION:
+            continue
+        if result["ns"] > base["ns"] * speed * (1 + threshold):
+            found.append(f"{name}: {base['ns']:.0f} -> {result['ns']:.0f} ns/op")
+        if result["alloc"] > base["alloc"] * (1 + threshold) + alloc_slack:
+            found.append(f"{name}: {base['alloc']} -> {result['alloc']} bytes allocated")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="wslib/httplib codec benchmark and regression check.")
+    parser.add_argument('--baseline', type=str, default=_DEFAULT_BASELINE,
+                        help="the baseline JSON to compare against. Defaults to benchmarks/codec_baseline.json.")
+    parser.add_argument('--update-baseline', action="store_true",
+                        help="write this run's results to --baseline instead of comparing.")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="the slowdown (or allocation growth) that fails the run, as a fraction. "
+                             "Defaults to 0.25.")
+    parser.add_argument('--alloc-slack', type=int, default=64,
+                        help="bytes of allocation growth always tolerated, for interpreter noise. Defaults to 64.")
+    parser.add_argument('--rounds', type=int, default=5,
+                        help="rounds over all the cases, of which each case's best counts. Defaults to 5.")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="timed runs per case and round. Defaults to 3.")
+    parser.add_argument('--min-time', type=float, default=0.02,
+                        help="seconds per timed run. Defaults to 0.02.")
+    parser.add_argument('--filter', type=str, default=None,
+                        help="only run cases whose name contains this.")
+    args = parser.parse_args()
+
+    cases = _cases()
+    if args.filter:
+        cases = {name: call for (name, call) in cases.items() if args.filter in name}
+    cases[_CALIBRATION] = _calibration
+    baseline = {}
+    if not args.update_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    numbers = {name: _calls_per_run(call, args.min_time) for (name, call) in cases.items()}
+    results = {name: {"ns": float("inf"), "alloc": _peak_alloc(call)}
+               for (name, call) in cases.items()}
+    for _ in range(args.rounds):
+        for (name, call) in cases.items():
+            results[name]["ns"] = min(results[name]["ns"],
+                                      _ns_per_op(call, numbers[name], args.repeat))
+
+    print(f"{'case':<40} {'ns/op':>12} {'alloc B':>9} {'vs baseline':>12}")
+    for name in cases:
+        base = baseline.get(name)
+        change = ""
+        if base is not None and name != _CALIBRATION:
+            speed = results[_CALIBRATION]["ns"] / baseline[_CALIBRATION]["ns"]
+            change = f"{(results[name]['ns'] / (base['ns'] * speed) - 1) * 100:+.1f}%"
+        print(f"{name:<40} {results[name]['ns']:>12.0f} {results[name]['alloc']:>9} {change:>12}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}.")
+        return
+    if not baseline:
+        print(f"No baseline at {args.baseline}; record one with --update-baseline.")
+        return
+    regressions = _regressions(results, baseline, args.threshold, args.alloc_slack)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print(f"\nNo regressions over {args.threshold:.0%}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Micro-benchmark: permessage-deflate bytes on the wire and CPU for chat traffic.
+
+Runs a synthetic chat corpus (short, repetitive lines, prefixed with the sender's address the
+way the test server relays them) through wslib.serialize_frame() and FrameDecoder with
+compression off, without context takeover (how the server sends, so one compressed frame can
+go to every consumer) and with context takeover (how the client sends by default), across a
+few minimum sizes.
+
+Run from the repository root:
+    python -m benchmarks.bench_deflate --messages 20000
+"""
+import argparse
+import random
+import time
+
+import a2lib.wslib
+
+_WORDS = ("the a to and is it you i that of in for on this was with be have are not but "
+          "so just what lol ok yes no can will do we they about get like know think deploy "
+          "build test server client message room queue broker latency ping timeout retry "
+          "merge review fixed broken works thanks sure later today tomorrow meeting").split()
+_USERS = [f"('10.0.{random.Random(n).randint(0, 255)}.{n}', {40000 + n * 37})" for n in range(12)]
+
+
+def _corpus(messages: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(messages):
+        # mostly short chatter with the odd longer paragraph, like a busy chat room
+        length = int(rng.paretovariate(1.5) * 5)
+        text = " ".join(rng.choice(_WORDS) for _ in range(min(length, 200)))
+        lines.append(f"{rng.choice(_USERS)}: {text}".encode())
+    return lines
+
+
+def _run(corpus: list, sender, receiver) -> tuple:
+    """(bytes on the wire, encode CPU us/msg, decode CPU us/msg)."""
+    start = time.process_time()
+    wire = b"".join(a2lib.wslib.serialize_frame(a2lib.wslib.Frame(a2lib.wslib.Opcode.TEXT, line),
+                                                mask=False, deflate=sender)
+                    for line in corpus)
+    encoded = time.process_time()
+    decoder = a2lib.wslib.FrameDecoder(deflate=receiver)
+    frames = decoder.feed(wire)
+    decoded = time.process_time()
+    assert [frame.data for frame in frames] == corpus
+    return (len(wire), (encoded - start) / len(corpus) * 1e6, (decoded - encoded) / len(corpus) * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="permessage-deflate benchmark.")
+    parser.add_argument('--messages', type=int, default=20000,
+                        help="messages in the corpus. Defaults to 20000.")
+    parser.add_argument('--min-sizes', type=int, nargs='+', default=[0, 32, 128],
+                        help="minimum payload sizes to compress. Defaults to 0, 32 and 128.")
+    args = parser.parse_args()
+
+    corpus = _corpus(args.messages)
+    raw = sum(len(line) for line in corpus)
+    print(f"{len(corpus)} messages, {raw} payload bytes, mean {raw / len(corpus):.0f} B")
+    print(f"{'mode':>22} {'min size':>9} {'wire bytes':>11} {'ratio':>7} {'encode':>11} {'decode':>11}")
+
+    (plain, encode_us, decode_us) = _run(corpus, None, None)
+    print(f"{'none':>22} {'-':>9} {plain:>11} {1:>7.2f} {encode_us:>8.2f} us {decode_us:>8.2f} us")
+    for (mode, no_takeover) in [("no context takeover", True), ("context takeover", False)]:
+        for min_size in args.min_sizes:
+            sender = a2lib.wslib.PerMessageDeflate(local_no_context_takeover=no_takeover,
+                                                   min_size=min_size)
+            receiver = a2lib.wslib.PerMessageDeflate(remote_no_context_takeover=no_takeover)
+            (wire, encode_us, decode_us) = _run(corpus, sender, receiver)
+            print(f"{mode:>22} {min_size:>9} {wire:>11} {wire / plain:>7.2f} "
+                  f"{encode_us:>8.2f} us {decode_us:>8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
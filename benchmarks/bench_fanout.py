@@ -0,0 +1,67 @@
+"""Micro-benchmark: CPU cost of broadcasting one message to many consumers.
+
+Compares serializing the frame for every recipient (what websockets' send() does) with
+serializing it once and writing the same bytes to every transport, as the test server does.
+
+Run from the repository root:
+    python -m benchmarks.bench_fanout --consumers 1000 10000
+"""
+import argparse
+import time
+
+import a2lib.wslib
+
+
+class _NullTransport:
+    """Stands in for an asyncio transport; only counts what it's given."""
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+
+def _per_consumer(msg: str, transports):
+    for transport in transports:
+        frame = a2lib.wslib.Frame(a2lib.wslib.Opcode.TEXT, msg.encode())
+        transport.write(a2lib.wslib.serialize_frame(frame, mask=False))
+
+
+def _encode_once(msg: str, transports):
+    frame = a2lib.wslib.serialize_frame(a2lib.wslib.Frame(a2lib.wslib.Opcode.TEXT, msg.encode()),
+                                        mask=False)
+    for transport in transports:
+        transport.write(frame)
+
+
+def _cpu_time(fanout, msg, transports, messages):
+    start = time.process_time()
+    for _ in range(messages):
+        fanout(msg, transports)
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Broadcast fan-out micro-benchmark.")
+    parser.add_argument('--consumers', type=int, nargs='+', default=[1000, 10000],
+                        help="consumer counts to measure. Defaults to 1000 and 10000.")
+    parser.add_argument('--messages', type=int, default=20,
+                        help="messages broadcast per measurement. Defaults to 20.")
+    parser.add_argument('--size', type=int, default=200,
+                        help="message size in characters. Defaults to 200.")
+    args = parser.parse_args()
+
+    msg = "x" * args.size
+    print(f"{'consumers':>10} {'per-consumer':>14} {'encode-once':>14} {'saved':>8}")
+    for consumers in args.consumers:
+        transports = [_NullTransport() for _ in range(consumers)]
+        before = _cpu_time(_per_consumer, msg, transports, args.messages)
+        after = _cpu_time(_encode_once, msg, transports, args.messages)
+        per_msg = 1e3 / args.messages
+        print(f"{consumers:>10} {before * per_msg:>11.3f} ms {after * per_msg:>11.3f} ms "
+              f"{(1 - after / before) * 100:>7.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Benchmark: server CPU and wakeups with many idle connections, per keepalive mechanism.
+
+Opens --connections idle consumer connections to the test server, answers every ping they
+get, and samples the server process over --duration seconds: CPU time, wakeups (voluntary
+context switches, i.e. times the process went to sleep and was woken again), resident memory
+and CPU per ping answered (the benchmark shares the machine, so on few cores it may not keep
+up with every ping). Runs once with the shared timer wheel and once with websockets'
+keepalive task per connection.
+
+Needs a file descriptor limit above the connection count. Run from the repository root:
+    python -m benchmarks.bench_idle --connections 10000 --duration 10
+"""
+import argparse
+import selectors
+import socket
+import time
+
+import a2lib.wslib
+from benchmarks.bench_load import _process_cpu, _start_server
+import ws_chat_client
+
+
+def _proc_status(pid: int, field: str):
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _connect_all(port: int, count: int) -> selectors.DefaultSelector:
+    selector = selectors.DefaultSelector()
+    for _ in range(count):
+        sock = socket.create_connection(("127.0.0.1", port))
+        (leftover, _) = ws_chat_client.perform_handshake("127.0.0.1", port, "consumer", sock)
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, a2lib.wslib.FrameDecoder(leftover))
+    return selector
+
+
+def _answer_pings(selector: selectors.DefaultSelector, until: float) -> int:
+    pongs = 0
+    while time.monotonic() < until:
+        for (key, _) in selector.select(timeout=max(0.0, until - time.monotonic())):
+            try:
+                frames = key.data.recv_from(key.fileobj)
+            except (BlockingIOError, ConnectionError):
+                continue
+            for frame in frames:
+                if frame.opcode == a2lib.wslib.Opcode.PING:
+                    key.fileobj.send(a2lib.wslib.serialize_frame(
+                        a2lib.wslib.Frame(a2lib.wslib.Opcode.PONG, frame.data)))
+                    pongs += 1
+    return pongs
+
+
+def _run(keepalive: str, args) -> dict:
+    server, port = _start_server(["--keepalive", keepalive, "--ping-interval", str(args.ping_interval),
+                                  "--timeout", str(args.ping_interval * 4)])
+    selector = None
+    try:
+        selector = _connect_all(port, args.connections)
+        # let the handshakes settle before measuring
+        _answer_pings(selector, time.monotonic() + args.ping_interval)
+        cpu = _process_cpu(server.pid)
+        switches = _proc_status(server.pid, "voluntary_ctxt_switches")
+        pongs = _answer_pings(selector, time.monotonic() + args.duration)
+        cpu = None if cpu is None else _process_cpu(server.pid) - cpu
+        switches = None if switches is None else _proc_status(server.pid, "voluntary_ctxt_switches") - switches
+        rss = _proc_status(server.pid, "VmRSS")
+    finally:
+        if selector is not None:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+        server.terminate()
+        server.wait()
+    return {"cpu": cpu, "switches": switches, "rss": rss, "pongs": pongs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Idle connection keepalive benchmark.")
+    parser.add_argument('--connections', type=int, default=10000,
+                        help="idle connections to hold open. Defaults to 10000.")
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help="seconds to measure for. Defaults to 10.")
+    parser.add_argument('--ping-interval', type=float, default=2.0,
+                        help="the server's ping interval. Defaults to 2.")
+    args = parser.parse_args()
+
+    print(f"{args.connections} idle connections, ping every {args.ping_interval}s, {args.duration}s")
+    print(f"{'keepalive':>11} {'CPU %':>7} {'wakeups/s':>10} {'pings/s':>9} {'CPU/ping':>11} {'RSS MiB':>9}")
+    for keepalive in ["wheel", "websockets"]:
+        r = _run(keepalive, args)
+        cpu = "n/a" if r["cpu"] is None else f"{r['cpu'] / args.duration * 100:.1f}"
+        per_ping = "n/a" if r["cpu"] is None or not r["pongs"] else f"{r['cpu'] / r['pongs'] * 1e6:.0f} us"
+        switches = "n/a" if r["switches"] is None else f"{r['switches'] / args.duration:.0f}"
+        rss = "n/a" if r["rss"] is None else f"{r['rss'] / 1024:.0f}"
+        print(f"{keepalive:>11} {cpu:>7} {switches:>10} {r['pongs'] / args.duration:>9.0f} "
+              f"{per_ping:>11} {rss:>9}")
+
+
+if __name__ == "__main__":
+    main()
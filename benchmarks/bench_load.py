@@ -0,0 +1,240 @@
+"""End-to-end load test of ws_chat_test_server.py.
+
+Starts the test server on a random local port, then runs producers, consumers and 'both'
+clients, each in its own process. Producers send at a fixed rate (or as fast as they can)
+for a set duration; every message carries the producer id, a sequence number and its send
+time, so consumers can measure delivery latency and count messages that never arrived.
+
+The report (also written as JSON with --out) has sustained throughput, p50/p95/p99/max
+latency, dropped messages and CPU seconds per process. --compare prints the change from an
+earlier report.
+
+Run from the repository root:
+    python -m benchmarks.bench_load --producers 2 --consumers 8 --duration 10 --out run.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import a2lib.wslib
+import ws_chat_client
+
+_SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       "ws_chat_test_server.py")
+
+
+def _connect(port: int, role: str):
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    (leftover, _) = ws_chat_client.perform_handshake("127.0.0.1", port, role, sock)
+    return sock, leftover
+
+
+def _produce(sock: socket.socket, producer_id: int, rate: float, duration: float, size: int) -> int:
+    """Sends for `duration` seconds; returns the number of messages sent."""
+    padding = "x" * size
+    interval = 1.0 / rate if rate > 0 else 0.0
+    start = time.monotonic()
+    next_send = start
+    seq = 0
+    while True:
+        now = time.monotonic()
+        if now - start >= duration:
+            break
+        if interval:
+            if now < next_send:
+                time.sleep(next_send - now)
+            next_send += interval
+        msg = f"{producer_id} {seq} {time.monotonic_ns()} {padding}"
+        ws_chat_client.send_frame(sock, a2lib.wslib.Opcode.TEXT, msg.encode())
+        seq += 1
+    return seq
+
+
+def _consume(sock: socket.socket, leftover: bytes, until: float, stats: dict):
+    decoder = a2lib.wslib.FrameDecoder(leftover)
+    latencies = stats["latencies"]
+    received = stats["received"]
+    while True:
+        remaining = until - time.monotonic()
+        if remaining <= 0:
+            break
+        sock.settimeout(remaining)
+        try:
+            frames = decoder.recv_from(sock)
+        except (socket.timeout, ConnectionError):
+            break
+        now = time.monotonic_ns()
+        for frame in frames:
+            if frame.opcode != a2lib.wslib.Opcode.TEXT:
+                continue
+            # "('127.0.0.1', 1234): <producer> <seq> <sent ns> <padding>"
+            body = frame.data.split(b"): ", 1)[1]
+            (producer_id, _, sent_ns, _) = body.split(b" ", 3)
+            latencies.append(now - int(sent_ns))
+            received[int(producer_id)] = received.get(int(producer_id), 0) + 1
+
+
+def _worker(role, worker_id, port, args, barrier, results):
+    (sock, leftover) = _connect(port, role)
+    barrier.wait()
+    start_cpu = time.process_time()
+    result = {"role": role, "id": worker_id, "sent": 0, "latencies": [], "received": {}}
+    if role == "consumer":
+        _consume(sock, leftover, time.monotonic() + args.duration + args.grace, result)
+    elif role == "producer":
+        result["sent"] = _produce(sock, worker_id, args.rate, args.duration, args.size)
+    else:
+        # 'both': consume on a second thread while producing on this one
+        consumer = threading.Thread(target=_consume,
+                                    args=(sock, leftover, time.monotonic() + args.duration + args.grace, result))
+        consumer.start()
+        result["sent"] = _produce(sock, worker_id, args.rate, args.duration, args.size)
+        consumer.join()
+    result["cpu"] = time.process_time() - start_cpu
+    sock.close()
+    results.put(result)
+
+
+def _process_cpu(pid: int):
+    """CPU seconds used so far by `pid`, or None where /proc isn't available."""
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except OSError:
+        return None
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _start_server(extra_args, endpoint=None):
+    """Starts the server on a free port, or on `endpoint` (e.g. unix:/path) if given."""
+    port = _free_port() if endpoint is None else endpoint
+    server = subprocess.Popen([sys.executable, "-u", _SERVER, str(port), "--ping-interval", "0"] + extra_args,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    for line in server.stdout:
+        if line.startswith("Started chat server"):
+            break
+    else:
+        raise RuntimeError("Server exited before it started listening")
+    # keep the pipe drained so the server never blocks on its own output
+    threading.Thread(target=lambda: [None for _ in server.stdout], daemon=True).start()
+    return server, port
+
+
+def run(args) -> dict:
+    server, port = _start_server(args.server_args)
+    roles = (["consumer"] * args.consumers + ["producer"] * args.producers + ["both"] * args.both)
+    barrier = multiprocessing.Barrier(len(roles))
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_worker, args=(role, i, port, args, barrier, results))
+               for (i, role) in enumerate(roles)]
+    try:
+        server_cpu = _process_cpu(server.pid)
+        for worker in workers:
+            worker.start()
+        # a worker that died never reports, so don't wait on it forever
+        deadline = args.duration + args.grace + 30
+        reports = [results.get(timeout=deadline) for _ in workers]
+        for worker in workers:
+            worker.join()
+        if server_cpu is not None:
+            server_cpu = round(_process_cpu(server.pid) - server_cpu, 3)
+    finally:
+        server.terminate()
+        server.wait()
+
+    senders = {r["id"]: r["sent"] for r in reports if r["role"] in ["producer", "both"]}
+    receivers = [r for r in reports if r["role"] in ["consumer", "both"]]
+    expected = sum(sent * sum(1 for r in receivers if r["id"] != sender)
+                   for (sender, sent) in senders.items())
+    delivered = sum(sum(r["received"].values()) for r in receivers)
+    latencies = sorted(lat for r in receivers for lat in r["latencies"])
+
+    def ms(ns):
+        return None if ns is None else round(ns / 1e6, 3)
+
+    return {
+        "config": {"producers": args.producers, "consumers": args.consumers, "both": args.both,
+                   "rate": args.rate, "duration": args.duration, "size": args.size,
+                   "server_args": args.server_args},
+        "sent": sum(senders.values()),
+        "delivered": delivered,
+        "dropped": expected - delivered,
+        "sent_per_second": round(sum(senders.values()) / args.duration, 1),
+        "delivered_per_second": round(delivered / args.duration, 1),
+        "latency_ms": {"p50": ms(_percentile(latencies, 50)), "p95": ms(_percentile(latencies, 95)),
+                       "p99": ms(_percentile(latencies, 99)), "max": ms(latencies[-1] if latencies else None)},
+        "cpu_seconds": {"server": server_cpu,
+                        "clients": {f"{r['role']}-{r['id']}": round(r["cpu"], 3) for r in reports}},
+    }
+
+
+def _compare(report: dict, baseline: dict):
+    def change(now, before):
+        if now is None or not before:
+            return "n/a"
+        return f"{(now - before) / before * 100:+.1f}%"
+
+    print("Change from baseline:")
+    for key in ["delivered_per_second", "dropped"]:
+        print(f"  {key}: {baseline.get(key)} -> {report[key]} ({change(report[key], baseline.get(key))})")
+    for key, value in report["latency_ms"].items():
+        before = baseline.get("latency_ms", {}).get(key)
+        print(f"  latency {key}: {before} -> {value} ms ({change(value, before)})")
+    before = baseline.get("cpu_seconds", {}).get("server")
+    now = report["cpu_seconds"]["server"]
+    print(f"  server cpu: {before} -> {now} s ({change(now, before)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat server load test.")
+    parser.add_argument('--producers', type=int, default=1, help="producer clients. Defaults to 1.")
+    parser.add_argument('--consumers', type=int, default=4, help="consumer clients. Defaults to 4.")
+    parser.add_argument('--both', type=int, default=0, help="'both' clients. Defaults to 0.")
+    parser.add_argument('--rate', type=float, default=1000.0,
+                        help="messages per second per producer; 0 sends as fast as possible. Defaults to 1000.")
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help="seconds to produce for. Defaults to 5.")
+    parser.add_argument('--grace', type=float, default=2.0,
+                        help="seconds consumers keep reading after producers stop. Defaults to 2.")
+    parser.add_argument('--size', type=int, default=100,
+                        help="padding added to each message, in characters. Defaults to 100.")
+    parser.add_argument('--out', type=str, default=None, help="write the report to this JSON file.")
+    parser.add_argument('--compare', type=str, default=None,
+                        help="a previous JSON report to compare against.")
+    parser.add_argument('server_args', nargs=argparse.REMAINDER,
+                        help="extra arguments for the server, after '--'.")
+    args = parser.parse_args()
+    if args.server_args[:1] == ["--"]:
+        args.server_args = args.server_args[1:]
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(report, out, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline:
+            _compare(report, json.load(baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Micro-benchmark: payload masking throughput.
+
+Compares a2lib.wslib.apply_mask() (int.from_bytes(), or NumPy above
+wslib.NUMPY_MASK_THRESHOLD) with byte-by-byte XOR in Python and, when installed,
+websockets' C speedups (which serialize_frame() prefers whenever they're available).
+
+Run from the repository root:
+    python -m benchmarks.bench_masking
+"""
+import argparse
+import os
+import time
+
+import a2lib.wslib
+
+try:
+    from websockets.speedups import apply_mask as _speedups_mask
+except ImportError:
+    _speedups_mask = None
+
+_SIZES = [64, 4 * 1024, 64 * 1024, 1024 * 1024]
+
+
+def _bytewise_mask(data: bytes, mask: bytes) -> bytes:
+    return bytes(b ^ mask[i & 3] for i, b in enumerate(data))
+
+
+def _int_mask(data: bytes, mask: bytes) -> bytes:
+    key = mask * (len(data) // 4 + 1)
+    return (int.from_bytes(data, "little")
+            ^ int.from_bytes(key[:len(data)], "little")).to_bytes(len(data), "little")
+
+
+def _throughput(apply_mask, data: bytes, mask: bytes, min_time: float) -> float:
+    """MiB/s, averaged over enough calls to run for at least `min_time` seconds."""
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        for _ in range(10):
+            apply_mask(data, mask)
+        calls += 10
+        elapsed = time.perf_counter() - start
+    return calls * len(data) / elapsed / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Websocket masking throughput benchmark.")
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help="seconds to spend on each measurement. Defaults to 0.2.")
+    args = parser.parse_args()
+
+    candidates = [("bytewise", _bytewise_mask), ("int.from_bytes", _int_mask),
+                  ("wslib.apply_mask", a2lib.wslib.apply_mask)]
+    if _speedups_mask is not None:
+        candidates.append(("websockets C", _speedups_mask))
+
+    mask = os.urandom(4)
+    print(f"NumPy: {'yes' if a2lib.wslib._np is not None else 'no'}  (MiB/s)")
+    print(f"{'payload':>10}" + "".join(f"{name:>18}" for name, _ in candidates))
+    for size in _SIZES:
+        data = os.urandom(size)
+        row = f"{size:>10}"
+        for name, apply_mask in candidates:
+            if name == "bytewise" and size > 64 * 1024:
+                row += f"{'-':>18}"  # far too slow to be worth waiting for
+                continue
+            row += f"{_throughput(apply_mask, data, mask, args.min_time):>18.1f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Benchmark: server memory per idle consumer connection.
+
+Starts the test server, then for each --connections count opens that many idle consumer
+connections to it and reports the growth of the server's resident memory, per connection.
+That's everything a connection costs the server process: the websockets protocol and its
+buffers, the session's task, its consumer record and room membership. Kernel socket buffers
+aren't included. Each count gets a fresh server.
+
+Both the server and this process need a file descriptor limit above the connection count
+(the soft limit is raised to the hard one here; the server inherits it). Past the ephemeral
+port range, connections come from further loopback addresses (127.0.0.2, ...). Run from the
+repository root:
+    python -m benchmarks.bench_memory --connections 10000 50000
+"""
+import argparse
+import resource
+import socket
+import time
+
+from benchmarks.bench_idle import _proc_status
+from benchmarks.bench_load import _start_server
+import ws_chat_client
+
+# connections per loopback source address, well inside the default ephemeral port range
+_PER_ADDRESS = 20000
+
+
+def _connect_all(port: int, count: int) -> list:
+    socks = []
+    for i in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind((f"127.0.0.{2 + i // _PER_ADDRESS}" if i >= _PER_ADDRESS else "127.0.0.1", 0))
+        sock.connect(("127.0.0.1", port))
+        ws_chat_client.perform_handshake("127.0.0.1", port, "consumer", sock)
+        socks.append(sock)
+    return socks
+
+
+def _settled_rss(pid: int, settle: float) -> int:
+    """The server's resident memory in KiB, once it stopped changing (or after `settle` s)."""
+    rss = _proc_status(pid, "VmRSS")
+    until = time.monotonic() + settle
+    while time.monotonic() < until:
+        time.sleep(0.2)
+        (previous, rss) = (rss, _proc_status(pid, "VmRSS"))
+        if rss == previous:
+            break
+    return rss
+
+
+def _run(count: int, args) -> dict:
+    server, port = _start_server(args.server_args)
+    socks = []
+    try:
+        before = _settled_rss(server.pid, args.settle)
+        start = time.monotonic()
+        socks = _connect_all(port, count)
+        elapsed = time.monotonic() - start
+        after = _settled_rss(server.pid, args.settle)
+    finally:
+        for sock in socks:
+            sock.close()
+        server.terminate()
+        server.wait()
+    return {"before": before, "after": after, "elapsed": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server memory per idle connection benchmark.")
+    parser.add_argument('--connections', type=int, nargs='+', default=[10000, 50000],
+                        help="idle connection counts to measure. Defaults to 10000 50000.")
+    parser.add_argument('--settle', type=float, default=5.0,
+                        help="the most seconds to wait for the server's memory to stop changing. Defaults to 5.")
+    parser.add_argument('--server-args', nargs=argparse.REMAINDER, default=[],
+                        help="further arguments for ws_chat_test_server.py.")
+    args = parser.parse_args()
+
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    print(f"{'connections':>11} {'RSS before':>11} {'RSS after':>10} {'bytes/conn':>11} {'connect s':>10}")
+    for count in args.connections:
+        if count + 100 > hard:
+            print(f"{count:>11} skipped: the file descriptor limit is {hard}")
+            continue
+        r = _run(count, args)
+        if r["before"] is None:
+            print(f"{count:>11} n/a: no /proc")
+            continue
+        print(f"{count:>11} {r['before'] / 1024:>8.1f} MiB {r['after'] / 1024:>6.1f} MiB "
+              f"{(r['after'] - r['before']) * 1024 / count:>11.0f} {r['elapsed']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Micro-benchmark: per-message fan-out cost as the number of rooms grows.
+
+Each room has the same number of subscribers. Posting to one room should cost the same no
+matter how many other rooms (and consumers) the server has, unlike broadcasting to every
+consumer the server knows about.
+
+Run from the repository root:
+    python -m benchmarks.bench_rooms --rooms 1 10 100 1000
+"""
+import argparse
+import time
+
+import ws_chat_test_server as server
+
+
+class _NullConsumer:
+    """Stands in for a connected consumer; only counts the bytes it's given."""
+
+    websocket = None
+
+    def __init__(self):
+        self.received = 0
+
+    def enqueue(self, message):
+        self.received += len(message.frame())
+
+
+def _per_message_us(post, messages: int) -> float:
+    start = time.perf_counter()
+    for _ in range(messages):
+        post()
+    return (time.perf_counter() - start) / messages * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Room fan-out micro-benchmark.")
+    parser.add_argument('--rooms', type=int, nargs='+', default=[1, 10, 100, 1000],
+                        help="room counts to measure. Defaults to 1, 10, 100 and 1000.")
+    parser.add_argument('--subscribers', type=int, default=10,
+                        help="subscribers per room. Defaults to 10.")
+    parser.add_argument('--messages', type=int, default=2000,
+                        help="messages posted per measurement. Defaults to 2000.")
+    args = parser.parse_args()
+
+    payload = b"('127.0.0.1', 12345): " + b"x" * 100
+    print(f"{'rooms':>8} {'consumers':>10} {'room post':>12} {'broadcast all':>15}")
+    for rooms in args.rooms:
+        server._rooms.clear()
+        for room in range(rooms):
+            server._rooms[str(room)] = {_NullConsumer() for _ in range(args.subscribers)}
+        everyone = list(server._all_consumers())
+
+        def post_to_room():
+            server._fan_out(server._Message(1, payload), None, "0")
+
+        def broadcast():
+            message = server._Message(1, payload)
+            for consumer in everyone:
+                consumer.enqueue(message)
+
+        room_us = _per_message_us(post_to_room, args.messages)
+        broadcast_us = _per_message_us(broadcast, max(1, args.messages // rooms))
+        print(f"{rooms:>8} {len(everyone):>10} {room_us:>9.2f} us {broadcast_us:>12.2f} us")
+    server._rooms.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Benchmark: a Unix domain socket vs loopback TCP between clients and the test server.
+
+Starts the test server once on 127.0.0.1 and once on unix:/path, and over each connects one
+producer and one consumer (same handshake and framing either way). Measures:
+  - latency: messages sent one at a time, each waited for at the consumer before the next,
+    reported as p50/p99 producer-to-consumer time through the server;
+  - throughput: --messages messages written in batches as fast as the socket takes them,
+    reported as messages and payload MB a second received, and server CPU per message.
+
+Run from the repository root:
+    python -m benchmarks.bench_unix --messages 200000 --size 128
+"""
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import a2lib.wslib
+from benchmarks.bench_load import _percentile, _process_cpu, _start_server
+import ws_chat_client
+
+
+def _connect(endpoint, role: str):
+    if isinstance(endpoint, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(endpoint[len(ws_chat_client.UNIX_PREFIX):])
+        (host, port) = ("localhost", None)
+    else:
+        sock = socket.create_connection(("127.0.0.1", endpoint))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        (host, port) = ("127.0.0.1", endpoint)
+    (leftover, _) = ws_chat_client.perform_handshake(host, port, role, sock)
+    return sock, a2lib.wslib.FrameDecoder(leftover)
+
+
+def _latency(producer, consumer, decoder, count: int, size: int) -> list:
+    frame = a2lib.wslib.serialize_frame(a2lib.wslib.Frame(a2lib.wslib.Opcode.TEXT, b"x" * size))
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter_ns()
+        producer.sendall(frame)
+        while not decoder.recv_from(consumer):
+            pass
+        latencies.append(time.perf_counter_ns() - start)
+    latencies.sort()
+    return latencies
+
+
+def _throughput(producer, consumer, decoder, count: int, size: int, batch: int) -> float:
+    """Returns seconds from the first write until the consumer had every message."""
+    frame = a2lib.wslib.serialize_frame(a2lib.wslib.Frame(a2lib.wslib.Opcode.TEXT, b"x" * size))
+    result = {}
+
+    def consume():
+        received = 0
+        while received < count:
+            received += len(decoder.recv_from(consumer))
+        result["end"] = time.perf_counter()
+
+    reader = threading.Thread(target=consume)
+    reader.start()
+    start = time.perf_counter()
+    for sent in range(0, count, batch):
+        producer.sendall(frame * min(batch, count - sent))
+    reader.join()
+    return result["end"] - start
+
+
+def _run(endpoint, args) -> dict:
+    server, endpoint = _start_server(["--replay-messages", "0", "--max-queue-messages", "100000",
+                                      "--max-queue-bytes", str(256 * 1024 * 1024)], endpoint)
+    try:
+        (consumer, decoder) = _connect(endpoint, "consumer")
+        (producer, _) = _connect(endpoint, "producer")
+        _latency(producer, consumer, decoder, min(args.round_trips, 100), args.size)  # warm up
+        latencies = _latency(producer, consumer, decoder, args.round_trips, args.size)
+        cpu = _process_cpu(server.pid)
+        elapsed = _throughput(producer, consumer, decoder, args.messages, args.size, args.batch)
+        cpu = None if cpu is None else _process_cpu(server.pid) - cpu
+        producer.close()
+        consumer.close()
+    finally:
+        server.terminate()
+        server.wait()
+    return {"p50": _percentile(latencies, 50), "p99": _percentile(latencies, 99),
+            "elapsed": elapsed, "cpu": cpu}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Unix domain socket vs loopback TCP benchmark.")
+    parser.add_argument('--messages', type=int, default=200000,
+                        help="messages sent for the throughput run. Defaults to 200000.")
+    parser.add_argument('--round-trips', type=int, default=2000,
+                        help="messages sent one at a time for the latency run. Defaults to 2000.")
+    parser.add_argument('--size', type=int, default=128,
+                        help="message payload size in bytes. Defaults to 128.")
+    parser.add_argument('--batch', type=int, default=256,
+                        help="messages per write in the throughput run. Defaults to 256.")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="chat-bench-"), "chat.sock")
+    print(f"{args.size} B messages: {args.round_trips} one at a time, then {args.messages} in "
+          f"batches of {args.batch}")
+    print(f"{'transport':>10} {'p50 us':>8} {'p99 us':>8} {'msgs/s':>9} {'MB/s':>7} {'server CPU/msg':>15}")
+    try:
+        for (name, endpoint) in [("tcp", None), ("unix", ws_chat_client.UNIX_PREFIX + path)]:
+            r = _run(endpoint, args)
+            per_message = "n/a" if r["cpu"] is None else f"{r['cpu'] / args.messages * 1e6:.1f} us"
+            print(f"{name:>10} {r['p50'] / 1e3:>8.0f} {r['p99'] / 1e3:>8.0f} "
+                  f"{args.messages / r['elapsed']:>9.0f} {args.messages * args.size / r['elapsed'] / 1e6:>7.1f} "
+                  f"{per_message:>15}")
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import unittest
+
+import a2lib.federationlib
+
+
+class DeduplicatorTest(unittest.TestCase):
+    def setUp(self):
+        self.dedupe = a2lib.federationlib.Deduplicator(window=8)
+
+    def test_second_copy_is_seen(self):
+        self.assertFalse(self.dedupe.seen(b"a", 1))
+        self.assertTrue(self.dedupe.seen(b"a", 1))
+
+    def test_origins_are_separate(self):
+        self.assertFalse(self.dedupe.seen(b"a", 1))
+        self.assertFalse(self.dedupe.seen(b"b", 1))
+
+    def test_out_of_order_within_window(self):
+        # a message that took a longer path arrives after later ones from the same origin
+        self.assertFalse(self.dedupe.seen(b"a", 5))
+        self.assertFalse(self.dedupe.seen(b"a", 3))
+        self.assertFalse(self.dedupe.seen(b"a", 4))
+        self.assertTrue(self.dedupe.seen(b"a", 3))
+        self.assertFalse(self.dedupe.seen(b"a", 1))
+        self.assertTrue(self.dedupe.seen(b"a", 5))
+
+    def test_behind_window_is_seen(self):
+        self.assertFalse(self.dedupe.seen(b"a", 20))
+        self.assertTrue(self.dedupe.seen(b"a", 12))
+        self.assertFalse(self.dedupe.seen(b"a", 13))
+
+    def test_window_slides(self):
+        self.assertFalse(self.dedupe.seen(b"a", 1))
+        self.assertFalse(self.dedupe.seen(b"a", 9))
+        self.assertTrue(self.dedupe.seen(b"a", 1))
+        self.assertFalse(self.dedupe.seen(b"a", 2))
+        self.assertFalse(self.dedupe.seen(b"a", 10))
+        self.assertTrue(self.dedupe.seen(b"a", 9))
+
+
+class RecordTest(unittest.TestCase):
+    def test_batch_round_trip(self):
+        records = [(b"node0001", 1, b"", b"hello", False),
+                   (b"node0002", 7, b"room", bytes(range(256)), True)]
+        batch = b"".join(a2lib.federationlib.encode_record(origin, counter, room, payload, binary)
+                         for (origin, counter, room, payload, binary) in records)
+        self.assertEqual(list(a2lib.federationlib.decode_batch(batch)), records)
+
+    def test_overhead_bounds_record(self):
+        record = a2lib.federationlib.encode_record(b"node0001", 1, b"r" * 255, b"x" * 100)
+        self.assertLessEqual(len(record), 100 + a2lib.federationlib.MAX_RECORD_OVERHEAD)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+from http import HTTPStatus
+
+import a2lib.httplib
+
+_RESPONSE = (b"HTTP/1.1 101 Switching Protocols\r\n"
+             b"Upgrade: websocket\r\n"
+             b"Connection: Upgrade\r\n"
+             b"Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=\r\n\r\n")
+
+
+class _RecordedSocket:
+    def __init__(self, data: bytes, chunk: int):
+        self._data = data
+        self._chunk = chunk
+
+    def recv(self, n: int) -> bytes:
+        (chunk, self._data) = (self._data[:min(n, self._chunk)], self._data[min(n, self._chunk):])
+        return chunk
+
+
+class HttpParserTest(unittest.TestCase):
+    def test_whole_head(self):
+        parser = a2lib.httplib.HttpParser()
+        self.assertTrue(parser.feed(_RESPONSE))
+        self.assertEqual(parser.start_line, "HTTP/1.1 101 Switching Protocols")
+        self.assertEqual(parser.headers["Upgrade"], "websocket")
+        self.assertEqual(parser.leftover, b"")
+
+    def test_head_split_at_every_byte(self):
+        parser = a2lib.httplib.HttpParser()
+        results = [parser.feed(_RESPONSE[i:i + 1]) for i in range(len(_RESPONSE))]
+        self.assertEqual(results, [False] * (len(_RESPONSE) - 1) + [True])
+        self.assertEqual(parser.headers["Connection"], "Upgrade")
+
+    def test_headers_are_case_insensitive(self):
+        parser = a2lib.httplib.HttpParser()
+        parser.feed(_RESPONSE)
+        self.assertEqual(parser.headers["sec-websocket-accept"], "s3pPLMBiTxaQ9kYGzzhZRbK+xOo=")
+        self.assertIn("SEC-WEBSOCKET-ACCEPT", parser.headers)
+        self.assertEqual(parser.headers["Missing"], "")
+        self.assertIsNone(parser.headers.get("Missing"))
+
+    def test_bytes_after_the_message_are_kept(self):
+        parser = a2lib.httplib.HttpParser()
+        self.assertTrue(parser.feed(_RESPONSE + b"\x81\x02hi"))
+        self.assertEqual(parser.leftover, b"\x81\x02hi")
+
+    def test_body_by_content_length(self):
+        parser = a2lib.httplib.HttpParser()
+        message = b"HTTP/1.1 400 Bad Request\r\nContent-Length: 5\r\n\r\nhello"
+        self.assertFalse(parser.feed(message[:-2]))
+        self.assertTrue(parser.feed(message[-2:] + b"extra"))
+        self.assertEqual((parser.body, parser.leftover), (b"hello", b"extra"))
+
+    def test_head_over_the_limit(self):
+        parser = a2lib.httplib.HttpParser(max_header_size=64)
+        with self.assertRaises(a2lib.httplib.HttpParseError):
+            parser.feed(b"GET / HTTP/1.1\r\n" + b"X-Long: " + b"x" * 100)
+
+    def test_malformed_header_line(self):
+        with self.assertRaises(a2lib.httplib.HttpParseError):
+            a2lib.httplib.HttpParser().feed(b"GET / HTTP/1.1\r\nno colon here\r\n\r\n")
+
+
+class ReadHttpTest(unittest.TestCase):
+    def test_read_response(self):
+        (response, leftover) = a2lib.httplib.read_http_response(
+            _RecordedSocket(_RESPONSE + b"\x81\x00", chunk=7))
+        self.assertEqual(response.status, HTTPStatus.SWITCHING_PROTOCOLS)
+        self.assertEqual(response.headers["Upgrade"], "websocket")
+        self.assertEqual(leftover, b"\x81\x00")
+
+    def test_read_request(self):
+        (request, _) = a2lib.httplib.read_http_request(
+            _RecordedSocket(b"GET /consumer/lobby HTTP/1.1\r\nHost: localhost\r\n\r\n", chunk=5))
+        self.assertEqual((request.method, request.url), ("GET", "/consumer/lobby"))
+
+    def test_connection_closed_early(self):
+        with self.assertRaises(ConnectionError):
+            a2lib.httplib.read_http_response(_RecordedSocket(_RESPONSE[:20], chunk=100))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import a2lib.loglib
+
+
+class LogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="loglib-test-")
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def open_log(self, **settings):
+        settings.setdefault("fsync", a2lib.loglib.FSYNC_NEVER)
+        log = a2lib.loglib.MessageLog(self.directory, **settings)
+        self.addCleanup(log.close)
+        return log
+
+    def write(self, count: int, **settings):
+        log = a2lib.loglib.MessageLog(self.directory, fsync=a2lib.loglib.FSYNC_NEVER, **settings)
+        for offset in range(1, count + 1):
+            log.append(offset, b"message %d" % offset)
+        log.close()
+
+    def segment_path(self, base: int = 1, suffix: str = ".log") -> str:
+        return os.path.join(self.directory, f"{base:020d}{suffix}")
+
+    def read_all(self, log, offset: int = 1) -> list:
+        return [(offset, bytes(payload)) for (offset, payload, _) in log.read(offset, 1 << 30)]
+
+
+class AppendReadTest(LogTestCase):
+    def test_read_back_in_order(self):
+        log = self.open_log(index_interval=64)
+        for offset in range(1, 101):
+            log.append(offset, b"message %d" % offset, binary=offset % 2 == 0)
+        records = log.read(1, 1 << 20)
+        self.assertEqual([offset for (offset, _, _) in records], list(range(1, 101)))
+        self.assertEqual(bytes(records[41][1]), b"message 42")
+        self.assertTrue(records[41][2])
+        self.assertFalse(records[42][2])
+
+    def test_read_from_the_middle(self):
+        log = self.open_log(index_interval=64)
+        for offset in range(1, 101):
+            log.append(offset, b"message %d" % offset)
+        self.assertEqual(self.read_all(log, 77)[:2], [(77, b"message 77"), (78, b"message 78")])
+        self.assertEqual(log.read(101), [])
+
+    def test_read_is_bounded(self):
+        log = self.open_log()
+        for offset in range(1, 101):
+            log.append(offset, b"x" * 100)
+        records = log.read(1, 1000)
+        self.assertLess(len(records), 100)
+        self.assertEqual(records[0][0], 1)
+
+    def test_offsets_must_be_consecutive(self):
+        log = self.open_log()
+        log.append(1, b"first")
+        with self.assertRaises(ValueError):
+            log.append(3, b"third")
+
+    def test_reopen_carries_on(self):
+        self.write(20)
+        log = self.open_log()
+        self.assertEqual((log.first_offset, log.next_offset), (1, 21))
+        log.append(21, b"message 21")
+        self.assertEqual(self.read_all(log, 20), [(20, b"message 20"), (21, b"message 21")])
+
+
+class RollTest(LogTestCase):
+    def test_segments_roll_at_the_size_limit(self):
+        log = self.open_log(segment_bytes=1024, flush_bytes=1)
+        for offset in range(1, 201):
+            log.append(offset, b"message %d" % offset)
+        log.flush()
+        segments = sorted(name for name in os.listdir(self.directory) if name.endswith(".log"))
+        self.assertGreater(len(segments), 1)
+        # a segment is finished by the record that takes it to the limit
+        for name in segments[:-1]:
+            self.assertLess(os.path.getsize(os.path.join(self.directory, name)), 1024 + 32)
+        # every record is found across segment boundaries
+        offsets = []
+        offset = 1
+        while True:
+            records = log.read(offset)
+            if not records:
+                break
+            offsets += [record[0] for record in records]
+            offset = records[-1][0] + 1
+        self.assertEqual(offsets, list(range(1, 201)))
+
+    def test_reopen_after_roll(self):
+        self.write(200, segment_bytes=1024, flush_bytes=1)
+        log = self.open_log(segment_bytes=1024)
+        self.assertEqual(log.next_offset, 201)
+        self.assertEqual(self.read_all(log, 150)[0], (150, b"message 150"))
+
+
+class RetentionTest(LogTestCase):
+    def test_size_retention_keeps_the_newest(self):
+        log = self.open_log(segment_bytes=1024, flush_bytes=1, retention_bytes=2048)
+        for offset in range(1, 501):
+            log.append(offset, b"message %d" % offset)
+        log.flush()
+        self.assertGreater(log.first_offset, 1)
+        self.assertLessEqual(log.size, 2048 + 1024)
+        self.assertEqual(log.read(1)[0][0], log.first_offset)
+        self.assertEqual(log.next_offset, 501)
+
+    def test_age_retention(self):
+        self.write(200, segment_bytes=1024, flush_bytes=1)
+        for name in os.listdir(self.directory):
+            os.utime(os.path.join(self.directory, name), (0, 0))
+        log = self.open_log(segment_bytes=1024, retention_seconds=60)
+        # only the active segment is left
+        self.assertEqual(len([name for name in os.listdir(self.directory) if name.endswith(".log")]), 1)
+        self.assertEqual(log.next_offset, 201)
+
+
+class RecoveryTest(LogTestCase):
+    def test_torn_last_record_is_dropped(self):
+        self.write(10)
+        size = os.path.getsize(self.segment_path())
+        os.truncate(self.segment_path(), size - 3)
+        log = self.open_log()
+        self.assertEqual(log.next_offset, 10)
+        self.assertEqual(self.read_all(log)[-1], (9, b"message 9"))
+        self.assertLess(os.path.getsize(self.segment_path()), size - 3)
+        log.append(10, b"again")
+        self.assertEqual(self.read_all(log, 10), [(10, b"again")])
+
+    def test_index_past_the_end_of_the_segment(self):
+        self.write(50, index_interval=1)
+        size = os.path.getsize(self.segment_path())
+        # the last record and a half never made it to disk, though their index entries did
+        os.truncate(self.segment_path(), size - 30)
+        log = self.open_log(index_interval=1)
+        self.assertEqual(log.next_offset, 49)
+        self.assertLess(os.path.getsize(self.segment_path()), size - 30)
+        self.assertEqual(self.read_all(log, 45),
+                         [(offset, b"message %d" % offset) for offset in range(45, 49)])
+
+    def test_index_entirely_past_the_end(self):
+        self.write(5, index_interval=1)
+        os.truncate(self.segment_path(), 0)
+        log = self.open_log(index_interval=1)
+        self.assertEqual(log.next_offset, 1)
+        self.assertEqual(os.path.getsize(self.segment_path()), 0)
+        self.assertEqual(self.read_all(log), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
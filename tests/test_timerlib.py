@@ -0,0 +1,66 @@
+import unittest
+
+import a2lib.timerlib
+
+
+class _ManualLoop:
+    """Stands in for the event loop: ticks are driven by the test, not by time."""
+
+    def call_at(self, when, callback):
+        return None
+
+
+class TimerWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.expired = []
+        self.wheel = a2lib.timerlib.TimerWheel(self.expired.append, tick=1.0, slots=8)
+        self.wheel._loop = _ManualLoop()
+
+    def advance(self, ticks: int) -> list:
+        """Runs `ticks` ticks; returns the keys expired, in order."""
+        del self.expired[:]
+        for _ in range(ticks):
+            self.wheel._tick()
+        return [key for batch in self.expired for key in batch]
+
+    def test_expires_when_due(self):
+        self.wheel.schedule("a", 3.0)
+        self.assertEqual(self.advance(2), [])
+        self.assertEqual(self.advance(1), ["a"])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_delay_rounds_up_to_a_tick(self):
+        self.wheel.schedule("a", 0.1)
+        self.wheel.schedule("b", 1.5)
+        self.assertEqual(self.advance(1), ["a"])
+        self.assertEqual(self.advance(1), ["b"])
+
+    def test_keys_due_together_expire_in_one_batch(self):
+        for key in "abc":
+            self.wheel.schedule(key, 2.0)
+        self.advance(2)
+        self.assertEqual(len(self.expired), 1)
+        self.assertEqual(sorted(self.expired[0]), ["a", "b", "c"])
+
+    def test_cancel(self):
+        self.wheel.schedule("a", 2.0)
+        self.wheel.cancel("a")
+        self.wheel.cancel("never scheduled")
+        self.assertEqual(self.advance(4), [])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_reschedule_replaces_the_timeout(self):
+        self.wheel.schedule("a", 2.0)
+        self.advance(1)
+        self.wheel.schedule("a", 3.0)
+        self.assertEqual(self.advance(2), [])
+        self.assertEqual(self.advance(1), ["a"])
+
+    def test_timeout_beyond_a_full_turn(self):
+        self.wheel.schedule("a", 11.0)  # 8 slots: passes its slot once before it's due
+        self.assertEqual(self.advance(10), [])
+        self.assertEqual(self.advance(1), ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import socket
+import unittest
+
+import a2lib.wslib
+from a2lib.wslib import Frame, Opcode
+
+
+def _wire(*frames, mask=False) -> bytes:
+    return b"".join(a2lib.wslib.serialize_frame(frame, mask=mask) for frame in frames)
+
+
+class FrameDecoderTest(unittest.TestCase):
+    def test_several_frames_in_one_chunk(self):
+        decoder = a2lib.wslib.FrameDecoder()
+        frames = decoder.feed(_wire(Frame(Opcode.TEXT, b"one"), Frame(Opcode.BINARY, b"two"),
+                                    Frame(Opcode.PING, b"")))
+        self.assertEqual([(frame.opcode, frame.data) for frame in frames],
+                         [(Opcode.TEXT, b"one"), (Opcode.BINARY, b"two"), (Opcode.PING, b"")])
+
+    def test_frames_split_at_every_byte(self):
+        payloads = [b"x" * 5, b"y" * 300, b"z" * 70000]  # 7-bit, 16-bit and 64-bit lengths
+        data = _wire(*[Frame(Opcode.BINARY, payload) for payload in payloads])
+        decoder = a2lib.wslib.FrameDecoder()
+        frames = []
+        for i in range(len(data)):
+            frames += decoder.feed(data[i:i + 1])
+        self.assertEqual([frame.data for frame in frames], payloads)
+
+    def test_masked_frames_are_unmasked(self):
+        decoder = a2lib.wslib.FrameDecoder()
+        frames = decoder.feed(_wire(Frame(Opcode.TEXT, b"hello there"), mask=True))
+        self.assertEqual(frames[0].data, b"hello there")
+
+    def test_seeded_with_leftover_bytes(self):
+        data = _wire(Frame(Opcode.TEXT, b"first"), Frame(Opcode.TEXT, b"second"))
+        decoder = a2lib.wslib.FrameDecoder(data[:9])
+        frames = decoder.feed(data[9:])
+        self.assertEqual([frame.data for frame in frames], [b"first", b"second"])
+
+    def test_fragments_come_out_as_they_are(self):
+        frames = list(a2lib.wslib.fragment(Opcode.BINARY, b"a" * 10, fragment_size=4))
+        decoded = a2lib.wslib.FrameDecoder().feed(_wire(*frames))
+        self.assertEqual([(frame.opcode, frame.fin) for frame in decoded],
+                         [(Opcode.BINARY, False), (Opcode.CONT, False), (Opcode.CONT, True)])
+
+    def test_oversized_frame_refused_from_its_header(self):
+        decoder = a2lib.wslib.FrameDecoder(max_size=100)
+        header = _wire(Frame(Opcode.BINARY, b"x" * 1000))[:4]
+        with self.assertRaises(a2lib.wslib.PayloadTooBig):
+            decoder.feed(header)
+
+    def test_invalid_opcode(self):
+        with self.assertRaises(a2lib.wslib.ProtocolError):
+            a2lib.wslib.FrameDecoder().feed(b"\x83\x00")
+
+    def test_recv_from_socket(self):
+        (left, right) = socket.socketpair()
+        self.addCleanup(left.close)
+        self.addCleanup(right.close)
+        decoder = a2lib.wslib.FrameDecoder()
+        left.sendall(_wire(Frame(Opcode.TEXT, b"over the socket")))
+        self.assertEqual(decoder.recv_from(right)[0].data, b"over the socket")
+        left.close()
+        with self.assertRaises(ConnectionError):
+            decoder.recv_from(right)
+
+
+class PerMessageDeflateTest(unittest.TestCase):
+    def setUp(self):
+        self.sender = a2lib.wslib.PerMessageDeflate()
+        self.receiver = a2lib.wslib.PerMessageDeflate()
+
+    def test_round_trip(self):
+        frame = self.sender.encode(Frame(Opcode.TEXT, b"hello " * 100))
+        self.assertTrue(frame.rsv1)
+        self.assertLess(len(frame.data), 600)
+        self.assertEqual(self.receiver.decode(frame, max_size=600).data, b"hello " * 100)
+
+    def test_message_that_just_fits(self):
+        frame = self.sender.encode(Frame(Opcode.BINARY, b"\0" * 1000))
+        self.assertEqual(len(self.receiver.decode(frame, max_size=1000).data), 1000)
+
+    def test_inflating_past_max_size(self):
+        # 64 MiB of zeros compress to about 64 KiB
+        bomb = self.sender.encode(Frame(Opcode.BINARY, b"\0" * (64 * 1024 * 1024)))
+        with self.assertRaises(a2lib.wslib.PayloadTooBig):
+            self.receiver.decode(bomb, max_size=1024 * 1024)
+
+    def test_limit_spans_fragments(self):
+        frames = [self.sender.encode(frame)
+                  for frame in a2lib.wslib.fragment(Opcode.BINARY, b"\0" * 4000, fragment_size=1000)]
+        self.receiver.decode(frames[0], max_size=2500)
+        self.receiver.decode(frames[1], max_size=2500)
+        with self.assertRaises(a2lib.wslib.PayloadTooBig):
+            self.receiver.decode(frames[2], max_size=2500)
+
+    def test_decoder_applies_its_max_size(self):
+        bomb = a2lib.wslib.serialize_frame(Frame(Opcode.BINARY, b"\0" * (1024 * 1024)),
+                                           mask=False, deflate=self.sender)
+        self.assertLess(len(bomb), 64 * 1024)
+        decoder = a2lib.wslib.FrameDecoder(max_size=64 * 1024, deflate=self.receiver)
+        with self.assertRaises(a2lib.wslib.PayloadTooBig):
+            decoder.feed(bomb)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,95 +1,286 @@
 import argparse
+import asyncio
+import json
 import os
 import random
-import select
 import signal
 import socket
+import struct
 import sys
 import time
 import traceback
 from base64 import b64encode
+from collections import deque
 from hashlib import sha1
 from http import HTTPStatus
-from threading import Thread
+from urllib.parse import urlencode
 
 import a2lib.httplib
+import a2lib.statslib
 import a2lib.wslib
 from a2lib.consolelib import *
-from a2lib.main_thread_waker import MainThreadWaker, WakingMainThread
 
-stop_thread = False
+# How much a bulk producer reads from its source at a time.
+_BULK_READ_SIZE = 64 * 1024
+
+# A host of unix:/path connects to the server's Unix domain socket at /path, and takes no port.
+UNIX_PREFIX = "unix:"
+
+# Length prefix of binary records, in --records input and in the "records" output format.
+_RECORD_HEADER = struct.Struct("!I")
 
 def main():
     parser = argparse.ArgumentParser(description="WebSocket chat client.")
     parser.add_argument('host', type=str,
-                        help="the port to bind to. Setting to 0 will randomly assign.")
-    parser.add_argument('port', type=int,
-                        help="the port to bind to. Setting to 0 will randomly assign.")
+                        help="the server's host, or unix:/path to connect to its Unix domain socket.")
+    parser.add_argument('port', type=int, nargs='?',
+                        help="the server's port. Left out with a unix:/path host.")
     parser.add_argument('role', type=str, choices=['producer', 'consumer', 'both'],
                         help="the role that the client should take: 'producer', 'consumer', or 'both'.")
     parser.add_argument('-v', '--verbose', action="store_true",
                         help="whether to print verbose output. Defaults to false.")
     parser.add_argument('-t', '--timeout', type=float, default=20.0,
                         help="How long to wait for responses from the server.")
+    parser.add_argument('--room', type=str, default=None,
+                        help="the chat room to join. Defaults to the server's default room.")
+    parser.add_argument('--replay-last', type=int, default=None,
+                        help="consumer: on joining, first receive up to this many of the room's latest messages.")
+    parser.add_argument('--replay-since', type=int, default=None,
+                        help="consumer: on joining, first receive the room's cached messages after this sequence number.")
+    parser.add_argument('--seq', action="store_true",
+                        help="ask the server to prefix each message with its sequence number in the room, \"#<seq> \".")
+    parser.add_argument('--ack', action="store_true",
+                        help="consumer: acknowledge received messages, so the server only sends a window past the "
+                             "last ack and a reconnect picks up after the last one processed.")
+    parser.add_argument('--ack-every', type=int, default=100,
+                        help="with --ack, acknowledge every this many messages. Defaults to 100.")
+    parser.add_argument('--ack-interval', type=float, default=0.1,
+                        help="with --ack, acknowledge at most this many seconds after a message arrived. "
+                             "Defaults to 0.1.")
+    parser.add_argument('--reconnect', action="store_true",
+                        help="reconnect when the connection is lost, buffering sent messages meanwhile; consumers "
+                             "resume after the last sequence number they saw, if the server numbers messages.")
+    parser.add_argument('--reconnect-delay', type=float, default=0.5,
+                        help="with --reconnect, the longest delay before the first attempt, doubling with every "
+                             "failed one. Defaults to 0.5.")
+    parser.add_argument('--reconnect-max-delay', type=float, default=30.0,
+                        help="with --reconnect, the cap on the delay between attempts. Defaults to 30.0.")
+    parser.add_argument('--reconnect-attempts', type=int, default=0,
+                        help="with --reconnect, give up after this many failed attempts in a row. Defaults to 0, "
+                             "which never gives up.")
+    parser.add_argument('--buffer-messages', type=int, default=1000,
+                        help="with --reconnect, the most messages buffered while disconnected; the oldest are "
+                             "dropped past it. Defaults to 1000.")
+    parser.add_argument('--buffer-bytes', type=int, default=1024 * 1024,
+                        help="with --reconnect, the most payload bytes buffered while disconnected. Defaults to 1 MiB.")
+    parser.add_argument('--deflate', action="store_true",
+                        help="offer permessage-deflate compression to the server.")
+    parser.add_argument('--no-context-takeover', action="store_true",
+                        help="with --deflate, compress every sent message on its own instead of reusing the "
+                             "dictionary of the previous ones.")
+    parser.add_argument('--deflate-min-size', type=int, default=a2lib.wslib.DEFLATE_MIN_SIZE,
+                        help=f"with --deflate, send shorter messages uncompressed. Defaults to {a2lib.wslib.DEFLATE_MIN_SIZE}.")
+    parser.add_argument('--send-file', type=str, default=None,
+                        help="producer: send FILE ('-' for stdin) as a single binary message, streamed in fragments.")
+    parser.add_argument('--fragment-size', type=int, default=a2lib.wslib.FRAGMENT_SIZE,
+                        help=f"the fragment size --send-file sends in. Defaults to {a2lib.wslib.FRAGMENT_SIZE // 1024} KiB.")
+    parser.add_argument('--save-dir', type=str, default=None,
+                        help="consumer: stream every received binary message to its own file in this directory.")
+    parser.add_argument('--max-message-size', type=int, default=16 * 1024 * 1024,
+                        help="the largest message reassembled in memory. Defaults to 16 MiB.")
+    parser.add_argument('--stdin-batch', action="store_true",
+                        help="producer: send every line piped into stdin, batching many messages per write.")
+    parser.add_argument('--file', type=str, default=None,
+                        help="producer: send every line of FILE, batching many messages per write.")
+    parser.add_argument('--records', action="store_true",
+                        help="bulk mode: the input is records, each prefixed with its 4-byte big-endian length, "
+                             "sent as binary messages.")
+    parser.add_argument('--batch-bytes', type=int, default=64 * 1024,
+                        help="bulk mode: flush once this many bytes of frames are batched. Defaults to 64 KiB.")
+    parser.add_argument('--batch-delay', type=float, default=0.01,
+                        help="bulk mode: flush a partial batch after this many seconds. Defaults to 0.01.")
+    parser.add_argument('--nodelay', action="store_true",
+                        help="set TCP_NODELAY on the connection (disable Nagle's algorithm).")
+    parser.add_argument('--cork', action="store_true",
+                        help="set TCP_CORK around each write so batches leave in full segments (Linux only).")
+    parser.add_argument('--instrument', action="store_true",
+                        help="stamp sent messages and measure end-to-end latency and sequence gaps of received "
+                             "ones. Statistics go to stderr on exit, on SIGUSR1 and with --stats-interval.")
+    parser.add_argument('--stats-interval', type=float, default=0.0,
+                        help="with --instrument, dump the statistics every this many seconds. Disabled by default.")
+    parser.add_argument('--out', type=str, default=None,
+                        help="consumer: append received messages to this file instead of printing them.")
+    parser.add_argument('--out-format', type=str, choices=['raw', 'jsonl', 'records'], default='raw',
+                        help="format of --out: one message per line (binary ones as they are), JSON Lines with a "
+                             "receive time, or length-prefixed records. Defaults to raw.")
+    parser.add_argument('--flush-bytes', type=int, default=64 * 1024,
+                        help="write received messages out once this many bytes are buffered. Defaults to 64 KiB.")
+    parser.add_argument('--flush-interval', type=float, default=0.05,
+                        help="write buffered messages out after at most this many seconds. Defaults to 0.05.")
+    parser.add_argument('--fps', type=float, default=20.0,
+                        help="the most times per second the 'both' prompt is redrawn. Defaults to 20.")
     args = parser.parse_args()
-
-    MainThreadWaker.register()
+    if args.host.startswith(UNIX_PREFIX) and args.port is not None:
+        parser.error("a unix:/path host takes no port")
+    if not args.host.startswith(UNIX_PREFIX) and args.port is None:
+        parser.error("the port is required")
+    if args.host.startswith(UNIX_PREFIX) and (args.nodelay or args.cork):
+        parser.error("--nodelay and --cork need a TCP connection")
+    if (args.stdin_batch or args.file or args.send_file) and args.role == "consumer":
+        parser.error("--stdin-batch, --file and --send-file need the 'producer' or 'both' role")
+    if args.send_file and (args.stdin_batch or args.file):
+        parser.error("--send-file can't be combined with --stdin-batch or --file")
+    if args.records and not (args.stdin_batch or args.file):
+        parser.error("--records needs --stdin-batch or --file")
+    if args.ack and args.role != "consumer":
+        parser.error("--ack needs the 'consumer' role")
+    if args.ack and args.save_dir:
+        parser.error("--ack can't be combined with --save-dir")
+    if args.reconnect and args.send_file:
+        parser.error("--reconnect can't be combined with --send-file")
+    if args.replay_last is not None and args.replay_since is not None:
+        parser.error("--replay-last and --replay-since are mutually exclusive")
+    replay = {}
+    if args.replay_last is not None:
+        replay["last"] = args.replay_last
+    elif args.replay_since is not None:
+        replay["since"] = args.replay_since
 
     # getting all the arguments
-    host = args.host
-    port = args.port
     role = args.role
     verbose = args.verbose
     timeout = args.timeout
+    sock = None
+    session = None
+    source = None
+    send_file = None
     
     try:
-        # TCP socket
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((host, port))
-        
-        # perform websocket handshake
-        perform_handshake(host, port, role, sock)
+        # TCP socket, websocket handshake
+        (sock, decoder, deflate, subprotocol) = connect(args, replay)
+        if args.file:
+            source = open(args.file, 'rb')
+        elif args.stdin_batch:
+            source = sys.stdin.buffer
+        if args.send_file == '-':
+            send_file = sys.stdin.buffer
+        elif args.send_file:
+            send_file = open(args.send_file, 'rb')
+        reconnect = None
+        if args.reconnect:
+            reconnect = Reconnector(
+                lambda since: connect(args, replay if since is None else {"since": since}),
+                args.reconnect_delay, args.reconnect_max_delay, args.reconnect_attempts,
+                args.buffer_messages, args.buffer_bytes)
         
         # Print the connection message
         print_color("Connected (press CTRL+C to quit)", "\033[0;32;49m")
         
         # handle role (client type)
-        if role == "producer":
-            handle_producer(sock, timeout)
-        elif role == "consumer":
-            handle_consumer(sock, timeout)
-        elif role == "both":
-            handle_both(sock, timeout)
+        session = ChatSession(sock, decoder, role, timeout, source=source,
+                              batch_bytes=args.batch_bytes, batch_delay=args.batch_delay,
+                              cork=args.cork, deflate=deflate, subprotocol=subprotocol,
+                              strip_seq=not args.seq, reconnect=reconnect,
+                              ack_every=args.ack_every, ack_interval=args.ack_interval,
+                              records=args.records, send_file=send_file,
+                              fragment_size=args.fragment_size,
+                              assembler=MessageAssembler(args.max_message_size, args.save_dir),
+                              stats=a2lib.statslib.Stats() if args.instrument else None,
+                              stats_interval=args.stats_interval,
+                              output=MessageOutput(args.out, args.out_format, args.flush_bytes,
+                                                   args.flush_interval, prompt=(role == "both"),
+                                                   fps=args.fps))
+        asyncio.run(session.run())
             
     except Exception as e:
         print(f"Error: {e}")
     finally:
-        try:
-            send_frame(sock, a2lib.wslib.Opcode.CLOSE)
-        except Exception as e:
-            pass
-        sock.close()
+        close = b''
+        if session is not None:
+            sock = session.sock  # it may have reconnected, or given up
+            if session.close_reason is not None:
+                close = session.close_reason.serialize()
+        if sock is not None:
+            try:
+                send_frame(sock, a2lib.wslib.Opcode.CLOSE, close)
+            except Exception as e:
+                pass
+            sock.close()
+        if args.file and source:
+            source.close()
+        if send_file is not None and send_file is not sys.stdin.buffer:
+            send_file.close()
         print("Connection closed.")
         print("Exiting successfully.")
 
+def connect(args, replay=None):
+    """Connects to the server and performs the websocket handshake. Returns the socket, a
+    FrameDecoder for it, the negotiated PerMessageDeflate (or None) and subprotocol."""
+    if args.host.startswith(UNIX_PREFIX):
+        # the same handshake and framing, minus the loopback TCP stack
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        (address, host, port) = (args.host[len(UNIX_PREFIX):], "localhost", None)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        (address, host, port) = ((args.host, args.port), args.host, args.port)
+    try:
+        sock.connect(address)
+        if args.nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        offer = a2lib.wslib.deflate_offer(args.no_context_takeover) if args.deflate else None
+        if args.ack:
+            subprotocol = "chat.ack, chat.seq, chat"
+        elif args.seq:
+            subprotocol = "chat.seq"
+        elif args.reconnect and args.role != "producer":
+            # numbered messages let a consumer resume where it left off, if the server has them
+            subprotocol = "chat.seq, chat"
+        else:
+            subprotocol = "chat"
+        (leftover, headers) = perform_handshake(host, port, args.role, sock, args.room,
+                                                replay, subprotocol, offer)
+    except BaseException:
+        sock.close()
+        raise
+    deflate = None
+    if offer is not None:
+        deflate = a2lib.wslib.accept_deflate(headers["Sec-WebSocket-Extensions"],
+                                             args.deflate_min_size)
+        if deflate is None:
+            print("The server declined compression.")
+    # no single frame is read in whole past the limit either, even with --save-dir
+    decoder = a2lib.wslib.FrameDecoder(leftover, max_size=args.max_message_size, deflate=deflate)
+    return (sock, decoder, deflate, headers.get("Sec-WebSocket-Protocol"))
+
 # Handshake protocol   
-def perform_handshake(host, port, role, sock):
-    request, websocket_key = establish_handshake(host, port, role)
+def perform_handshake(host, port, role, sock, room=None, replay=None, subprotocol="chat",
+                      extensions=None):
+    """Returns any bytes the server sent after its response (i.e. the first frames), and the
+    response headers, for the extensions and subprotocol it accepted."""
+    request, websocket_key = establish_handshake(host, port, role, room, replay, subprotocol,
+                                                 extensions)
     sock.sendall(request.serialize())
-    response = a2lib.httplib.get_http_response(sock)
+    response, leftover = a2lib.httplib.read_http_response(sock)
     validate_handshake(response, websocket_key)
+    return leftover, response.headers
     
-def establish_handshake(host, port, role):
+def establish_handshake(host, port, role, room=None, replay=None, subprotocol="chat",
+                        extensions=None):
     websocket_key = b64encode(os.urandom(16))
     headers = {
-        "Host": f"{host}:{port}",
+        "Host": host if port is None else f"{host}:{port}",
         "Upgrade": "websocket",
         "Connection": "Upgrade",
         "Sec-Websocket-Key": f"{websocket_key.decode('utf-8')}",
-        "Sec-Websocket-Protocol": "chat",
+        "Sec-Websocket-Protocol": subprotocol,
         "Sec-Websocket-Version": "13"
     }
-    request = a2lib.httplib.HttpRequest("GET", f"/{role}", headers)
+    if extensions:
+        headers["Sec-Websocket-Extensions"] = extensions
+    path = f"/{role}/{room}" if room else f"/{role}"
+    if replay:
+        path += "?" + urlencode(replay)
+    request = a2lib.httplib.HttpRequest("GET", path, headers)
     return request, websocket_key
     
 def validate_handshake(response: a2lib.httplib.HttpResponse, websocket_key: bytes):
@@ -101,183 +292,794 @@ def validate_handshake(response: a2lib.httplib.HttpResponse, websocket_key: byte
     if accept_key != expected_key:
         raise Exception("Invalid Sec-WebSocket-Accept")
 
-# send, receive & close frames
+# send & close frames
 def send_frame(sock, opcode, payload=b''):
     frame = a2lib.wslib.Frame(opcode, payload)
     serialized_frame = a2lib.wslib.serialize_frame(frame)
     sock.sendall(serialized_frame)
 
-def receive_frame(sock):
-    frame_data = sock.recv(a2lib.httplib._RECV_BUFFER_SIZE)
-    frame = a2lib.wslib.parse_frame(frame_data)
-    if frame:
-        return frame
-    else:
-        raise Exception("Failed to parse frame")
-    
-def close_frame(sock, frame):
-    # wrap close object with a close frame
-    close_frame = a2lib.wslib.wrap_close(a2lib.wslib.parse_close(frame))
-    # then let the server know that the client side is closing
-    sock.sendall(a2lib.wslib.serialize_frame(close_frame))
-
-# send PONG response
-def pong_response(sock, frame):
-    if frame.opcode == a2lib.wslib.Opcode.PING:
-        send_frame(sock, a2lib.wslib.Opcode.PONG, frame.data)
-        print('do ping-pong')
-    elif frame.opcode == a2lib.wslib.Opcode.CLOSE:
-        close_frame(sock, frame)
-        return True
-    return False
-
-# helpers
-# take user message
-def handle_user_input(sock, timeout):
-    global stop_thread
-    end_time = time.time() + timeout
-    # initialize the first '>'
-    sys.stdout.write('> ')
-    sys.stdout.flush()
-    while not stop_thread and time.time() < end_time:
+def close_frame(frame):
+    # wrap close object with a close frame (a close frame without a body is echoed as is)
+    if not frame.data:
+        return a2lib.wslib.Frame(a2lib.wslib.Opcode.CLOSE, b'')
+    return a2lib.wslib.wrap_close(a2lib.wslib.parse_close(frame))
+
+# output stage
+class MessageOutput:
+    """Renders received messages and writes them out in batches.
+
+    Rendered lines are buffered and written with a single write() once `flush_bytes` have
+    built up, or `flush_interval` seconds after the first of them arrived. ANSI styling is
+    left out unless stdout is a terminal. With `prompt`, the '> ' input prompt is redrawn
+    after each batch, which happens at most `fps` times a second.
+
+    Given an `out_path`, messages are appended there (raw lines, JSON Lines with the time they
+    were received, or length-prefixed records) through a large file buffer instead of going
+    to the console. Binary messages are passed in as memoryviews and queued as they are."""
+
+    def __init__(self, out_path=None, out_format="raw", flush_bytes=64 * 1024,
+                 flush_interval=0.05, prompt=False, fps=20.0):
+        self.out_format = out_format
+        self.flush_bytes = flush_bytes
+        if out_path is None:
+            self._file = None
+            self._stream = sys.stdout.buffer
+            self._styled = sys.stdout.isatty()
+        else:
+            self._file = self._stream = open(out_path, 'ab', buffering=1024 * 1024)
+            self._styled = False
+        self.prompt = prompt and self._styled
+        self.flush_interval = max(flush_interval, 1.0 / fps) if self.prompt else flush_interval
+        self._pending = []
+        self._pending_bytes = 0
+        self._timer = None
+
+    def message(self, data):
+        if self._file is None:
+            if self._styled:
+                line = b"\033[0;34;49m< " + data + b"\033[0m\n"
+            else:
+                line = b"< " + data + b"\n"
+        elif self.out_format == "jsonl":
+            record = {"time": time.time(), "message": data.decode('utf-8')}
+            line = json.dumps(record).encode() + b"\n"
+        elif self.out_format == "records":
+            self._queue(_RECORD_HEADER.pack(len(data)), data)
+            return
+        else:
+            line = data + b"\n"
+        self._queue(line)
+
+    def binary(self, data: memoryview):
+        if self._file is None:
+            self.message(f"[binary message, {len(data)} bytes]".encode())
+        elif self.out_format == "jsonl":
+            record = {"time": time.time(), "binary": b64encode(data).decode()}
+            self._queue(json.dumps(record).encode() + b"\n")
+        elif self.out_format == "records":
+            self._queue(_RECORD_HEADER.pack(len(data)), data)
+        else:
+            self._queue(data)
+
+    def _queue(self, *chunks):
+        self._pending.extend(chunks)
+        self._pending_bytes += sum(len(chunk) for chunk in chunks)
+        if self._pending_bytes >= self.flush_bytes:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self.flush)
+
+    def flush(self, to_os=False):
+        """Writes out what's pending. With `to_os`, a file's buffer is emptied into it too."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            data = b"".join(self._pending)
+            self._pending.clear()
+            self._pending_bytes = 0
+            if self._file is None:
+                if self.prompt:
+                    # clear the '>' line, write the batch, then reprint the input prompt
+                    data = b"\n\033[F\033[K" + data + b"> "
+                sys.stdout.flush()  # anything print()ed so far goes first
+                self._stream.write(data)
+                self._stream.flush()
+            else:
+                self._stream.write(data)
+        if to_os and self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+
+# client engine
+def split_records(data):
+    """Splits length-prefixed records off the front of `data`. Returns the records, as
+    memoryviews into `data`, and whatever is left of an incomplete last record."""
+    view = memoryview(data)
+    records = []
+    pos = 0
+    while len(data) - pos >= _RECORD_HEADER.size:
+        (length,) = _RECORD_HEADER.unpack_from(data, pos)
+        end = pos + _RECORD_HEADER.size + length
+        if end > len(data):
+            break
+        records.append(view[pos + _RECORD_HEADER.size:end])
+        pos = end
+    return records, bytes(view[pos:])
+
+class MessageAssembler:
+    """Puts fragmented messages back together.
+
+    Fragments are collected in one buffer, reused from message to message, up to `max_size`
+    bytes. Given a `save_dir`, binary messages are instead streamed into a new file there a
+    fragment at a time, so memory use is bounded by the fragment size however large the
+    message is."""
+
+    def __init__(self, max_size=16 * 1024 * 1024, save_dir=None):
+        self.max_size = max_size
+        self.save_dir = save_dir
+        self.saved = 0
+        self._opcode = None
+        self._buffer = bytearray()
+        self._file = None
+        self._path = None
+        self._size = 0
+
+    def feed(self, frame):
+        """Takes a TEXT, BINARY or CONT frame. Returns (opcode, data) once a message is
+        complete, where data is the path of the file for a saved binary message."""
+        if frame.opcode == a2lib.wslib.Opcode.CONT:
+            if self._opcode is None:
+                raise a2lib.wslib.ProtocolError("unexpected continuation frame")
+        else:
+            if self._opcode is not None:
+                raise a2lib.wslib.ProtocolError("expected a continuation frame")
+            if frame.fin and (frame.opcode == a2lib.wslib.Opcode.TEXT or self.save_dir is None):
+                # unfragmented: nothing to copy, but it may have been inflated past the limit
+                if len(frame.data) > self.max_size:
+                    raise a2lib.wslib.PayloadTooBig(f"message over {self.max_size} bytes")
+                return (frame.opcode, frame.data)
+            self._opcode = frame.opcode
+            self._size = 0
+            if frame.opcode == a2lib.wslib.Opcode.BINARY and self.save_dir is not None:
+                self.saved += 1
+                self._path = os.path.join(self.save_dir, f"message-{os.getpid()}-{self.saved:06d}.bin")
+                self._file = open(self._path, 'wb')
+
+        self._size += len(frame.data)
+        if self._file is not None:
+            self._file.write(frame.data)
+        elif self._size > self.max_size:
+            self.reset()
+            raise a2lib.wslib.PayloadTooBig(f"message over {self.max_size} bytes")
+        else:
+            self._buffer += frame.data
+        if not frame.fin:
+            return None
+
+        opcode = self._opcode
+        if self._file is not None:
+            data = self._path
+        else:
+            data = bytes(self._buffer)
+        self.reset()
+        return (opcode, data)
+
+    def reset(self):
+        if self._file is not None:
+            self._file.close()
+        self._opcode = self._file = self._path = None
+        self._buffer.clear()
+
+class Reconnector:
+    """How a session gets its connection back once it's lost.
+
+    `connect(since)` opens a new connection, resuming after sequence number `since` when it
+    isn't None, and returns what connect() does. Attempts are spaced out by exponential
+    backoff with full jitter: a random delay of up to `base_delay` * 2^(failed attempts so
+    far), capped at `max_delay`, so clients that lost the same server don't all come back at
+    once. Messages sent meanwhile are buffered, up to `buffer_messages` and `buffer_bytes`."""
+
+    def __init__(self, connect, base_delay=0.5, max_delay=30.0, max_attempts=0,
+                 buffer_messages=1000, buffer_bytes=1024 * 1024):
+        self.connect = connect
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.buffer_messages = buffer_messages
+        self.buffer_bytes = buffer_bytes
+        self.reconnects = 0
+        self.failures = 0
+        self.dropped = 0
+        self.lost_bytes = 0
+
+    def delay(self, attempt):
+        return random.uniform(0.0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+class ChatSession:
+    """Runs one connected client (any role) on a single asyncio event loop.
+
+    The socket, stdin, server pings and the inactivity deadline are all multiplexed on the
+    loop. The deadline is a timer that re-arms itself when there has been activity since it
+    was set, rather than something checked in a polling loop.
+
+    With a `source` (a binary file or pipe) the session is a bulk producer: every line of the
+    source is sent, with frames batched into one write per `batch_bytes`, or per
+    `batch_delay` seconds when the source is slower than that.
+
+    With `stats`, sent messages are stamped with a sequence number and send time, and the
+    stamps of received messages feed end-to-end latency and sequence gap statistics.
+
+    With `records`, the source holds length-prefixed records instead of lines, each sent as a
+    binary message.
+
+    With a `send_file`, the session streams the file as one binary message of `fragment_size`
+    fragments, with one fragment in flight at a time. Received fragments are put back together
+    by `assembler`, a MessageAssembler.
+
+    Received messages are written out through `output`, a MessageOutput. Sent frames are
+    compressed with `deflate` when the handshake negotiated it (the decoder takes care of
+    received ones). With the "chat.seq" `subprotocol`, the sequence number of each received
+    message is noted, and stripped from it with `strip_seq`. With "chat.ack", binary messages
+    are numbered too, and once `ack_every` messages have been written out, or `ack_interval`
+    seconds after the first of them, the output is flushed and the last number sent back as a
+    cumulative ack.
+
+    With a `reconnect`, a Reconnector, a lost connection is replaced rather than ending the
+    session. Messages sent while disconnected are buffered and go out in one write once the
+    new handshake is done; a bulk producer just stops reading its source until then. What
+    was in flight when the connection went is lost, and counted."""
+
+    def __init__(self, sock, decoder, role, timeout, source=None,
+                 batch_bytes=64 * 1024, batch_delay=0.01, cork=False, deflate=None,
+                 subprotocol=None, strip_seq=False, reconnect=None, ack_every=100, ack_interval=0.1,
+                 records=False, send_file=None, fragment_size=a2lib.wslib.FRAGMENT_SIZE,
+                 assembler=None,
+                 stats=None, stats_interval=0.0, output=None):
+        self.sock = sock
+        self.decoder = decoder
+        self.role = role
+        self.timeout = timeout
+        self.source = source
+        self.batch_bytes = batch_bytes
+        self.batch_delay = batch_delay
+        self.cork = cork
+        self.deflate = deflate
+        self.subprotocol = subprotocol
+        self.strip_seq = strip_seq
+        self.reconnect = reconnect
+        self.last_seq = None
+        self.acked_seq = None
+        self.ack_every = ack_every
+        self.ack_interval = ack_interval
+        self.records = records
+        self.send_file = send_file
+        self.fragment_size = fragment_size
+        self.assembler = assembler or MessageAssembler()
+        self.stats = stats
+        self.stats_interval = stats_interval
+        self.output = output or MessageOutput(prompt=(role == "both"))
+        # why the client is closing the connection, when it's for something the server sent
+        self.close_reason = None
+        self._seq = 0
+        self._last_seqs = {}
+        self._loop = None
+        self._done = None
+        self._outbox = None
+        self._deadline = None
+        self._last_activity = 0.0
+        self._connected = None
+        self._reader = None
+        self._writer = None
+        self._reconnecting = None
+        self._buffer = deque()
+        self._buffered_bytes = 0
+        self._unacked = 0
+        self._ack_timer = None
+
+    async def run(self):
+        """Runs until the server closes the connection, the timeout passes without activity,
+        stdin runs out (producers only) or the user presses Ctrl+C."""
+        self._loop = asyncio.get_running_loop()
+        self._done = self._loop.create_future()
+        self._outbox = asyncio.Queue()
+        self._connected = asyncio.Event()
+        self._connected.set()
+        self._loop.add_signal_handler(signal.SIGINT, self._finish, "interrupted")
+        if self.stats is not None or self.reconnect is not None:
+            self._loop.add_signal_handler(signal.SIGUSR1, self._dump_stats)
+
+        self._start_io()
+        tasks = []
+        reading_stdin = False
+        if self.source is not None:
+            tasks.append(asyncio.create_task(self._produce_bulk()))
+        elif self.send_file is not None:
+            tasks.append(asyncio.create_task(self._send_file()))
+        elif self.role in ["producer", "both"]:
+            # initialize the first '>'
+            sys.stdout.write('> ')
+            sys.stdout.flush()
+            try:
+                self._loop.add_reader(sys.stdin, self._read_input)
+                reading_stdin = True
+            except PermissionError:
+                # stdin is a regular file, which can't be polled
+                tasks.append(asyncio.create_task(self._read_input_file()))
+        if self.stats is not None and self.stats_interval > 0:
+            tasks.append(asyncio.create_task(self._report_stats()))
+
+        self._touch()
+        self._deadline = self._loop.call_later(self.timeout, self._check_deadline)
         try:
-            if select.select([sys.stdin], [], [], 1)[0]:
-                sys.stdout.write('> ')
-                sys.stdout.flush()
-                message = input()
-                
-                # handle potential errors due to not able to encode special characters
+            reason = await self._done
+            if reason != "interrupted":
+                # let queued messages (and any close echo) reach the server
                 try:
-                    message_encoded = message.encode('utf-8')
-                except UnicodeEncodeError:
-                    print("Error: Invalid characters detected. Please enter text using a compatible encoding.")
-                    sys.stdout.write('> ')
-                    sys.stdout.flush()
-                    continue  # Skip to next iteration of the loop
-                
-                if message:  # Only send if there's actual input
-                    send_frame(sock, a2lib.wslib.Opcode.TEXT, message_encoded)
-                    end_time = time.time() + timeout  # Reset timeout
-        except (KeyboardInterrupt, EOFError):
-            break
-    if time.time() >= end_time:
-        print("\nTimeout reached, closing client side...")
-        stop_thread = True
-
-# get server frame (no messages from other users/clients)
-def handle_server_frames(sock):
-    global stop_thread
-    while not stop_thread:
+                    await asyncio.wait_for(self._outbox.join(), self.timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._deadline.cancel()
+            if self._ack_timer is not None:
+                self._ack_timer.cancel()
+            if reading_stdin:
+                self._loop.remove_reader(sys.stdin)
+            self._loop.remove_signal_handler(signal.SIGINT)
+            if self.stats is not None or self.reconnect is not None:
+                self._loop.remove_signal_handler(signal.SIGUSR1)
+            tasks += [self._reader, self._writer]
+            if self._reconnecting is not None:
+                tasks.append(self._reconnecting)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.assembler.reset()
+            self.output.close()
+            if self._done.done() and self._done.result() == "timeout":
+                print("\nTimeout reached, closing client side...")
+            if self.stats is not None or self.reconnect is not None:
+                self._dump_stats()
+            if self.sock is not None:
+                self.sock.setblocking(True)
+
+    def send(self, opcode, payload=b''):
+        if not self._connected.is_set():
+            self._buffer_message(opcode, payload)
+            return
+        self.send_serialized(a2lib.wslib.serialize_frame(a2lib.wslib.Frame(opcode, payload),
+                                                         deflate=self.deflate))
+
+    def send_serialized(self, data):
+        self._outbox.put_nowait(data)
+
+    def _stamp(self, payload):
+        self._seq += 1
+        self.stats.count("sent")
+        return a2lib.statslib.stamp(payload, self._seq)
+
+    def _record_delivery(self, data):
+        """Records the latency and sequence gap of a received message, returning it unstamped."""
+        stamped = a2lib.statslib.parse_stamp(data)
+        if stamped is None:
+            self.stats.count("unstamped")
+            return data
+        (source, seq, sent, data) = stamped
+        self.stats.histogram("latency_us").record((time.time_ns() - sent) // 1000)
+        self.stats.count("received")
+        last = self._last_seqs.get(source)
+        if last is not None and seq != last + 1:
+            if seq > last + 1:
+                self.stats.count("missing", seq - last - 1)
+            else:
+                self.stats.count("out_of_order")
+        self._last_seqs[source] = seq
+        return data
+
+    def _buffer_message(self, opcode, payload):
+        # like a slow consumer on the server, the oldest messages give way to the newest
+        self._buffer.append((opcode, payload))
+        self._buffered_bytes += len(payload)
+        while (len(self._buffer) > self.reconnect.buffer_messages
+               or self._buffered_bytes > self.reconnect.buffer_bytes):
+            self._buffered_bytes -= len(self._buffer.popleft()[1])
+            self.reconnect.dropped += 1
+
+    def _take_seq(self, data, strip=False):
+        """Notes the sequence number of a "#<seq> " prefixed message, returning the message
+        without it if it's to be stripped."""
+        if data[:1] == b'#':
+            (tag, _, rest) = data.partition(b' ')
+            if tag[1:].isdigit():
+                seq = int(tag[1:])
+                # only with chat.ack is every message numbered, so a skipped number is a loss
+                if (self.subprotocol == "chat.ack" and self.last_seq is not None
+                        and seq > self.last_seq + 1):
+                    print(f"\nMissed messages {self.last_seq + 1} to {seq - 1}, no longer held "
+                          f"by the server", file=sys.stderr, flush=True)
+                self.last_seq = seq
+                if strip or self.strip_seq:
+                    return rest
+        return data
+
+    def _processed(self):
+        self._unacked += 1
+        if self._unacked >= self.ack_every:
+            self._send_ack()
+        elif self._ack_timer is None:
+            self._ack_timer = self._loop.call_later(self.ack_interval, self._send_ack)
+
+    def _send_ack(self):
+        if self._ack_timer is not None:
+            self._ack_timer.cancel()
+            self._ack_timer = None
+        self._unacked = 0
+        if self.last_seq is not None and self._connected.is_set():
+            # acked means written out, not just buffered
+            self.output.flush(to_os=True)
+            self.send(a2lib.wslib.Opcode.TEXT, str(self.last_seq).encode())
+            self.acked_seq = self.last_seq
+
+    def _dump_stats(self):
+        if self.stats is not None:
+            print(self.stats.report(), file=sys.stderr, flush=True)
+        if self.reconnect is not None:
+            print(self._reconnect_status(), file=sys.stderr, flush=True)
+
+    def _reconnect_status(self):
+        r = self.reconnect
+        return (f"reconnects: {r.reconnects}, failed attempts: {r.failures}, "
+                f"buffered: {len(self._buffer)} messages ({self._buffered_bytes} bytes), "
+                f"dropped: {r.dropped}, lost in flight: {r.lost_bytes} bytes")
+
+    async def _report_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            self._dump_stats()
+
+    def _finish(self, reason):
+        if not self._done.done():
+            self._done.set_result(reason)
+
+    def _touch(self):
+        self._last_activity = self._loop.time()
+
+    def _check_deadline(self):
+        remaining = self._last_activity + self.timeout - self._loop.time()
+        if self._reconnecting is not None:
+            remaining = self.timeout  # waiting for the server isn't inactivity
+        if remaining > 0:
+            self._deadline = self._loop.call_later(remaining, self._check_deadline)
+        else:
+            self._finish("timeout")
+
+    def _start_io(self):
+        self.sock.setblocking(False)
+        self._reader = asyncio.create_task(self._read_frames())
+        self._writer = asyncio.create_task(self._write_frames())
+
+    def _connection_lost(self, reason):
+        if self.reconnect is None or self._done.done():
+            self._finish("closed")
+        elif self._reconnecting is None:
+            print(f"\nConnection lost ({reason}), reconnecting...", file=sys.stderr, flush=True)
+            self._connected.clear()
+            self._reconnecting = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        for task in [self._reader, self._writer]:
+            task.cancel()
+        await asyncio.gather(self._reader, self._writer, return_exceptions=True)
+        # whatever the writer hadn't sent yet was serialized for the old connection
+        while not self._outbox.empty():
+            self.reconnect.lost_bytes += len(self._outbox.get_nowait())
+            self._outbox.task_done()
+        self.sock.close()
+        self.assembler.reset()
+
+        # an acking consumer resumes after its last ack (so what came after it may come twice),
+        # before the first one with the replay it originally asked for
+        since = self.acked_seq if self.subprotocol == "chat.ack" else self.last_seq
+        attempt = 0
+        while True:
+            await asyncio.sleep(self.reconnect.delay(attempt))
+            try:
+                (sock, decoder, deflate, subprotocol) = await self._loop.run_in_executor(
+                    None, self.reconnect.connect, since)
+                break
+            except Exception as e:
+                attempt += 1
+                self.reconnect.failures += 1
+                print(f"Reconnect attempt {attempt} failed: {e}", file=sys.stderr, flush=True)
+                if self.reconnect.max_attempts and attempt >= self.reconnect.max_attempts:
+                    self.sock = None  # closed above, so there's nothing left to close
+                    self._finish("closed")
+                    return
+
+        (self.sock, self.decoder, self.deflate, self.subprotocol) = (sock, decoder, deflate,
+                                                                     subprotocol)
+        self.reconnect.reconnects += 1
+        self._reconnecting = None
+        self._start_io()
+        if self._buffer:
+            self.send_serialized(b''.join(
+                a2lib.wslib.serialize_frame(a2lib.wslib.Frame(opcode, payload), deflate=self.deflate)
+                for (opcode, payload) in self._buffer))
+            self._buffer.clear()
+            self._buffered_bytes = 0
+        self._connected.set()
+        self._touch()
+        print(f"Reconnected ({self._reconnect_status()})", file=sys.stderr, flush=True)
+
+    async def _write_frames(self):
+        # one sendall() for everything queued since the last one
+        while True:
+            pending = [await self._outbox.get()]
+            while not self._outbox.empty():
+                pending.append(self._outbox.get_nowait())
+            data = b''.join(pending)
+            try:
+                if self.cork:
+                    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+                await self._loop.sock_sendall(self.sock, data)
+                if self.cork:
+                    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+            except OSError as e:
+                print(f"Error sending frames: {e}")
+                if self.reconnect is not None:
+                    self.reconnect.lost_bytes += len(data)
+                self._connection_lost(e)
+                return
+            finally:
+                # also when it failed or was cancelled, so nothing waits on the queue forever
+                for _ in pending:
+                    self._outbox.task_done()
+
+    async def _read_frames(self):
         try:
-            # Receive frame from server
-            frame = receive_frame(sock)
-            if frame.opcode == a2lib.wslib.Opcode.PING:
-                pong_response(sock, frame)
-            elif frame.opcode == a2lib.wslib.Opcode.CLOSE:
-                stop_thread = True
-                close_frame(sock, frame)
-                return True  # Exit the loop on close frame
-        except Exception as e:
+            # frames that arrived along with the handshake response come first
+            frames = self.decoder.feed(b'')
+            while not self._done.done():
+                for frame in frames:
+                    self._handle_frame(frame)
+                    if self._done.done():
+                        break
+                frames = await self.decoder.sock_recv(self._loop, self.sock)
+        except OSError as e:
             print(f"Error handling server frames: {e}")
-            break
+            self._connection_lost(e)
+        except a2lib.wslib.PayloadTooBig as e:
+            print(f"Error handling server frames: {e}")
+            self.close_reason = a2lib.wslib.Close(a2lib.wslib.CloseCode.MESSAGE_TOO_BIG, "")
+            self._finish("closed")
+        except a2lib.wslib.ProtocolError as e:
+            print(f"Error handling server frames: {e}")
+            self.close_reason = a2lib.wslib.Close(a2lib.wslib.CloseCode.PROTOCOL_ERROR, "")
+            self._finish("closed")
+
+    def _handle_frame(self, frame):
+        if frame.opcode == a2lib.wslib.Opcode.PING:
+            # send PONG response
+            self.send(a2lib.wslib.Opcode.PONG, frame.data)
+            print('do ping-pong')
+        elif frame.opcode == a2lib.wslib.Opcode.CLOSE:
+            # let the server know that the client side is closing
+            echo = a2lib.wslib.serialize_frame(close_frame(frame))
+            if self.reconnect is None:
+                self.send_serialized(echo)
+                self._finish("closed")
+            else:
+                # the writer is about to be replaced, so the echo can't wait in its queue
+                try:
+                    self.sock.send(echo)
+                except OSError:
+                    pass
+                self._connection_lost("closed by the server")
+        else:
+            if self.role == "consumer":
+                self._touch()  # Reset timeout, on every fragment of a long message too
+            message = self.assembler.feed(frame)
+            if message is None or self.role == "producer":
+                return
+            (opcode, data) = message
+            binary = opcode == a2lib.wslib.Opcode.BINARY
+            acking = self.subprotocol == "chat.ack"
+            if acking or (self.subprotocol == "chat.seq" and not binary):
+                # a binary message's number is never part of its payload
+                data = self._take_seq(data, strip=binary)
+            if not binary:
+                if self.stats is not None:
+                    data = self._record_delivery(data)
+                self.output.message(data)
+            elif self.assembler.save_dir is not None:
+                self.output.message(f"[binary message saved to {data}]".encode())
+            else:
+                self.output.binary(memoryview(data))
+            if acking:
+                self._processed()
+
+    # bulk producer
+    async def _produce_bulk(self):
+        sent = skipped = 0
+        opcode = a2lib.wslib.Opcode.BINARY if self.records else a2lib.wslib.Opcode.TEXT
+        batch = []
+        batch_size = 0
+        batch_started = 0.0
+        partial = b''
+        start = time.perf_counter()
+
+        async def flush():
+            nonlocal batch_size
+            # keep at most one batch in flight behind the writer, and none while reconnecting
+            await self._outbox.join()
+            await self._connected.wait()
+            # serialized only now, for whichever connection is current
+            self.send_serialized(b''.join(
+                a2lib.wslib.serialize_frame(a2lib.wslib.Frame(opcode, message), deflate=self.deflate)
+                for message in batch))
+            batch.clear()
+            batch_size = 0
+            self._touch()
+
+        read = None
+        while True:
+            if read is None:
+                read = asyncio.ensure_future(self._read(self.source, _BULK_READ_SIZE))
+            wait = None
+            if batch:
+                wait = max(0.0, batch_started + self.batch_delay - self._loop.time())
+            done, _ = await asyncio.wait([read], timeout=wait)
+            if not done:
+                # the source is slow: don't hold on to what we have
+                await flush()
+                continue
+            chunk = read.result()
+            read = None
+            if self.records:
+                (messages, partial) = split_records(partial + chunk)
+                if partial and not chunk:
+                    skipped += 1  # the source ended halfway through a record
+            else:
+                lines = (partial + chunk).split(b'\n') if chunk else [partial, b'']
+                partial = lines.pop()
+                messages = []
+                for line in lines:
+                    line = line.rstrip(b'\r')
+                    if not line:
+                        continue
+                    try:
+                        line.decode('utf-8')
+                    except UnicodeDecodeError:
+                        skipped += 1
+                        continue
+                    if self.stats is not None:
+                        line = self._stamp(line)
+                    messages.append(line)
+            if messages and not batch:
+                batch_started = self._loop.time()
+            batch += messages
+            batch_size += sum(map(len, messages))
+            sent += len(messages)
+            if batch_size >= self.batch_bytes or (batch and not chunk):
+                await flush()
+            if not chunk:
+                break
 
-# get server frame as well as message sent to server by other users/clients
-def handle_server_frames_both(sock):
-    global stop_thread
-    while not stop_thread:
+        await self._outbox.join()
+        elapsed = time.perf_counter() - start
+        rate = sent / elapsed if elapsed > 0 else 0.0
+        what = "truncated records" if self.records else "lines that weren't UTF-8"
+        print(f"\nSent {sent} messages in {elapsed:.2f}s ({rate:.0f} msg/s)"
+              + (f", skipped {skipped} {what}" if skipped else ""))
+        if self.role == "producer":
+            self._finish("eof")
+
+    async def _send_file(self):
+        """Streams `send_file` as one BINARY message, reading the next fragment while the
+        previous one is written. Like read_fragments(), it reads a fragment ahead to know
+        which one is the last."""
+        sent = 0
+        start = time.perf_counter()
+        opcode = a2lib.wslib.Opcode.BINARY
+        chunk = await self._read_fragment()
+        while True:
+            following = await self._read_fragment() if chunk else b''
+            frame = a2lib.wslib.Frame(opcode, chunk, not following)
+            await self._outbox.join()
+            self.send_serialized(a2lib.wslib.serialize_frame(frame, deflate=self.deflate))
+            sent += len(frame.data)
+            self._touch()
+            if not following:
+                break
+            (opcode, chunk) = (a2lib.wslib.Opcode.CONT, following)
+
+        await self._outbox.join()
+        elapsed = time.perf_counter() - start
+        rate = sent / elapsed / (1024 * 1024) if elapsed > 0 else 0.0
+        print(f"\nSent {sent} bytes in {elapsed:.2f}s ({rate:.1f} MiB/s)")
+        if self.role == "producer":
+            self._finish("eof")
+
+    async def _read_fragment(self):
+        """Reads a whole `fragment_size` from `send_file`, or what's left of it."""
+        chunks = []
+        size = 0
+        while size < self.fragment_size:
+            chunk = await self._read(self.send_file, self.fragment_size - size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        return b''.join(chunks)
+
+    async def _read(self, source, size):
+        """Reads up to `size` bytes from the binary file `source`, waiting for a pipe or
+        terminal to be readable on the loop rather than in a thread, which would hold up
+        exiting until the read returned. A regular file can't be polled, but never blocks
+        either, so it's read in the executor."""
+        fd = source.fileno()
+        ready = self._loop.create_future()
         try:
-            # Receive frame from server
-            frame = receive_frame(sock)
-            if frame.opcode == a2lib.wslib.Opcode.PING:
-                pong_response(sock, frame)
-            elif frame.opcode == a2lib.wslib.Opcode.CLOSE:
-                stop_thread = True
-                close_frame(sock, frame)
-                return True  # Exit the loop on close frame
-            elif frame.opcode == a2lib.wslib.Opcode.TEXT:
-                # make a newline and clear '>' for incoming messages
-                sys.stdout.write("\n\033[F\033[K")
-                print_color(f"< {frame.data.decode('utf-8')}", "\033[0;34;49m")
-                sys.stdout.write('> ')  # Reprint the input prompt
-                sys.stdout.flush()
-        except Exception as e:
-            print(f"Error handling server frames: {e}")
-            break
+            self._loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        except PermissionError:
+            return await self._loop.run_in_executor(None, source.read1, size)
+        try:
+            await ready
+        finally:
+            self._loop.remove_reader(fd)
+        # bypasses the file's buffer, which nothing else reads through
+        return os.read(fd, size)
 
-# handle roles
-def handle_producer(sock, t_out):
-    # Create threads for handling user and server frames
-    user_thread = Thread(target=handle_user_input, args=(sock, t_out))
-    user_thread.daemon = True
-    server_thread = Thread(target=handle_server_frames, args=(sock,))
-    
-    def handle_ctrl_c(sig, frame):
-        global stop_thread
-        stop_thread = True
-        user_thread.join(timeout=0)
-        server_thread.join(timeout=0)
-        sys.exit(0)
-    signal.signal(signal.SIGINT, handle_ctrl_c)
-
-    # Start the threads
-    user_thread.start()
-    server_thread.start()
-
-    # wait for server thread but not user thread
-    server_thread.join()
-    
-    if user_thread.is_alive():
-        user_thread.join(timeout=0)
+    # take user message
+    def _read_input(self):
+        self._handle_input(sys.stdin.readline())
 
-def handle_consumer(sock, t_out):
-    end_time = time.time() + t_out
-    while True and time.time() < end_time:
+    async def _read_input_file(self):
+        line = None
+        while line != '' and not self._done.done():
+            line = await self._loop.run_in_executor(None, sys.stdin.readline)
+            self._handle_input(line)
+
+    def _handle_input(self, line):
+        if not line:
+            # EOF: a producer has nothing left to do, 'both' keeps receiving
+            if self.role == "producer":
+                self._finish("eof")
+            else:
+                self._loop.remove_reader(sys.stdin)
+            return
+        sys.stdout.write('> ')
+        sys.stdout.flush()
+        message = line.rstrip('\n')
+
+        # handle potential errors due to not able to encode special characters
         try:
-            # check if the socket is ready for reading
-            ready, _, _ = select.select([sock], [], [], t_out)
-            if sock in ready:
-                frame = receive_frame(sock)
-                if pong_response(sock, frame):
-                    break
-                if frame.opcode == a2lib.wslib.Opcode.TEXT:
-                    print_color(f"< {frame.data.decode('utf-8')}", "\033[0;34;49m")
-                    end_time = time.time() + t_out  # Reset timeout
-        except (KeyboardInterrupt, EOFError):
-            break
-    if time.time() >= end_time:
-        print("\nTimeout reached, closing client side...")
-        return True
-
-def handle_both(sock, t_out):
-    # Create threads for handling user and server frames
-    user_thread = Thread(target=handle_user_input, args=(sock, t_out))
-    user_thread.daemon = True
-    server_thread = Thread(target=handle_server_frames_both, args=(sock,))
-    
-    def handle_ctrl_c(sig, frame):
-        global stop_thread
-        stop_thread = True
-        user_thread.join(timeout=0)
-        server_thread.join(timeout=0)
-        sys.exit(0)
-    signal.signal(signal.SIGINT, handle_ctrl_c)
-
-    # Start the threads
-    user_thread.start()
-    server_thread.start()
-
-    # Wait for server thread but not user thread
-    server_thread.join()
-    
-    if user_thread.is_alive():
-        user_thread.join(timeout=0)
-        
+            message_encoded = message.encode('utf-8')
+        except UnicodeEncodeError:
+            print("Error: Invalid characters detected. Please enter text using a compatible encoding.")
+            sys.stdout.write('> ')
+            sys.stdout.flush()
+            return
+
+        if message:  # Only send if there's actual input
+            if self.stats is not None:
+                message_encoded = self._stamp(message_encoded)
+            self.send(a2lib.wslib.Opcode.TEXT, message_encoded)
+            self._touch()  # Reset timeout
+
 # styling
 def print_color(str, styling):
     # coloring text on console
     # https://www.kaggle.com/discussions/general/273188
     reset = "\033[0m"
-    print(f"{styling}{str}{reset}")
+    if sys.stdout.isatty():
+        print(f"{styling}{str}{reset}")
+    else:
+        print(str)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
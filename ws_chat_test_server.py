@@ -2,35 +2,761 @@
 
 import argparse
 import asyncio
+import math
+import multiprocessing
+import os
+import re
+import shutil
+import signal
 import sys
+import tempfile
+import time
 from asyncio.exceptions import CancelledError, TimeoutError
+from collections import deque
+from itertools import islice
 from http import HTTPStatus
-from typing import List
+from typing import Deque, Dict, Iterator, List, Optional, Set, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
 
 import aioconsole
 import websockets
 from websockets.exceptions import ConnectionClosed
+from websockets.extensions.permessage_deflate import (PerMessageDeflate,
+                                                      ServerPerMessageDeflateFactory)
 
-_consumers: List[websockets.WebSocketClientProtocol] = []
+import a2lib.brokerlib
+import a2lib.federationlib
+import a2lib.loglib
+import a2lib.ratelib
+import a2lib.statslib
+import a2lib.timerlib
+import a2lib.wslib
 
-async def _post_message(msg: str, source: websockets.WebSocketClientProtocol):
-    global _consumers
-    for consumer in _consumers:
-        if not source or consumer != source:
-            await consumer.send(msg)
+ROLES = ["producer", "consumer", "both"]
 
+# Clients pick a room with /<role>/<room>; plain /<role> joins the default room.
+DEFAULT_ROOM = ""
+_ROOM_NAME = re.compile(r"[A-Za-z0-9_.-]{1,64}")
 
-async def _handle_session(websocket: websockets.WebSocketServerProtocol):
+# What to do with a consumer whose outbound queue is full. See _Consumer.enqueue().
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+DISCONNECT = "disconnect"
+_SLOW_CONSUMER_POLICIES = [DROP_OLDEST, DROP_NEWEST, DISCONNECT]
+
+_slow_consumer_policy = DROP_OLDEST
+_max_queue_messages = 1000
+_max_queue_bytes = 1024 * 1024
+
+# The server listens on (and clients connect to) a Unix domain socket given as unix:/path.
+UNIX_PREFIX = "unix:"
+
+# Each room remembers up to this many of its latest messages (and payload bytes) to replay to
+# consumers that join late. Zero disables the replay cache.
+_replay_messages = 1000
+_replay_bytes = 1024 * 1024
+
+# Consumers that negotiate this subprotocol get every message prefixed with "#<seq> ", its
+# sequence number in the room, so they can later ask for a replay "since" it.
+SEQ_SUBPROTOCOL = "chat.seq"
+
+# Consumers that negotiate this one get every message numbered, binary ones included, and send
+# back cumulative acks: text messages holding the last sequence number they've processed. At
+# most _ack_window messages are sent past the last ack; see _Consumer.enqueue().
+ACK_SUBPROTOCOL = "chat.ack"
+_ack_window = 1000
+
+# permessage-deflate settings. Outgoing messages are compressed without context takeover,
+# once per window size rather than once per consumer; see _deflate_bits().
+_deflate = True
+_deflate_min_size = a2lib.wslib.DEFLATE_MIN_SIZE
+_DEFLATE_WINDOW_BITS = 12
+_DEFLATE_MEM_LEVEL = 5
+_deflaters: Dict[int, a2lib.wslib.PerMessageDeflate] = {}
+
+# With --log-dir, every room also appends its messages to a durable log there, offsets being
+# the rooms' sequence numbers, so they survive restarts and consumers can resume from any
+# offset still kept. Appends are written out once per event loop iteration; see _History.
+_log_dir: Optional[str] = None
+_log_settings: Dict[str, Union[int, float, str]] = {}
+_unflushed_logs: Set[a2lib.loglib.MessageLog] = set()
+
+# With --workers, this process's link to the broker shared by all the worker processes.
+_broker: Optional[a2lib.brokerlib.BrokerClient] = None
+
+# Federation with other servers (--peer): this node's ID in message IDs, the counter of
+# messages that originated here, the live links and what has been seen from other origins.
+# A dialing peer sends its node ID in NODE_HEADER, so when it reconnects it gets back the
+# link it had, along with anything that was still queued for it. Links take messages of
+# --max-message-size plus the record overhead, and batches are held to that size.
+PEER_PATH = "/peer"
+NODE_HEADER = "X-Chat-Node"
+_node_id = os.urandom(a2lib.federationlib.NODE_ID_SIZE)
+_originated = 0
+_links: Set[a2lib.federationlib.PeerLink] = set()
+_peer_links: Dict[str, a2lib.federationlib.PeerLink] = {}
+_dedupe = a2lib.federationlib.Deduplicator()
+_max_link_bytes = 1024 * 1024
+_max_link_message = 16 * 1024 * 1024 + a2lib.federationlib.MAX_RECORD_OVERHEAD
+
+# Heartbeats and idle timeouts. With the "wheel" keepalive, one timer wheel ticking every
+# _WHEEL_TICK seconds pings and times out every connection, in batches, instead of websockets
+# running a keepalive task per connection. See _check_connections().
+KEEPALIVE_WHEEL = "wheel"
+KEEPALIVE_WEBSOCKETS = "websockets"
+_WHEEL_TICK = 0.5
+_wheel: Optional[a2lib.timerlib.TimerWheel] = None
+_ping_interval: Optional[float] = 5.0
+_ping_timeout = 20.0
+_idle_timeout = 0.0
+# pings carry no per-connection data, so one serialized frame does for all of them
+_PING = a2lib.wslib.serialize_frame(a2lib.wslib.Frame(a2lib.wslib.Opcode.PING, b"keepalive"),
+                                    mask=False)
+
+# Rate limits on local producers, in messages and bytes a second, each producer on its own
+# (zero for no limit) and all of them together (a bucket, or None for no limit). Bursts of
+# _rate_burst seconds' worth are let through. See _throttle().
+_producer_rate = 0.0
+_producer_byte_rate = 0.0
+_global_messages: Optional[a2lib.ratelib.TokenBucket] = None
+_global_bytes: Optional[a2lib.ratelib.TokenBucket] = None
+_rate_burst = 1.0
+
+# Admission control: the most connections open, and handshakes under way, at once (zero for
+# no limit). Connections past either are turned away with a 503 by _process_request().
+_max_connections = 0
+_max_handshakes = 0
+_connections = 0
+_handshakes = 0
+
+# How often producers were held back by their own limit or the global one, for how long in
+# all, and how many connections were turned away for being over a cap.
+_throttles = {"producer": 0, "global": 0, "seconds": 0.0, "connections": 0, "handshakes": 0}
+
+# Set by --stats. Left as None, instrumentation costs one comparison per message.
+_stats: Optional[a2lib.statslib.Stats] = None
+
+
+class _Connection(websockets.WebSocketServerProtocol):
+    """A server connection that notes when anything (pongs included) last arrived from the
+    peer and when it last carried a message, for _check_connections()."""
+
+    last_seen = 0.0
+    last_active = 0.0
+    ping_sent = 0.0  # when the unanswered ping, if any, went out
+
+    def connection_made(self, transport):
+        global _connections
+        _connections += 1
+        super().connection_made(transport)
+
+    def connection_lost(self, exc):
+        global _connections
+        _connections -= 1
+        super().connection_lost(exc)
+
+    def select_subprotocol(self, client_subprotocols, server_subprotocols):
+        # acks come in as text messages, so only pure consumers can speak chat.ack
+        if _parse_route(self.path) is None or _parse_route(self.path)[0] != "consumer":
+            server_subprotocols = [p for p in server_subprotocols if p != ACK_SUBPROTOCOL]
+        return super().select_subprotocol(client_subprotocols, server_subprotocols)
+
+    async def handshake(self, *args, **kwargs):
+        global _handshakes
+        _handshakes += 1
+        try:
+            return await super().handshake(*args, **kwargs)
+        finally:
+            _handshakes -= 1
+
+    def data_received(self, data: bytes):
+        self.last_seen = time.monotonic()
+        super().data_received(data)
+
+
+class _Message:
+    """A message posted to a room. Each wire format of it is serialized on first use and then
+    shared by every recipient, as well as by the room's replay cache."""
+
+    __slots__ = ("seq", "payload", "binary", "_frames")
+
+    def __init__(self, seq: int, payload: bytes, binary: bool = False):
+        self.seq = seq
+        self.payload = payload
+        self.binary = binary
+        self._frames = {}
+
+    def frame(self, with_seq: bool = False, deflate_bits: Optional[int] = None,
+              binary_seq: bool = False) -> bytes:
+        """The serialized frame(s), optionally prefixed with the sequence number (text only,
+        unless `binary_seq`) and compressed with a window of `deflate_bits`."""
+        key = (with_seq and (binary_seq or not self.binary), deflate_bits)
+        frame = self._frames.get(key)
+        if frame is None:
+            payload = b"#%d %s" % (self.seq, self.payload) if key[0] else self.payload
+            frame = self._frames[key] = _serialize_payload(payload, deflate_bits, self.binary)
+        return frame
+
+
+class _History:
+    """A room's message sequence, plus its latest messages for replay to late joiners.
+
+    The cache is bounded by both _replay_messages and _replay_bytes; sequence numbers are
+    consecutive, so a "since" lookup is an index rather than a search. With a log, every
+    message is also appended to it, and the sequence carries on from where the log ends."""
+
+    def __init__(self, log: Optional[a2lib.loglib.MessageLog] = None):
+        self.log = log
+        self.seq = 0 if log is None else log.next_offset - 1
+        self.messages: Deque[_Message] = deque()
+        self.size = 0
+
+    def append(self, payload: bytes, binary: bool = False) -> _Message:
+        self.seq += 1
+        message = _Message(self.seq, payload, binary)
+        if self.log is not None:
+            self.log.append(self.seq, payload, binary)
+            if not _unflushed_logs:
+                asyncio.get_running_loop().call_soon(_flush_logs)
+            _unflushed_logs.add(self.log)
+        if _replay_messages > 0:
+            self.messages.append(message)
+            self.size += len(payload)
+            while len(self.messages) > _replay_messages or self.size > _replay_bytes:
+                self.size -= len(self.messages.popleft().payload)
+        return message
+
+    def cached(self, seq: int) -> bool:
+        """Whether the cache holds everything after `seq`."""
+        return seq >= self.seq or (bool(self.messages) and self.messages[0].seq <= seq + 1)
+
+    def since(self, seq: int, limit: Optional[int] = None) -> List[_Message]:
+        """The cached messages after `seq`, up to `limit` of them."""
+        if not self.messages:
+            return []
+        start = max(0, seq + 1 - self.messages[0].seq)
+        return list(islice(self.messages, start, None if limit is None else start + limit))
+
+    def after(self, seq: int, limit: int) -> List[_Message]:
+        """Up to `limit` messages after `seq`, from the cache or, if it doesn't go back that
+        far, the log. They start later than `seq` + 1 if neither does."""
+        if self.log is None or self.cached(seq):
+            return self.since(seq, limit)
+        messages = []
+        while len(messages) < limit:
+            records = self.log.read(seq + 1)
+            if not records:
+                break
+            messages += [_Message(offset, bytes(payload), binary)
+                         for (offset, payload, binary) in records[:limit - len(messages)]]
+            seq = messages[-1].seq
+            del records
+        return messages
+
+
+class _Consumer:
+    """The outbound side of a consumer connection.
+
+    _post_message() only appends to the bounded queue; a writer task drains it onto the
+    socket, so one slow consumer can't hold up the producer or the other consumers. The task
+    is only started once something is queued and ends when the queue is empty, so an idle
+    consumer costs no more than this record. Queued items are already serialized frames
+    shared by every consumer.
+
+    A consumer that acks has a window instead of queue limits: it's sent messages up to
+    `window` past its last ack, then paused, and once acks make room it catches up from the
+    room's replay cache and log, so nothing is held for it meanwhile. If messages have left
+    both by then, it's disconnected rather than silently skipping them; only a joining
+    consumer's replay starts past them (and they're counted)."""
+
+    __slots__ = ("websocket", "room", "window", "with_seq", "deflate_bits", "acked_seq",
+                 "sent_seq", "paused", "skipped", "queue", "queued_bytes", "dropped",
+                 "disconnected", "_queued_since", "_writer")
+
+    def __init__(self, websocket: websockets.WebSocketServerProtocol, room: str):
+        self.websocket = websocket
+        self.room = room
+        self.window = _ack_window if websocket.subprotocol == ACK_SUBPROTOCOL else 0
+        self.with_seq = websocket.subprotocol == SEQ_SUBPROTOCOL or self.window > 0
+        self.deflate_bits = _deflate_bits(websocket)
+        self.acked_seq = 0
+        self.sent_seq = 0
+        self.paused = False
+        self.skipped = 0
+        self.queue: Deque[bytes] = deque()
+        self.queued_bytes = 0
+        self.dropped = 0
+        self.disconnected = False
+        self._queued_since = 0
+        self._writer: Optional[asyncio.Task] = None
+
+    def frame(self, message: _Message) -> bytes:
+        return message.frame(self.with_seq, self.deflate_bits, self.window > 0)
+
+    def enqueue(self, message: _Message):
+        if self.disconnected:
+            return
+        if self.window:
+            if self.paused or message.seq - self.acked_seq > self.window:
+                self.paused = True
+                return
+            self.sent_seq = message.seq
+            self._append(self.frame(message))
+            return
+        frame = self.frame(message)
+        size = len(frame)
+        # a message larger than the byte limit still goes through an empty queue
+        if self.queue and (len(self.queue) >= _max_queue_messages
+                           or self.queued_bytes + size > _max_queue_bytes):
+            if _slow_consumer_policy == DROP_NEWEST:
+                self.dropped += 1
+                return
+            elif _slow_consumer_policy == DROP_OLDEST:
+                while self.queue and (len(self.queue) >= _max_queue_messages
+                                      or self.queued_bytes + size > _max_queue_bytes):
+                    self.queued_bytes -= len(self.queue.popleft())
+                    self.dropped += 1
+            else:
+                print(f"{self.websocket.remote_address}: Consumer too slow, disconnecting.")
+                self.close()
+                self.websocket.fail_connection(1013, "Consumer too slow")
+                return
+        self._append(frame)
+
+    def enqueue_replay(self, messages: List[_Message]):
+        """Queues `messages` as a single item, so the whole replay goes out in one write. It's
+        already bounded by the replay cache, so it isn't held to the queue limits."""
+        self._append(b"".join(self.frame(message) for message in messages))
+
+    def start_window(self, seq: int):
+        """Starts the window after `seq`, the message before any replay, as if acked, and
+        queues as much of the replay as the window has room for; acks pull in the rest."""
+        self.acked_seq = self.sent_seq = seq
+        self.paused = True
+        self._catch_up(joining=True)
+
+    def ack(self, seq: int):
+        """Takes a cumulative ack of everything up to `seq`, and sends what the window has
+        room for now if the consumer was paused."""
+        seq = min(seq, self.sent_seq)
+        if seq <= self.acked_seq:
+            return
+        self.acked_seq = seq
+        if self.paused:
+            self._catch_up()
+
+    def _catch_up(self, joining: bool = False):
+        history = _history(self.room)
+        limit = max(0, self.acked_seq + self.window - self.sent_seq)
+        if not limit:
+            return
+        messages = history.after(self.sent_seq, limit)
+        first = messages[0].seq if messages else history.seq + 1
+        if first > self.sent_seq + 1 and not joining:
+            print(f"{self.websocket.remote_address}: Acked consumer fell behind the replay "
+                  f"cache, disconnecting.")
+            self.close()
+            self.websocket.fail_connection(1013, "Messages past the last ack are gone")
+            return
+        if messages:
+            self.skipped += messages[0].seq - self.sent_seq - 1
+            self.enqueue_replay(messages)
+            self.sent_seq = messages[-1].seq
+        elif self.sent_seq < history.seq:
+            self.skipped += history.seq - self.sent_seq
+            self.sent_seq = history.seq
+        self.paused = self.sent_seq < history.seq
+
+    def _append(self, frame: bytes):
+        if _stats is not None and not self.queue:
+            self._queued_since = time.perf_counter_ns()
+        self.queue.append(frame)
+        self.queued_bytes += len(frame)
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_queued())
+
+    def close(self):
+        self.disconnected = True
+        self.queue.clear()
+        self.queued_bytes = 0
+        if self._writer is not None:
+            self._writer.cancel()
+
+    async def _write_queued(self):
+        # Server frames aren't masked, so the bytes on the wire are the same for every consumer
+        # and can go straight to the transport, a whole backlog per write.
+        try:
+            while self.queue:
+                if not self.websocket.open:
+                    break
+                frames = list(self.queue)
+                self.queue.clear()
+                self.queued_bytes = 0
+                self.websocket.transport.writelines(frames)
+                self.websocket.last_active = time.monotonic()
+                if _stats is not None:
+                    # how long the oldest frame of this batch sat in the queue
+                    _stats.histogram("queue_delay_us").record(
+                        (time.perf_counter_ns() - self._queued_since) // 1000)
+                    _stats.count("frames_written", len(frames))
+                await self.websocket.drain()
+        except ConnectionClosed:
+            pass
+        finally:
+            self._writer = None
+        if self.queue:
+            # the connection is gone; stop queueing (and restarting this task) for it
+            self.close()
+
+
+# Subscribers of each room, so a message only costs as much as its own room's audience.
+_rooms: Dict[str, Set[_Consumer]] = {}
+
+def _all_consumers() -> Iterator[_Consumer]:
+    for consumers in _rooms.values():
+        yield from consumers
+
+# Sequence numbers and replay caches of the rooms, kept while a room has no subscribers.
+_histories: Dict[str, _History] = {}
+
+def _history(room: str) -> _History:
+    history = _histories.get(room)
+    if history is None:
+        log = None
+        if _log_dir is not None:
+            log = a2lib.loglib.MessageLog(
+                os.path.join(_log_dir, f"room-{room}" if room else "default"), **_log_settings)
+        history = _histories[room] = _History(log)
+    return history
+
+def _flush_logs():
+    for log in _unflushed_logs:
+        log.flush()
+    _unflushed_logs.clear()
+
+async def _maintain_logs(interval: float):
+    """fsyncs the logs that have gone quiet and applies age retention, which otherwise only
+    happens when a log starts a new segment."""
+    while True:
+        await asyncio.sleep(interval)
+        for history in _histories.values():
+            if history.log is not None:
+                history.log.sync()
+                history.log.apply_retention()
+
+async def _replay_log(consumer: "_Consumer", log: a2lib.loglib.MessageLog, seq: int) -> int:
+    """Streams the logged messages after `seq` straight from the mapped segments to the
+    consumer, a chunk per write, until it's caught up with the log. Returns the last sequence
+    number sent; the caller must subscribe the consumer without awaiting anything first."""
+    websocket = consumer.websocket
+    sent = 0
+    while True:
+        records = log.read(seq + 1)
+        if not records:
+            break
+        websocket.transport.writelines(
+            [consumer.frame(_Message(offset, payload, binary))
+             for (offset, payload, binary) in records])
+        seq = records[-1][0]
+        sent += len(records)
+        del records
+        websocket.last_active = time.monotonic()
+        await websocket.drain()
+    if sent:
+        print(f"{websocket.remote_address}: Replayed {sent} messages from the log.")
+    return seq
+
+def _parse_route(path: str) -> Optional[Tuple[str, str]]:
+    """Splits a request path into (role, room), or returns None if it isn't a valid route."""
+    (role, _, room) = urlsplit(path).path.lstrip("/").partition("/")
+    if role not in ROLES or (room and not _ROOM_NAME.fullmatch(room)):
+        return None
+    return (role, room or DEFAULT_ROOM)
+
+def _parse_replay(path: str, headers) -> Optional[Tuple[str, int]]:
+    """What a consumer asked to have replayed on joining: ("last", N) or ("since", seq), from
+    the "last"/"since" query parameters or the X-Replay-Last/X-Replay-Since headers.
+
+    Returns None if it asked for nothing; raises ValueError if the request is malformed."""
+    query = parse_qs(urlsplit(path).query)
+    for kind in ("last", "since"):
+        value = query[kind][0] if kind in query else headers.get(f"X-Replay-{kind.title()}")
+        if value is not None:
+            value = int(value)
+            if value < 0:
+                raise ValueError(f"negative {kind}")
+            return (kind, value)
+    return None
+
+def _check_connections(connections: List[_Connection]):
+    """Runs when the timer wheel says these connections are due: disconnects those that have
+    been idle or didn't answer a ping, pings those that have been quiet, and sets the next
+    time each needs looking at. Timestamps are only compared here, never rescheduled on
+    traffic, so a busy connection costs nothing until its slot comes round."""
+    now = time.monotonic()
+    for connection in connections:
+        if not connection.open:
+            continue
+        if _idle_timeout and now - connection.last_active >= _idle_timeout:
+            print(f"{connection.remote_address}: Idle for {_idle_timeout}s, disconnecting.")
+            if _stats is not None:
+                _stats.count("idle_timeouts")
+            connection.fail_connection(1001, "Idle timeout")
+            continue
+        delay = math.inf
+        if connection.ping_sent and connection.last_seen >= connection.ping_sent:
+            connection.ping_sent = 0.0  # answered
+        if connection.ping_sent:
+            if now - connection.ping_sent >= _ping_timeout:
+                print(f"{connection.remote_address}: Client timed out!")
+                if _stats is not None:
+                    _stats.count("ping_timeouts")
+                connection.fail_connection(1011, "keepalive ping timeout")
+                continue
+            delay = connection.ping_sent + _ping_timeout - now
+        elif _ping_interval:
+            delay = connection.last_seen + _ping_interval - now
+            if delay <= 0:
+                connection.transport.write(_PING)
+                connection.ping_sent = now
+                # look again when the next ping would be due, or when this one times out
+                delay = min(_ping_interval, _ping_timeout)
+                if _stats is not None:
+                    _stats.count("pings")
+        if _idle_timeout:
+            delay = min(delay, connection.last_active + _idle_timeout - now)
+        if delay != math.inf:
+            _wheel.schedule(connection, delay)
+
+async def _report_queues(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        depths = [len(consumer.queue) for consumer in _all_consumers()]
+        dropped = sum(consumer.dropped for consumer in _all_consumers())
+        print(f"Queues: {len(depths)} consumers in {len(_rooms)} rooms, max depth {max(depths, default=0)}, "
+              f"total queued {sum(depths)}, dropped {dropped}")
+        for consumer in _all_consumers():
+            if consumer.queue:
+                print(f"  {consumer.websocket.remote_address}: {len(consumer.queue)} queued "
+                      f"({consumer.queued_bytes} bytes)")
+
+def _dump_stats():
+    depths = [len(consumer.queue) for consumer in _all_consumers()]
+    print(_stats.report())
+    print(f"  consumers: {len(depths)} in {len(_rooms)} rooms, max queue depth {max(depths, default=0)}")
+    if _producer_rate or _producer_byte_rate or _global_messages or _global_bytes:
+        print(f"  throttled: {_throttles['producer']} by producer limits, {_throttles['global']} by "
+              f"global ones, {_throttles['seconds']:.1f}s in all")
+    if _max_connections or _max_handshakes:
+        print(f"  turned away: {_throttles['connections']} over the connection cap, "
+              f"{_throttles['handshakes']} over the handshake cap")
+    acking = [consumer for consumer in _all_consumers() if consumer.window]
+    if acking:
+        print(f"  acking consumers: {len(acking)}, {sum(c.paused for c in acking)} paused, "
+              f"{sum(c.skipped for c in acking)} messages skipped")
+    if _wheel is not None:
+        print(f"  timer wheel: {len(_wheel)} timeouts, {_wheel.wakeups} ticks, {_wheel.expired} expired")
+    sys.stdout.flush()
+
+async def _report_stats(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        _dump_stats()
+
+def _deflate_bits(websocket: websockets.WebSocketServerProtocol) -> Optional[int]:
+    """The window size to compress messages to this connection with, or None if it didn't
+    negotiate compression. Our side never takes over context, so a compressed frame doesn't
+    depend on what else the consumer was sent and can be shared like any other."""
+    for extension in websocket.extensions:
+        if isinstance(extension, PerMessageDeflate):
+            return extension.local_max_window_bits
+    return None
+
+def _serialize_payload(payload: bytes, deflate_bits: Optional[int] = None,
+                       binary: bool = False) -> bytes:
+    """Serializes a broadcast message once, for all its recipients. Large messages are
+    fragmented, so consumers never need a whole frame of them in memory."""
+    deflate = None
+    if deflate_bits is not None:
+        deflate = _deflaters.get(deflate_bits)
+        if deflate is None:
+            deflate = _deflaters[deflate_bits] = a2lib.wslib.PerMessageDeflate(
+                local_no_context_takeover=True, local_max_window_bits=deflate_bits,
+                min_size=_deflate_min_size, mem_level=_DEFLATE_MEM_LEVEL)
+    opcode = a2lib.wslib.Opcode.BINARY if binary else a2lib.wslib.Opcode.TEXT
+    return a2lib.wslib.serialize_message(opcode, payload, mask=False, deflate=deflate)
+
+def _fan_out(message: _Message, source: Optional[_Consumer], room: str):
+    """Queues `message` for every consumer in `room` but `source` (the sender's own consumer,
+    as a 'both' client). The sender is taken out of the set for the loop and put back, which
+    costs two set operations per message instead of a comparison per recipient."""
+    consumers = _rooms.get(room)
+    if not consumers:
+        return
+    skipped = source is not None and source in consumers
+    if skipped:
+        consumers.discard(source)
+    try:
+        for consumer in consumers:
+            consumer.enqueue(message)
+    finally:
+        if skipped:
+            consumers.add(source)
+
+def _fan_out_brokered(record: bytes):
+    (room, _, payload) = record.partition(b" ")
+    room = room.decode()
+    _fan_out(_history(room).append(payload[1:], payload[:1] == b"b"), None, room)
+
+def _forward(record: bytes, source: Optional[a2lib.federationlib.PeerLink] = None
+             ) -> List[a2lib.federationlib.PeerLink]:
+    """Queues a federation record on every link, except back where it came from, and returns
+    the links it went to."""
+    links = [link for link in _links if link is not source]
+    for link in links:
+        link.forward(record)
+    if _stats is not None:
+        _stats.count("federated_out", len(links))
+    return links
+
+async def _post_message(msg: Union[str, bytes], source: Optional[_Consumer],
+                        room: str = DEFAULT_ROOM):
+    """Posts a text message (str) or a binary one (bytes) to `room`, to every consumer there
+    but the sender's own, `source`."""
+    global _originated
+    binary = isinstance(msg, bytes)
+    payload = msg if binary else msg.encode()
+    _fan_out(_history(room).append(payload, binary), source, room)
+    if _broker is not None:
+        # consumers connected to the other workers get it through the broker, which relays
+        # the payload rather than our frame: every worker numbers the room's messages itself
+        _broker.publish(room.encode() + (b" b" if binary else b" t") + payload)
+        await _broker.drain()
+    if _links:
+        _originated += 1
+        record = a2lib.federationlib.encode_record(_node_id, _originated, room.encode(), payload,
+                                                   binary)
+        # Only local producers wait for links that are too far behind. A relay waiting on its
+        # next link would stop reading the last one, which can deadlock a loop of busy peers;
+        # what's relayed is bounded by what producers somewhere were let through.
+        for link in _forward(record):
+            await link.wait_writable()
+
+async def _receive_federated(link: a2lib.federationlib.PeerLink, batch: bytes):
+    if _stats is not None:
+        _stats.count("federated_batches")
+    for (origin, counter, room, payload, binary) in a2lib.federationlib.decode_batch(batch):
+        link.received += 1
+        if origin == _node_id or _dedupe.seen(origin, counter):
+            if _stats is not None:
+                _stats.count("federated_duplicates")
+            continue
+        if _stats is not None:
+            _stats.count("federated_in")
+        _fan_out(_history(room.decode()).append(payload, binary), None, room.decode())
+        _forward(a2lib.federationlib.encode_record(origin, counter, room, payload, binary), link)
+
+def _peer_name(websocket) -> str:
+    if not websocket.remote_address:
+        return "unix socket"
+    return f"{websocket.remote_address[0]}:{websocket.remote_address[1]}"
+
+def _new_link(websocket, name: str) -> a2lib.federationlib.PeerLink:
+    return a2lib.federationlib.PeerLink(websocket, name, _max_link_bytes, _max_link_message)
+
+async def _run_link(link: a2lib.federationlib.PeerLink):
+    """Runs `link` over its current connection. It's only forwarded to while that's up; what
+    it still had queued when the connection closed is resent over the next one."""
+    link.websocket.max_size = _max_link_message
+    _links.add(link)
+    print(f"Federation link to {link.name} up.")
+    try:
+        await link.run(_receive_federated)
+    finally:
+        _links.discard(link)
+        print(f"Federation link to {link.name} down ({link.forwarded} forwarded, "
+              f"{link.received} received, {link.pending} queued).")
+
+async def _connect_peer(peer: str):
+    """Keeps a link open to `peer` (host:port), reconnecting with a growing delay."""
+    link = _new_link(None, peer)
+    delay = 0.5
+    while True:
+        try:
+            async with websockets.connect(f"ws://{peer}{PEER_PATH}",
+                                          open_timeout=10, max_size=_max_link_message,
+                                          extra_headers={NODE_HEADER: _node_id.hex()}) as websocket:
+                delay = 0.5
+                link.websocket = websocket
+                await _run_link(link)
+        except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake, ConnectionClosed):
+            pass
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30.0)
+
+
+async def _handle_session(websocket: _Connection):
     print(f'{websocket.remote_address}: Client connected as {websocket.path}')
+    websocket.last_seen = websocket.last_active = time.monotonic()
+    if websocket.path == PEER_PATH:
+        websocket.last_active = math.inf  # federation links are never idle
+        if _wheel is not None:
+            _check_connections([websocket])
+        node = websocket.request_headers.get(NODE_HEADER)
+        link = _peer_links.get(node) if node else None
+        if link is None or link in _links:
+            link = _new_link(websocket, _peer_name(websocket))
+            if node:
+                _peer_links[node] = link
+        link.websocket = websocket
+        try:
+            await _run_link(link)
+        except ConnectionClosed:
+            pass
+        finally:
+            if _wheel is not None:
+                _wheel.cancel(websocket)
+        return
+    if _wheel is not None:
+        _check_connections([websocket])
 
+    (role, room) = _parse_route(websocket.path)
+    consumer = None
     try:
-        if websocket.path in ["/consumer", "/both"]:
-            _consumers.append(websocket)
+        if role in ["consumer", "both"]:
+            consumer = _Consumer(websocket, room)
+            replay = _parse_replay(websocket.path, websocket.request_headers)
+            history = _history(room)
+            start = history.seq
+            if replay is not None:
+                (kind, value) = replay
+                start = max(0, history.seq - value) if kind == "last" else value
+            if consumer.window:
+                # the replay is held to the window like everything after it
+                consumer.start_window(min(start, history.seq))
+            elif replay is not None:
+                seq = start
+                if history.log is not None and not history.cached(seq):
+                    seq = await _replay_log(consumer, history.log, seq)
+                messages = history.since(seq)
+                if messages:
+                    print(f"{websocket.remote_address}: Replaying {len(messages)} messages.")
+                    consumer.enqueue_replay(messages)
+            # no await since the replay was queued, so nothing posted meanwhile is missed
+            _rooms.setdefault(room, set()).add(consumer)
         
-        if websocket.path in ["/producer", "/both"]:
-            await _handle_producer_session(websocket)
+        if role in ["producer", "both"]:
+            await _handle_producer_session(websocket, room, consumer)
         else:
-            await websocket.wait_closed()
+            if consumer.window:
+                async for ack in websocket:
+                    try:
+                        seq = int(ack)
+                    except (TypeError, ValueError):
+                        continue  # not an ack
+                    consumer.ack(seq)
+            else:
+                await websocket.wait_closed()
             print(f"{websocket.remote_address}: Consumer closed.")
 
     except TimeoutError:
@@ -43,53 +769,346 @@ async def _handle_session(websocket: websockets.WebSocketServerProtocol):
     except Exception as e:
         print(e)
     finally:
-        if websocket in _consumers:
-            _consumers.remove(websocket)
+        if consumer is not None:
+            subscribers = _rooms.get(room)
+            if subscribers is not None:
+                subscribers.discard(consumer)
+                if not subscribers:
+                    del _rooms[room]
+            consumer.close()
+        if _wheel is not None:
+            _wheel.cancel(websocket)
         if not websocket.closed:
             await websocket.close(reason="")
 
-async def _handle_producer_session(websocket: websockets.WebSocketServerProtocol):
-    closing = False
-    while not closing:
+def _bucket(rate: float) -> Optional[a2lib.ratelib.TokenBucket]:
+    return a2lib.ratelib.TokenBucket(rate, rate * _rate_burst) if rate > 0 else None
+
+async def _throttle(messages: Optional[a2lib.ratelib.TokenBucket],
+                    data: Optional[a2lib.ratelib.TokenBucket], size: int):
+    """Charges a producer's message of `size` bytes to its own buckets and the global ones,
+    and waits out any debt before the producer's next message is read. Meanwhile websockets
+    stops reading its socket once its receive queue is full, which a limited producer's is at
+    one message (see _handle_producer_session()), so the producer is pushed back on through
+    TCP rather than buffered for."""
+    now = time.monotonic()
+    own = shared = 0.0
+    for (bucket, amount) in [(messages, 1), (data, size)]:
+        if bucket is not None:
+            own = max(own, bucket.charge(amount, now))
+    for (bucket, amount) in [(_global_messages, 1), (_global_bytes, size)]:
+        if bucket is not None:
+            shared = max(shared, bucket.charge(amount, now))
+    delay = max(own, shared)
+    if delay > 0.0:
+        _throttles["producer" if own >= shared else "global"] += 1
+        _throttles["seconds"] += delay
+        if _stats is not None:
+            _stats.count("throttled")
+            _stats.histogram("throttle_us").record(int(delay * 1e6))
+        await asyncio.sleep(delay)
+
+async def _handle_producer_session(websocket: websockets.WebSocketServerProtocol,
+                                   room: str = DEFAULT_ROOM, consumer: Optional[_Consumer] = None):
+    limited = bool(_producer_rate or _producer_byte_rate or _global_messages or _global_bytes)
+    messages = _bucket(_producer_rate)
+    data = _bucket(_producer_byte_rate)
+    if limited:
+        # websockets would otherwise read ahead up to 32 messages while this one is throttled
+        websocket.max_queue = 1
+    while True:
         msg = await websocket.recv()
+        websocket.last_active = time.monotonic()
+        print(f'Received message from {websocket.remote_address}.')
+        if limited:
+            # what the producer sent, not the address prefixed to it below
+            size = len(msg) if isinstance(msg, bytes) else len(msg.encode())
         if isinstance(msg, str):
-            print(f'Received message from {websocket.remote_address}.')
-            msg = f'{websocket.remote_address[:2]}: {msg}'
-            await _post_message(msg, websocket)
+            # Unix domain socket clients have no address to show
+            msg = f'{websocket.remote_address[:2] or "unix"}: {msg}'
+        # binary messages (files, records) are relayed exactly as they were sent
+        if _stats is None:
+            await _post_message(msg, consumer, room)
         else:
-            await websocket.send("Server only accepts text data! Closing connection.")
-            closing = True
+            received = time.perf_counter_ns()
+            await _post_message(msg, consumer, room)
+            _stats.histogram("fanout_us").record((time.perf_counter_ns() - received) // 1000)
+            _stats.count("messages")
+        if limited:
+            await _throttle(messages, data, size)
 
 async def _process_request(path, request_headers):
     print(path, request_headers)
-    if path not in ["/producer", "/consumer", "/both"]:
-        msg = "Improper route. Must be one of \"/producer\", \"/consumer\", or \"/both\""
+    # both counts include this connection
+    for (cap, count, kind) in [(_max_connections, _connections, "connections"),
+                               (_max_handshakes, _handshakes, "handshakes")]:
+        if cap and count > cap:
+            _throttles[kind] += 1
+            msg = f"Too many {kind}, try again later."
+            return (HTTPStatus.SERVICE_UNAVAILABLE,
+                    {'Content-Length': len(msg), 'Retry-After': '1'}, msg.encode())
+    if path == PEER_PATH:
+        return None
+    if _parse_route(path) is None:
+        msg = ("Improper route. Must be one of \"/producer\", \"/consumer\", or \"/both\", "
+               "optionally followed by \"/<room>\"")
+        return (HTTPStatus.BAD_REQUEST, {'Content-Length': len(msg)}, msg.encode())
+    try:
+        _parse_replay(path, request_headers)
+    except ValueError:
+        msg = "Improper replay request. \"last\" and \"since\" take a non-negative integer."
         return (HTTPStatus.BAD_REQUEST, {'Content-Length': len(msg)}, msg.encode())
     return None
 
 
+async def _serve(args, broker_path: Optional[str] = None):
+    """Runs the chat server in this process. As one of several --workers, the listening port
+    is shared through SO_REUSEPORT and messages are exchanged through the broker."""
+    global _broker
+    if broker_path is not None:
+        _broker = a2lib.brokerlib.BrokerClient(_fan_out_brokered)
+        await _broker.connect(broker_path)
+
+    # compression=None drops websockets' own deflate settings in favour of ours
+    extensions = None
+    if _deflate:
+        extensions = [ServerPerMessageDeflateFactory(
+            server_no_context_takeover=True, server_max_window_bits=_DEFLATE_WINDOW_BITS,
+            compress_settings={"memLevel": _DEFLATE_MEM_LEVEL})]
+    options = dict(process_request = _process_request,
+                   create_protocol = _Connection,
+                   ping_interval = None if _wheel is not None else args.ping_interval,
+                   ping_timeout = None if _wheel is not None else args.timeout,
+                   server_header = "test_chat_server/1.0",
+                   subprotocols = [ACK_SUBPROTOCOL, SEQ_SUBPROTOCOL, "chat"],
+                   compression = None,
+                   max_size = args.max_message_size,
+                   extensions = extensions)
+    if isinstance(args.port, str):
+        # asyncio replaces a socket file left behind by an earlier run
+        serve = websockets.unix_serve(_handle_session, args.port, **options)
+    else:
+        serve = websockets.serve(_handle_session, '', args.port,
+                                 reuse_port = broker_path is not None, **options)
+    async with serve as server:
+        if isinstance(args.port, str):
+            where = f"socket {args.port}"
+        else:
+            # with port 0, every address family gets its own random port
+            where = "port " + ", ".join(sorted({str(sock.getsockname()[1]) for sock in server.sockets}))
+        print(
+            f'Started chat server on {where}. Accepting connections...', flush=True)
+        if args.queue_report > 0.0:
+            reporter = asyncio.create_task(_report_queues(args.queue_report))
+        if _wheel is not None:
+            _wheel.start()
+        peers = [asyncio.create_task(_connect_peer(peer)) for peer in args.peer]
+        if _stats is not None:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, _dump_stats)
+            if args.stats_interval > 0.0:
+                stats_reporter = asyncio.create_task(_report_stats(args.stats_interval))
+        # only the interval policy leaves writes to fsync later, and only age retention needs a clock
+        if _log_dir is not None and (args.log_fsync == a2lib.loglib.FSYNC_INTERVAL
+                                     or args.log_retention_seconds > 0.0):
+            log_maintainer = asyncio.create_task(_maintain_logs(args.log_fsync_interval))
+
+        try:
+            await asyncio.Future()
+        finally:
+            for history in _histories.values():
+                if history.log is not None:
+                    history.log.close()
+            if isinstance(args.port, str):
+                try:
+                    os.remove(args.port)
+                except FileNotFoundError:
+                    pass
+
+def _configure(args):
+    global _slow_consumer_policy, _max_queue_messages, _max_queue_bytes, _stats
+    global _replay_messages, _replay_bytes, _deflate, _deflate_min_size, _max_link_bytes, _max_link_message
+    global _wheel, _ping_interval, _ping_timeout, _idle_timeout, _log_dir, _log_settings
+    global _producer_rate, _producer_byte_rate, _global_messages, _global_bytes, _rate_burst
+    global _max_connections, _max_handshakes, _ack_window
+    _slow_consumer_policy = args.slow_consumer
+    _max_queue_messages = args.max_queue_messages
+    _max_queue_bytes = args.max_queue_bytes
+    _replay_messages = args.replay_messages
+    _replay_bytes = args.replay_bytes
+    _deflate = not args.no_deflate
+    _deflate_min_size = args.deflate_min_size
+    _max_link_bytes = args.max_link_bytes
+    _max_link_message = args.max_message_size + a2lib.federationlib.MAX_RECORD_OVERHEAD
+    _ping_interval = args.ping_interval
+    _ping_timeout = args.timeout
+    _idle_timeout = args.idle_timeout
+    _ack_window = args.ack_window
+    _rate_burst = args.rate_burst
+    _producer_rate = args.producer_rate
+    _producer_byte_rate = args.producer_byte_rate
+    _global_messages = _bucket(args.global_rate)
+    _global_bytes = _bucket(args.global_byte_rate)
+    _max_connections = args.max_connections
+    _max_handshakes = args.max_handshakes
+    _log_dir = args.log_dir
+    _log_settings = {"segment_bytes": args.log_segment_bytes, "fsync": args.log_fsync,
+                     "fsync_interval": args.log_fsync_interval,
+                     "retention_bytes": args.log_retention_bytes,
+                     "retention_seconds": args.log_retention_seconds}
+    if args.keepalive == KEEPALIVE_WHEEL:
+        _wheel = a2lib.timerlib.TimerWheel(_check_connections, _WHEEL_TICK)
+    if args.stats:
+        _stats = a2lib.statslib.Stats()
+
+def _run_worker(args, broker_path: str):
+    _configure(args)
+    try:
+        asyncio.run(_serve(args, broker_path))
+    except KeyboardInterrupt:
+        pass
+
+async def _run_workers(args):
+    """Starts --workers server processes, all accepting on the same port, plus the broker
+    that relays messages between them."""
+    broker_dir = tempfile.mkdtemp(prefix="chat-broker-")
+    broker_path = os.path.join(broker_dir, "broker.sock")
+    broker_server = await a2lib.brokerlib.Broker().serve(broker_path)
+
+    # spawn, not fork: the children must not inherit this process's running event loop
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=_run_worker, args=(args, broker_path), daemon=True)
+               for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    print(f'Started {args.workers} workers on port {args.port}.', flush=True)
+
+    loop = asyncio.get_running_loop()
+    # pass SIGUSR1 on, so --stats dumps come from every worker
+    loop.add_signal_handler(signal.SIGUSR1,
+                            lambda: [os.kill(worker.pid, signal.SIGUSR1) for worker in workers])
+    # and don't leave the workers behind on SIGTERM
+    terminated = loop.create_future()
+    loop.add_signal_handler(signal.SIGTERM, terminated.set_result, None)
+    try:
+        joins = [loop.run_in_executor(None, worker.join) for worker in workers]
+        await asyncio.wait(joins + [terminated], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for worker in workers:
+            worker.terminate()
+        broker_server.close()
+        shutil.rmtree(broker_dir, ignore_errors=True)
+
+def _endpoint(value: str) -> Union[int, str]:
+    """A port number, or the path of a Unix domain socket given as unix:/path."""
+    if value.startswith(UNIX_PREFIX):
+        if not value[len(UNIX_PREFIX):]:
+            raise argparse.ArgumentTypeError("unix: needs a socket path")
+        return value[len(UNIX_PREFIX):]
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a port or unix:/path: {value!r}")
+
 async def main(argv):
     parser = argparse.ArgumentParser(description="Chat server.")
-    parser.add_argument('port', type=int,
-                        help="the port to bind to. Setting to 0 will randomly assign.")
+    parser.add_argument('port', type=_endpoint, metavar="port",
+                        help="the port to bind to, or unix:/path to listen on a Unix domain socket instead. "
+                             "Setting to 0 will randomly assign.")
     parser.add_argument('-p', '--ping-interval', type=float, default=5.0,
                     help="the ping interval in seconds. Defaults to 5.0. A zero or negative value disables pinging.")
     parser.add_argument('-t', '--timeout', type=float, default=20.0,
                         help="the connecion timeout in seconds. Defaults to 20.0.")
+    parser.add_argument('--idle-timeout', type=float, default=0.0,
+                        help="disconnect clients that haven't sent or been sent a message for this many seconds. "
+                             "Disabled by default; needs --keepalive wheel.")
+    parser.add_argument('--keepalive', choices=[KEEPALIVE_WHEEL, KEEPALIVE_WEBSOCKETS], default=KEEPALIVE_WHEEL,
+                        help="what drives pings: one timer wheel for all connections, or websockets' task per "
+                             "connection. Defaults to wheel.")
+    parser.add_argument('--slow-consumer', choices=_SLOW_CONSUMER_POLICIES, default=DROP_OLDEST,
+                        help="what to do when a consumer's outbound queue is full. Defaults to drop-oldest.")
+    parser.add_argument('--max-queue-messages', type=int, default=1000,
+                        help="the most messages queued per consumer. Defaults to 1000.")
+    parser.add_argument('--max-queue-bytes', type=int, default=1024 * 1024,
+                        help="the most bytes queued per consumer. Defaults to 1 MiB.")
+    parser.add_argument('--ack-window', type=int, default=1000,
+                        help="the most messages sent to an acking consumer past its last ack. Defaults to 1000.")
+    parser.add_argument('--replay-messages', type=int, default=1000,
+                        help="the most messages each room keeps for replay to late joiners. Defaults to 1000; 0 disables replay.")
+    parser.add_argument('--replay-bytes', type=int, default=1024 * 1024,
+                        help="the most payload bytes each room keeps for replay. Defaults to 1 MiB.")
+    parser.add_argument('--log-dir',
+                        help="keep a durable log of every room's messages in this directory, to resume from "
+                             "after a restart. Disabled by default.")
+    parser.add_argument('--log-segment-bytes', type=int, default=64 * 1024 * 1024,
+                        help="start a new log segment file after this many bytes. Defaults to 64 MiB.")
+    parser.add_argument('--log-fsync', choices=a2lib.loglib.FSYNC_POLICIES, default=a2lib.loglib.FSYNC_INTERVAL,
+                        help="when to fsync the log: after every write, at most every --log-fsync-interval, "
+                             "or never. Defaults to interval.")
+    parser.add_argument('--log-fsync-interval', type=float, default=1.0,
+                        help="seconds between fsyncs of the log with --log-fsync interval, and between "
+                             "--log-retention-seconds checks. Defaults to 1.0.")
+    parser.add_argument('--log-retention-bytes', type=int, default=0,
+                        help="delete a room's oldest log segments once its log is over this size. "
+                             "Disabled by default.")
+    parser.add_argument('--log-retention-seconds', type=float, default=0.0,
+                        help="delete log segments last written this many seconds ago. Disabled by default.")
+    parser.add_argument('--max-message-size', type=int, default=16 * 1024 * 1024,
+                        help="the largest message accepted from a producer. Defaults to 16 MiB.")
+    parser.add_argument('--no-deflate', action="store_true",
+                        help="don't negotiate permessage-deflate compression with clients.")
+    parser.add_argument('--deflate-min-size', type=int, default=a2lib.wslib.DEFLATE_MIN_SIZE,
+                        help=f"send shorter messages uncompressed. Defaults to {a2lib.wslib.DEFLATE_MIN_SIZE}.")
+    parser.add_argument('--producer-rate', type=float, default=0.0,
+                        help="the most messages a second each producer may send on average. Unlimited by default.")
+    parser.add_argument('--producer-byte-rate', type=float, default=0.0,
+                        help="the most bytes a second each producer may send on average. Unlimited by default.")
+    parser.add_argument('--global-rate', type=float, default=0.0,
+                        help="the most messages a second all producers together may send on average. "
+                             "Unlimited by default.")
+    parser.add_argument('--global-byte-rate', type=float, default=0.0,
+                        help="the most bytes a second all producers together may send on average. "
+                             "Unlimited by default.")
+    parser.add_argument('--rate-burst', type=float, default=1.0,
+                        help="the rate limits let through bursts of this many seconds' worth. Defaults to 1.0.")
+    parser.add_argument('--max-connections', type=int, default=0,
+                        help="turn away connections past this many open ones with a 503. Unlimited by default.")
+    parser.add_argument('--max-handshakes', type=int, default=0,
+                        help="turn away connections past this many handshakes under way with a 503. "
+                             "Unlimited by default.")
+    parser.add_argument('--queue-report', type=float, default=0.0,
+                        help="print consumer queue depths every this many seconds. Disabled by default.")
+    parser.add_argument('--stats', action="store_true",
+                        help="record fan-out and queueing latency. Dumped on SIGUSR1 and with --stats-interval.")
+    parser.add_argument('--stats-interval', type=float, default=0.0,
+                        help="with --stats, dump the statistics every this many seconds. Disabled by default.")
+    parser.add_argument('--peer', action="append", default=[], metavar="HOST:PORT",
+                        help="federate with the server at HOST:PORT. May be repeated.")
+    parser.add_argument('--max-link-bytes', type=int, default=1024 * 1024,
+                        help="the most bytes queued per federation link before forwarding waits. Defaults to 1 MiB.")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="the number of server processes sharing the port. Defaults to 1.")
 
     args = parser.parse_args(argv)
     if args.ping_interval <= 0.0:
         args.ping_interval = None
+    if args.workers > 1 and args.port == 0:
+        parser.error("--workers needs a fixed port")
+    if args.workers > 1 and isinstance(args.port, str):
+        parser.error("--workers needs a TCP port")
+    if args.idle_timeout > 0.0 and args.keepalive != KEEPALIVE_WHEEL:
+        parser.error("--idle-timeout needs --keepalive wheel")
+    if args.workers > 1 and args.peer:
+        parser.error("--peer can't be combined with --workers")
+    if args.log_fsync_interval <= 0.0:
+        parser.error("--log-fsync-interval must be positive")
+    if args.workers > 1 and args.log_dir:
+        parser.error("--log-dir can't be combined with --workers")
 
-    async with websockets.serve(_handle_session, '', args.port, 
-                                process_request = _process_request,
-                                ping_interval = args.ping_interval,
-                                ping_timeout= args.timeout,
-                                server_header = "test_chat_server/1.0"):
-        print(
-            f'Started chat server on port {args.port}. Accepting connections...')
-
-        await asyncio.Future()
+    if args.workers > 1:
+        await _run_workers(args)
+    else:
+        _configure(args)
+        await _serve(args)
 
 if __name__ == "__main__":
     try: